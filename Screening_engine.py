@@ -0,0 +1,435 @@
+import os
+import re
+import pickle
+import hashlib
+import threading
+import logging
+from collections import namedtuple, deque
+import ahocorasick
+
+from Prompt_injection import prompt_injection_keywords
+import Sensitive_word_screening
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CATEGORY_INJECTION = "prompt_injection"
+# 敏感词按词表文件名细分类别（如 "pol"、"ad"），CATEGORY_SENSITIVE 表示其中任意一个
+CATEGORY_SENSITIVE = "sensitive"
+
+# 这些类别按子串匹配，其余类别套用 ASCII 单词边界（与 flashtext 行为一致）
+SUBSTRING_CATEGORIES = frozenset({CATEGORY_INJECTION})
+
+# 命中结果: 文本中的区间 [start, end)、命中的词以及所属类别
+ScreenHit = namedtuple("ScreenHit", ["start", "end", "word", "categories"])
+
+# 只折叠 ASCII 大小写，保证文本长度不变、区间可以直接映射回原文
+_ASCII_LOWER = str.maketrans(
+    "ABCDEFGHIJKLMNOPQRSTUVWXYZ",
+    "abcdefghijklmnopqrstuvwxyz"
+)
+# screen_many 拼接文本时使用的分隔符（Unicode 非字符，不会出现在词库中）
+_SEPARATOR = "\uffff"
+_NON_BMP = re.compile("[\U00010000-\U0010FFFF]")
+
+# 构建好的自动机缓存在敏感词快照旁边，按快照摘要和提示注入关键词校验；
+# 之后启动时直接载入，不再逐词构建
+ENGINE_CACHE_FILE = os.path.splitext(Sensitive_word_screening.SNAPSHOT_FILE)[0] + ".engine"
+_CACHE_MAGIC = b"SCRENG01"
+
+
+def _encode(text):
+    """把每个字符拆成两个 8 位单元（UTF-16 字节）再交给自动机
+
+    pyahocorasick 在节点内线性查找子节点，中文词库的根节点有数千个分支，
+    拆分后每个节点最多 256 个分支，扫描速度提高约一个数量级。
+    """
+    return text.encode('utf-16-be').decode('latin-1')
+
+
+def _pair_map(text):
+    """含 BMP 以外字符时，返回 UTF-16 码元下标到字符下标的映射（续接码元为 -1）"""
+    if not _NON_BMP.search(text):
+        return None
+    mapping = []
+    for index, char in enumerate(text):
+        mapping.append(index)
+        if ord(char) > 0xFFFF:
+            mapping.append(-1)
+    mapping.append(len(text))
+    return mapping
+
+
+def _is_word_char(char):
+    return char in Sensitive_word_screening.NON_WORD_BOUNDARIES
+
+
+class ScreeningEngine:
+    """提示注入与敏感词的合并检测引擎
+
+    两套词表带类别标签装入同一个 Aho-Corasick 自动机，对文本只扫描一遍
+    即可得到全部命中及其区间。自动机中每个词只存一个整数编号，词和类别在命中时
+    才从 mmap 的敏感词快照中读取，堆上不为每个词保留字符串和元组。
+    """
+
+    def __init__(self, matcher=None, keywords=None, cache_path=None):
+        """matcher 为敏感词快照（默认全局 kp），keywords 为提示注入关键词；
+        cache_path 不为 None 时优先从该文件载入自动机，不存在或已过期时构建后写入
+        """
+        try:
+            self.matcher = matcher if matcher is not None else Sensitive_word_screening.kp
+            self.keywords = list(prompt_injection_keywords if keywords is None else keywords)
+            self._resolved = {}
+            self.loaded_from_cache = False
+            cache_key = self._cache_key()
+            automaton = self._load_cache(cache_path, cache_key) if cache_path else None
+            if automaton is None:
+                automaton = self._build()
+                if cache_path:
+                    self._save_cache(cache_path, cache_key, automaton)
+            else:
+                self.loaded_from_cache = True
+            self.automaton = automaton
+            stats = automaton.get_stats()
+            self.word_count = stats["words_count"]
+            # 键按 UTF-16 码元拆成两个单元，最长词的码元数不小于其字符数
+            self.max_word_length = stats["longest_word"] // 2
+        except Exception as e:
+            logger.error(f"ScreeningEngine 初始化失败: {str(e)}")
+            raise
+
+    def _build(self):
+        """编号 = (引用 << 1) | 是否为提示注入关键词；引用小于快照词数时指向快照中的词，
+        否则指向 keywords 中的第 (引用 - 快照词数) 个"""
+        matcher = self.matcher
+        automaton = ahocorasick.Automaton(ahocorasick.STORE_INTS)
+        # 与 flashtext 一致：大小写冲突时后加入的原词覆盖前者（快照中该词的类别已是所有冲突词的并集）
+        for word_id in range(matcher.word_count):
+            key = matcher.get_word(word_id).translate(_ASCII_LOWER)
+            if key.strip() and _SEPARATOR not in key:
+                automaton.add_word(_encode(key), word_id << 1)
+        for index, word in enumerate(self.keywords):
+            key = word.translate(_ASCII_LOWER)
+            if not key.strip() or _SEPARATOR in key:
+                continue
+            encoded = _encode(key)
+            existing = automaton.get(encoded, None)
+            if existing is None:
+                automaton.add_word(encoded, (matcher.word_count + index) << 1 | 1)
+            else:
+                automaton.add_word(encoded, existing | 1)
+        automaton.make_automaton()
+        return automaton
+
+    def _cache_key(self):
+        digest = hashlib.sha256(_CACHE_MAGIC)
+        digest.update(self.matcher.digest)
+        digest.update("\0".join(self.keywords).encode("utf-8"))
+        return digest.digest()
+
+    @staticmethod
+    def _load_cache(path, cache_key):
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        prefix = _CACHE_MAGIC + cache_key
+        if not data.startswith(prefix):
+            logger.info("检测引擎缓存已过期，重新构建")
+            return None
+        try:
+            return pickle.loads(data[len(prefix):])
+        except Exception as e:
+            logger.warning(f"检测引擎缓存无法读取，重新构建: {str(e)}")
+            return None
+
+    @staticmethod
+    def _save_cache(path, cache_key, automaton):
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(_CACHE_MAGIC + cache_key)
+                pickle.dump(automaton, f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        except Exception as e:
+            logger.warning(f"写入检测引擎缓存失败: {str(e)}")
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _resolve(self, value):
+        """编号 -> (键的码元单元数, 原词, 类别元组)，结果按编号缓存"""
+        resolved = self._resolved.get(value)
+        if resolved is None:
+            ref, injection = value >> 1, value & 1
+            if ref < self.matcher.word_count:
+                word = self.matcher.get_word(ref)
+                categories = self.matcher.get_categories(ref)
+                if injection:
+                    categories = (CATEGORY_INJECTION,) + categories
+            else:
+                word = self.keywords[ref - self.matcher.word_count]
+                categories = (CATEGORY_INJECTION,)
+            resolved = (len(_encode(word)), word, categories)
+            self._resolved[value] = resolved
+        return resolved
+
+    @staticmethod
+    def _filter_categories(text, start, end, categories, lo, hi):
+        """按类别检查单词边界，返回仍然成立的类别；lo/hi 为所在文本在 text 中的范围"""
+        for category in categories:
+            if category not in SUBSTRING_CATEGORIES:
+                break
+        else:
+            return categories
+        bounded = (
+            (start == lo or not (_is_word_char(text[start]) and _is_word_char(text[start - 1]))) and
+            (end == hi or not (_is_word_char(text[end - 1]) and _is_word_char(text[end])))
+        )
+        if bounded:
+            return categories
+        return tuple(c for c in categories if c in SUBSTRING_CATEGORIES)
+
+    def _iter_matches(self, lowered):
+        """扫描已折叠大小写的文本，按结束位置递增产出 (start, end, word, categories)"""
+        mapping = _pair_map(lowered)
+        for end_idx, value in self.automaton.iter(_encode(lowered)):
+            length, word, categories = self._resolve(value)
+            end_unit = end_idx + 1
+            start_unit = end_unit - length
+            # 起点落在字符中间的是跨字符的伪匹配
+            if start_unit & 1:
+                continue
+            if mapping is None:
+                yield start_unit >> 1, end_unit >> 1, word, categories
+            else:
+                start = mapping[start_unit >> 1]
+                if start < 0:
+                    continue
+                yield start, mapping[end_unit >> 1], word, categories
+
+    def screen(self, text):
+        """单次扫描文本，返回全部命中（按结束位置排序）"""
+        hits = []
+        if not text:
+            return hits
+        lowered = text.translate(_ASCII_LOWER)
+        text_len = len(lowered)
+        for start, end, word, categories in self._iter_matches(lowered):
+            categories = self._filter_categories(lowered, start, end, categories, 0, text_len)
+            if categories:
+                hits.append(ScreenHit(start, end, word, categories))
+        return hits
+
+    def screen_many(self, texts):
+        """批量检测：把所有文本拼接后只调用一次自动机，返回与输入对应的命中列表"""
+        texts = [text or "" for text in texts]
+        results = [[] for _ in texts]
+        if not texts:
+            return results
+
+        # ends[i] 为第 i 段文本在拼接串中的结束位置
+        ends = []
+        position = 0
+        for text in texts:
+            position += len(text)
+            ends.append(position)
+            position += len(_SEPARATOR)
+        joined = _SEPARATOR.join(texts).translate(_ASCII_LOWER)
+
+        # 命中按结束位置递增返回，且不会跨越分隔符，只需单调推进当前文本下标
+        index = 0
+        offset = 0
+        for start, end, word, categories in self._iter_matches(joined):
+            while end > ends[index]:
+                offset = ends[index] + len(_SEPARATOR)
+                index += 1
+            categories = self._filter_categories(joined, start, end, categories, offset, ends[index])
+            if categories:
+                results[index].append(ScreenHit(start - offset, end - offset, word, categories))
+        return results
+
+
+    def stream(self):
+        """创建一个流式检测器，用于逐块检测模型输出"""
+        return StreamScreener(self)
+
+
+class StreamScreener:
+    """流式检测器：在多个文本块之间延续自动机状态
+
+    每个块只扫描一次（O(块长)），能发现跨越块边界的词，命中区间为整段
+    输出中的全局字符位置。末尾恰好停在块边界、需要下一个字符才能确认
+    单词边界的命中会延迟到下一块（或 finish）时报告。
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._iter = None
+        self._chars = 0          # 已消费的字符数
+        self._units = 0          # 已消费的 UTF-16 码元对数
+        self._pair_maps = deque()  # 最近各块的 (码元起点, 字符起点, 映射或 None)
+        self._tail = ""          # 最近的文本（已折叠大小写），用于边界判断
+        self._tail_start = 0     # _tail 第一个字符的全局位置
+        self._pending = []       # 等待下一个字符确认边界的命中
+
+    def _char_at_pair(self, pair_index):
+        for unit_start, char_start, mapping in reversed(self._pair_maps):
+            if pair_index >= unit_start:
+                if mapping is None:
+                    return char_start + pair_index - unit_start
+                local = mapping[pair_index - unit_start]
+                return -1 if local < 0 else char_start + local
+        return -1
+
+    def _char(self, index):
+        local = index - self._tail_start
+        if 0 <= local < len(self._tail):
+            return self._tail[local]
+        return ""
+
+    def _resolve(self, start, end, word, categories, final=False):
+        """判断单词边界，返回命中、None（不成立）或 False（需等待下一个字符）"""
+        needs_boundary = any(c not in SUBSTRING_CATEGORIES for c in categories)
+        if needs_boundary:
+            if end == self._chars and not final and _is_word_char(self._char(end - 1)):
+                return False
+            bounded = (
+                (start == 0 or not (_is_word_char(self._char(start)) and _is_word_char(self._char(start - 1)))) and
+                (end == self._chars or not (_is_word_char(self._char(end - 1)) and _is_word_char(self._char(end))))
+            )
+            if not bounded:
+                categories = tuple(c for c in categories if c in SUBSTRING_CATEGORIES)
+                if not categories:
+                    return None
+        return ScreenHit(start, end, word, categories)
+
+    def feed(self, chunk):
+        """检测一个新文本块，返回本次确认的命中列表"""
+        if not chunk:
+            return []
+        lowered = chunk.translate(_ASCII_LOWER)
+        mapping = _pair_map(lowered)
+        pairs = len(lowered) if mapping is None else len(mapping) - 1
+        self._pair_maps.append((self._units, self._chars, mapping))
+        self._units += pairs
+        self._chars += len(lowered)
+
+        # 只保留足以覆盖最长词（再加一个边界字符）的尾部文本
+        keep = self.engine.max_word_length + 1
+        self._tail = (self._tail + lowered)[-keep - len(lowered):]
+        self._tail_start = self._chars - len(self._tail)
+        while len(self._pair_maps) > 1 and self._pair_maps[1][1] <= self._tail_start:
+            self._pair_maps.popleft()
+
+        hits = []
+        pending, self._pending = self._pending, []
+        for start, end, word, categories in pending:
+            hit = self._resolve(start, end, word, categories)
+            if hit:
+                hits.append(hit)
+
+        encoded = _encode(lowered)
+        if self._iter is None:
+            self._iter = self.engine.automaton.iter(encoded)
+        else:
+            self._iter.set(encoded)
+        for end_idx, value in self._iter:
+            length, word, categories = self.engine._resolve(value)
+            end_unit = end_idx + 1
+            start_unit = end_unit - length
+            if start_unit & 1:
+                continue
+            start = self._char_at_pair(start_unit >> 1)
+            if start < 0:
+                continue
+            end = self._char_at_pair(end_unit >> 1) if end_unit >> 1 < self._units else self._chars
+            hit = self._resolve(start, end, word, categories)
+            if hit is False:
+                self._pending.append((start, end, word, categories))
+            elif hit:
+                hits.append(hit)
+        return hits
+
+    def settled(self):
+        """此位置之前的文本不会再产生新的命中（之后的块中的词最长向前延伸 max_word_length - 1 个字符）"""
+        position = max(0, self._chars + 1 - self.engine.max_word_length)
+        for start, _, _, _ in self._pending:
+            position = min(position, start)
+        return position
+
+    def finish(self):
+        """输出结束，报告所有仍在等待的命中"""
+        hits = []
+        for start, end, word, categories in self._pending:
+            hit = self._resolve(start, end, word, categories, final=True)
+            if hit:
+                hits.append(hit)
+        self._pending = []
+        return hits
+
+
+def is_sensitive_category(category):
+    return category not in SUBSTRING_CATEGORIES
+
+
+def hits_in_category(hits, category):
+    """取出属于指定类别的命中词（去重并保持出现顺序）
+
+    category 为 CATEGORY_SENSITIVE 时匹配任意敏感词类别
+    """
+    words = []
+    for hit in hits:
+        if category == CATEGORY_SENSITIVE:
+            matched = any(is_sensitive_category(c) for c in hit.categories)
+        else:
+            matched = category in hit.categories
+        if matched and hit.word not in words:
+            words.append(hit.word)
+    return words
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """获取全局检测引擎，首次调用时构建"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            while _engine is None:
+                matcher = Sensitive_word_screening.kp
+                engine = ScreeningEngine(matcher, cache_path=ENGINE_CACHE_FILE)
+                # 构建期间词库被热更新时，用新词库重新构建
+                if matcher is Sensitive_word_screening.kp:
+                    _engine = engine
+                    source = "从缓存载入" if engine.loaded_from_cache else "构建完成"
+                    logger.info(f"检测引擎{source}，共 {engine.word_count} 个词")
+    return _engine
+
+
+def _rebuild_engine(matcher):
+    """词库热更新后在后台线程重建引擎，构建完成后一次性替换"""
+    global _engine
+    if _engine is None:
+        # 尚未使用过，首次 get_engine 时自然会用到新词库
+        return
+    engine = ScreeningEngine(matcher, cache_path=ENGINE_CACHE_FILE)
+    _engine = engine
+    logger.info(f"检测引擎已热更新，共 {engine.word_count} 个词")
+
+
+Sensitive_word_screening.add_reload_listener(_rebuild_engine)
+
+
+def screen(text):
+    return get_engine().screen(text)
+
+
+def screen_many(texts):
+    return get_engine().screen_many(texts)
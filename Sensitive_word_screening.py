@@ -1,6 +1,18 @@
 import os
 import sys
-from flashtext import KeywordProcessor
+import time
+import mmap
+import threading
+import string
+import struct
+import codecs
+import hashlib
+import logging
+from array import array
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 def resource_path(relative_path):
     """兼容 PyInstaller 打包路径"""
@@ -10,26 +22,484 @@ def resource_path(relative_path):
 
 # 批量读取文件夹下所有敏感词
 def load_keywords_from_folder(folder_path):
-    keywords = set()
-    absolute_folder_path = resource_path(folder_path)
-    for filename in os.listdir(absolute_folder_path):
-        if filename.endswith('.txt'):
-            file_path = os.path.join(absolute_folder_path, filename)
-            with open(file_path, encoding='utf-8', errors='ignore') as f:
-                for line in f:
-                    word = line.strip().rstrip(',')  # 去除多余空格与末尾逗号
-                    if word:
-                        keywords.add(word)
-    return list(keywords)
-
-# 加载所有敏感词
-folder = 'sensitive_words'
-keywords = load_keywords_from_folder(folder)
+    word_categories, _ = load_corpus([folder_path])
+    return list(word_categories)
+
+
+def _decode_word_file(data):
+    """按 BOM 识别编码（部分词表为 UTF-16）"""
+    if data.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return data.decode('utf-16', errors='ignore')
+    return data.decode('utf-8-sig', errors='ignore')
+
+
+def _parse_word_file(text):
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        # 个别词表是一行内以 ", " 分隔的列表
+        for word in line.split(', '):
+            word = word.strip().rstrip(',')  # 去除多余空格与末尾逗号
+            if word:
+                yield word
+
+
+def load_corpus(folders):
+    """读取多个词库目录，跨文件去重并保留每个词所属的类别（文件名）
+
+    返回 (词 -> 类别编号集合, 类别名列表)
+    """
+    categories = []
+    category_ids = {}
+    word_categories = {}
+    for folder_path in folders:
+        absolute_folder_path = resource_path(folder_path)
+        for filename in sorted(os.listdir(absolute_folder_path)):
+            if not filename.endswith('.txt'):
+                continue
+            category = os.path.splitext(filename)[0]
+            if category not in category_ids:
+                category_ids[category] = len(categories)
+                categories.append(category)
+            category_id = category_ids[category]
+            with open(os.path.join(absolute_folder_path, filename), 'rb') as f:
+                for word in _parse_word_file(_decode_word_file(f.read())):
+                    word_categories.setdefault(word, set()).add(category_id)
+    return word_categories, categories
+
+
+# ---------------------------------------------------------------------------
+# 预编译快照
+#
+# 词库被编译成一棵扁平化的 trie（CSR 布局，全部为 uint32 数组），写入二进制
+# 快照文件。运行时只需 mmap 该文件，不做任何解析；多个进程映射同一文件时
+# 共享物理页。快照头部记录词库文件的哈希，任一 .txt 变化都会触发重建。
+# ---------------------------------------------------------------------------
+
+SNAPSHOT_MAGIC = b"SWSNAP02"
+SNAPSHOT_VERSION = 2
+# magic, version, 字节序, 节点数, 边数, 词数, 词表字节数, 类别表字节数, 词库摘要
+_HEADER = struct.Struct("<8sIIIIIII32s")
+_HEADER_SIZE = 128
+_NO_WORD = 0xFFFFFFFF
+_BYTEORDER = 0 if sys.byteorder == "little" else 1
+# 每个词的类别以 uint32 位图存储
+MAX_CATEGORIES = 32
+
+# 与 flashtext 默认设置一致：这些字符被视为单词内部字符
+NON_WORD_BOUNDARIES = frozenset(string.digits + string.ascii_letters + '_')
+
+
+def compute_corpus_digest(folders):
+    """计算所有词库目录中 .txt 文件的摘要（目录名 + 文件名 + 内容）"""
+    digest = hashlib.sha256()
+    digest.update(f"v{SNAPSHOT_VERSION}".encode())
+    for folder_path in folders:
+        digest.update(folder_path.encode('utf-8') + b"\0")
+        absolute_folder_path = resource_path(folder_path)
+        for filename in sorted(os.listdir(absolute_folder_path)):
+            if filename.endswith('.txt'):
+                digest.update(filename.encode('utf-8') + b"\0")
+                with open(os.path.join(absolute_folder_path, filename), 'rb') as f:
+                    digest.update(hashlib.sha256(f.read()).digest())
+    return digest.digest()
+
+
+def compile_snapshot(word_categories, categories, digest):
+    """把词表编译为快照字节串
+
+    word_categories: 词 -> 类别编号集合；categories: 类别名列表
+    """
+    if len(categories) > MAX_CATEGORIES:
+        raise ValueError(f"词库类别数超过上限 {MAX_CATEGORIES}")
+
+    # 与 flashtext 一致：按小写建树，返回原词；同一小写形式后加入者覆盖前者，
+    # 类别取所有冲突词的并集
+    trie = {}
+    words = []
+    word_masks = array('I')
+    for word in sorted(word_categories):
+        node = trie
+        for char in word.lower():
+            node = node.setdefault(char, {})
+        mask = 0
+        for category_id in word_categories[word]:
+            mask |= 1 << category_id
+        if None in node:
+            mask |= word_masks[node[None]]
+        node[None] = len(words)
+        words.append(word)
+        word_masks.append(mask)
+
+    # 按广度优先编号，使相邻层的节点在文件中也相邻
+    first_edge = array('I')
+    node_word = array('I')
+    edge_char = array('I')
+    edge_child = array('I')
+    queue = [trie]
+    head = 0
+    while head < len(queue):
+        node = queue[head]
+        head += 1
+        first_edge.append(len(edge_char))
+        node_word.append(node.get(None, _NO_WORD))
+        for char in sorted(k for k in node if k is not None):
+            edge_char.append(ord(char))
+            edge_child.append(len(queue))
+            queue.append(node[char])
+    first_edge.append(len(edge_char))
+
+    word_offset = array('I', [0])
+    blob = bytearray()
+    for word in words:
+        blob += word.encode('utf-8')
+        word_offset.append(len(blob))
+    category_blob = "\n".join(categories).encode('utf-8')
+
+    header = _HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, _BYTEORDER, len(node_word),
+                          len(edge_char), len(words), len(blob), len(category_blob), digest)
+    return b"".join([
+        header.ljust(_HEADER_SIZE, b"\0"),
+        first_edge.tobytes(),
+        node_word.tobytes(),
+        edge_char.tobytes(),
+        edge_child.tobytes(),
+        word_offset.tobytes(),
+        word_masks.tobytes(),
+        bytes(blob),
+        category_blob,
+    ])
+
+
+def _snapshot_size(node_count, edge_count, word_count, blob_size, category_size):
+    """按头部记录的各段长度计算快照应有的总字节数"""
+    arrays = (node_count + 1) + node_count + edge_count * 2 + (word_count + 1) + word_count
+    return _HEADER_SIZE + arrays * 4 + blob_size + category_size
+
+
+def read_snapshot_digest(buffer, size=None):
+    """读取快照头中的词库摘要；头部不完整、格式不符或文件长度与头部不一致时返回 None
+
+    buffer 至少包含头部；size 为快照文件的总长度，默认为 len(buffer)。
+    """
+    if len(buffer) < _HEADER_SIZE:
+        return None
+    (magic, version, byteorder, node_count, edge_count, word_count,
+     blob_size, category_size, digest) = _HEADER.unpack_from(buffer, 0)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION or byteorder != _BYTEORDER:
+        return None
+    expected = _snapshot_size(node_count, edge_count, word_count, blob_size, category_size)
+    if (len(buffer) if size is None else size) != expected:
+        return None
+    return digest
+
+
+def read_snapshot_file_digest(snapshot_path):
+    """只读取快照文件的头部做校验，返回词库摘要；文件不存在或损坏时返回 None"""
+    try:
+        with open(snapshot_path, 'rb') as f:
+            header = f.read(_HEADER_SIZE)
+            size = os.fstat(f.fileno()).st_size
+    except OSError:
+        return None
+    return read_snapshot_digest(header, size)
+
+
+def build_snapshot(folders, snapshot_path, digest=None):
+    """构建步骤：解析词库并原子地写出快照文件，返回快照路径"""
+    digest = digest or compute_corpus_digest(folders)
+    data = compile_snapshot(*load_corpus(folders), digest)
+    temp_path = f"{snapshot_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            # 先落盘再替换，断电后不会留下长度为 0 或只写了一半的快照
+            os.fsync(f.fileno())
+        # 旧快照仍被映射时（Windows）替换会失败，由调用方退回内存快照
+        os.replace(temp_path, snapshot_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    logger.info(f"敏感词快照已生成: {snapshot_path} ({len(data)} 字节)")
+    return snapshot_path
+
+
+class SnapshotMatcher:
+    """基于快照的关键词匹配器，匹配语义与 flashtext.KeywordProcessor 相同"""
+
+    def __init__(self, buffer):
+        (_, _, _, node_count, edge_count, word_count,
+         blob_size, category_size, self.digest) = _HEADER.unpack_from(buffer, 0)
+        view = memoryview(buffer)
+        offset = _HEADER_SIZE
+
+        def take(count):
+            nonlocal offset
+            part = view[offset:offset + count * 4].cast('I')
+            offset += count * 4
+            return part
+
+        self._buffer = buffer
+        self._first_edge = take(node_count + 1)
+        self._node_word = take(node_count)
+        self._edge_char = take(edge_count)
+        self._edge_child = take(edge_count)
+        self._word_offset = take(word_count + 1)
+        self._word_mask = take(word_count)
+        self._blob = view[offset:offset + blob_size]
+        offset += blob_size
+        self.categories = bytes(view[offset:offset + category_size]).decode('utf-8').split("\n")
+        self.word_count = word_count
+        self._mask_cache = {}
+        # 访问过的节点按需展开为字典，热点路径与 flashtext 一样走字典查找，
+        # 未访问的部分仍只存在于共享的映射页中
+        self._expanded = [None] * node_count
+
+    @classmethod
+    def from_file(cls, snapshot_path):
+        with open(snapshot_path, 'rb') as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def _expand(self, node):
+        lo, hi = self._first_edge[node], self._first_edge[node + 1]
+        children = dict(zip(map(chr, self._edge_char[lo:hi]), self._edge_child[lo:hi]))
+        self._expanded[node] = children
+        return children
+
+    def get_word(self, word_id):
+        start, end = self._word_offset[word_id], self._word_offset[word_id + 1]
+        return bytes(self._blob[start:end]).decode('utf-8')
+
+    def get_categories(self, word_id):
+        """返回词所属的类别名元组"""
+        mask = self._word_mask[word_id]
+        categories = self._mask_cache.get(mask)
+        if categories is None:
+            categories = tuple(name for bit, name in enumerate(self.categories) if mask >> bit & 1)
+            self._mask_cache[mask] = categories
+        return categories
+
+    def iter_words(self):
+        for word_id in range(self.word_count):
+            yield self.get_word(word_id)
+
+    def iter_entries(self):
+        """逐个产出 (词, 类别元组)"""
+        for word_id in range(self.word_count):
+            yield self.get_word(word_id), self.get_categories(word_id)
+
+    def extract_keywords(self, sentence, with_categories=False):
+        """with_categories 为 True 时返回 (词, 类别元组) 列表"""
+        found = []
+        if not sentence:
+            return found
+        sentence = sentence.lower()
+        node_word = self._node_word
+        expanded = self._expanded
+        expand = self._expand
+        current = 0
+        idx = 0
+        sentence_len = len(sentence)
+        while idx < sentence_len:
+            char = sentence[idx]
+            reset = False
+            children = expanded[current]
+            if children is None:
+                children = expand(current)
+            child = children.get(char)
+            if char not in NON_WORD_BOUNDARIES:
+                if node_word[current] != _NO_WORD or child is not None:
+                    longest = None
+                    is_longer_found = False
+                    sequence_end_pos = idx
+                    if node_word[current] != _NO_WORD:
+                        longest = node_word[current]
+                    # 从当前位置继续寻找最长匹配
+                    if child is not None:
+                        continued = child
+                        idy = idx + 1
+                        while idy < sentence_len:
+                            inner_char = sentence[idy]
+                            if inner_char not in NON_WORD_BOUNDARIES and node_word[continued] != _NO_WORD:
+                                longest = node_word[continued]
+                                sequence_end_pos = idy
+                                is_longer_found = True
+                            children = expanded[continued]
+                            if children is None:
+                                children = expand(continued)
+                            nxt = children.get(inner_char)
+                            if nxt is None:
+                                break
+                            continued = nxt
+                            idy += 1
+                        else:
+                            if node_word[continued] != _NO_WORD:
+                                longest = node_word[continued]
+                                sequence_end_pos = idy
+                                is_longer_found = True
+                        if is_longer_found:
+                            idx = sequence_end_pos
+                    current = 0
+                    if longest is not None:
+                        found.append(longest)
+                reset = True
+            else:
+                if child is not None:
+                    current = child
+                else:
+                    current = 0
+                    reset = True
+                    # 跳到当前单词末尾
+                    idy = idx + 1
+                    while idy < sentence_len and sentence[idy] in NON_WORD_BOUNDARIES:
+                        idy += 1
+                    idx = idy
+            if idx + 1 >= sentence_len and node_word[current] != _NO_WORD:
+                found.append(node_word[current])
+            idx += 1
+            if reset:
+                current = 0
+        if with_categories:
+            return [(self.get_word(word_id), self.get_categories(word_id)) for word_id in found]
+        return [self.get_word(word_id) for word_id in found]
+
+
+def load_matcher(folders, snapshot_path):
+    """加载词库快照；缺失、过期或损坏（空文件、头部或长度不符）时自动重建
+
+    先只读取头部校验，通过后才映射整个文件；重建或映射仍然失败时退回内存中的快照。
+    """
+    digest = compute_corpus_digest(folders)
+    try:
+        if read_snapshot_file_digest(snapshot_path) == digest:
+            try:
+                return SnapshotMatcher.from_file(snapshot_path)
+            except (ValueError, TypeError, struct.error) as e:
+                logger.warning(f"敏感词快照无法解析，重建快照: {str(e)}")
+        elif os.path.exists(snapshot_path):
+            logger.info("敏感词库已变化或快照已损坏，重建快照")
+        return SnapshotMatcher.from_file(build_snapshot(folders, snapshot_path, digest))
+    except (OSError, ValueError, TypeError, struct.error) as e:
+        # 目录不可写等情况下退回到内存中的快照
+        logger.error(f"敏感词快照不可用，使用内存词表: {str(e)}")
+        return SnapshotMatcher(compile_snapshot(*load_corpus(folders), digest))
+
+
+# 加载所有敏感词：sensitive_words_2 为补充词库，按文件名标注类别
+CORPUS_FOLDERS = ['sensitive_words', 'sensitive_words_2']
+SNAPSHOT_FILE = resource_path('sensitive_words.snap')
 
 # 初始化关键词处理器
-kp = KeywordProcessor()
-kp.add_keywords_from_list(keywords)
+kp = load_matcher(CORPUS_FOLDERS, SNAPSHOT_FILE)
 
 # 检索文本
 def search_keywords_in_text(text):
     return kp.extract_keywords(text)
+
+# 检索文本，同时返回每个命中词的类别（如 "pol"、"ad"）
+def search_keywords_with_categories(text):
+    return kp.extract_keywords(text, with_categories=True)
+
+
+# ---------------------------------------------------------------------------
+# 热更新
+#
+# 后台线程轮询词库文件的 mtime，发现变化后在该线程内重建匹配器，再以一次
+# 赋值原子地替换全局 kp。检索函数只读取一次 kp，进行中的调用继续使用旧
+# 匹配器，既不会阻塞也不会看到构建到一半的索引。
+# ---------------------------------------------------------------------------
+
+_reload_listeners = []
+_reload_lock = threading.Lock()
+# 最近一次重建的统计：耗时（秒）、词数、完成时间
+last_reload_stats = {}
+
+
+def add_reload_listener(listener):
+    """注册重建完成后的回调 listener(matcher)，在重建线程中调用"""
+    _reload_listeners.append(listener)
+
+
+def corpus_signature(folders):
+    """词库文件的 (路径, mtime, 大小) 列表，用于轮询检测变化"""
+    signature = []
+    for folder_path in folders:
+        absolute_folder_path = resource_path(folder_path)
+        for filename in sorted(os.listdir(absolute_folder_path)):
+            if filename.endswith('.txt'):
+                stat = os.stat(os.path.join(absolute_folder_path, filename))
+                signature.append((folder_path, filename, stat.st_mtime_ns, stat.st_size))
+    return signature
+
+
+def reload_keywords():
+    """重建匹配器并原子替换，返回本次重建的统计信息"""
+    global kp, last_reload_stats
+    with _reload_lock:
+        started = time.perf_counter()
+        matcher = load_matcher(CORPUS_FOLDERS, SNAPSHOT_FILE)
+        kp = matcher
+        for listener in list(_reload_listeners):
+            try:
+                listener(matcher)
+            except Exception as e:
+                logger.error(f"词库重建回调失败: {str(e)}")
+        last_reload_stats = {
+            "duration": time.perf_counter() - started,
+            "word_count": matcher.word_count,
+            "finished_at": time.time(),
+        }
+        logger.info(f"敏感词库已重新加载: {matcher.word_count} 个词，"
+                    f"耗时 {last_reload_stats['duration'] * 1000:.0f} ms")
+        return last_reload_stats
+
+
+class WordListReloader(threading.Thread):
+    """轮询词库目录，文件变化时在后台重建并热替换匹配器"""
+
+    def __init__(self, interval=2.0, on_reload=None):
+        super().__init__(name="word_list_reloader", daemon=True)
+        self.interval = interval
+        self.on_reload = on_reload
+        self._stop_event = threading.Event()
+        self._signature = corpus_signature(CORPUS_FOLDERS)
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                signature = corpus_signature(CORPUS_FOLDERS)
+                if signature == self._signature:
+                    continue
+                self._signature = signature
+                stats = reload_keywords()
+                if self.on_reload:
+                    self.on_reload(stats)
+            except Exception as e:
+                logger.error(f"词库热更新失败: {str(e)}")
+
+    def stop(self):
+        self._stop_event.set()
+
+
+_reloader = None
+
+
+def start_reloader(interval=2.0, on_reload=None):
+    """启动全局词库热更新线程（重复调用返回同一线程）"""
+    global _reloader
+    if _reloader is None or not _reloader.is_alive():
+        _reloader = WordListReloader(interval, on_reload)
+        _reloader.start()
+    return _reloader
+
+
+def stop_reloader():
+    if _reloader is not None:
+        _reloader.stop()
+
+
+if __name__ == "__main__":
+    # 构建步骤: python Sensitive_word_screening.py
+    build_snapshot(CORPUS_FOLDERS, SNAPSHOT_FILE)
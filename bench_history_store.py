@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""剧情历史存储基准
+
+对比改造前的字典列表 + 每回合整段重建 get_history，与 HistoryStore：
+  - 保存 N 条事件占用的内存（tracemalloc，不含事件正文本身共有的部分）
+  - 模拟整局游戏时每回合生成 NPC 剧情文本的耗时（完整文本与窗口文本）
+
+用法:
+    python bench_history_store.py
+    python bench_history_store.py --events 1000 10000 --output history.json
+"""
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+from history_store import HistoryStore, NPC_HISTORY_WINDOW
+
+_ROLES = ["系统", "玩家", "阿狸", "老王", "星术师艾琳", "船长霍克"]
+
+
+def synthetic_events(count):
+    """角色名用新建的字符串对象，模拟从模型输出或存档中解析出来的事件"""
+    events = []
+    for index in range(count):
+        role = "".join(list(_ROLES[index % len(_ROLES)]))
+        events.append((role, f"第 {index} 条事件：玩家在浮空群岛上继续冒险，遇到了新的线索。"))
+    return events
+
+
+def legacy_get_history(history):
+    """改造前 Controller.get_history 的实现"""
+    text = ""
+    for event in history:
+        if event['role'] == "系统":
+            text += event['content'] + "\n"
+        else:
+            text += f"{event['role']} 做了: {event['content'].strip()}\n"
+    return text
+
+
+def measure_memory(build, events):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    container = build(events)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    del container
+    return size
+
+
+def build_dict_list(events):
+    return [{"role": role, "content": content} for role, content in events]
+
+
+def build_store(events):
+    store = HistoryStore()
+    for role, content in events:
+        store.append({"role": role, "content": content})
+    return store
+
+
+def measure_session(events, per_turn=4):
+    """逐回合追加事件并生成 NPC 剧情文本，返回整局总耗时（毫秒）"""
+    legacy = []
+    started = time.perf_counter()
+    for index, (role, content) in enumerate(events, 1):
+        legacy.append({"role": role, "content": content})
+        if index % per_turn == 0:
+            legacy_get_history(legacy)
+    legacy_ms = (time.perf_counter() - started) * 1000
+
+    results = {"legacy_ms": legacy_ms}
+    for name, window in (("store_full_ms", 0), ("store_window_ms", NPC_HISTORY_WINDOW)):
+        store = HistoryStore()
+        started = time.perf_counter()
+        for index, (role, content) in enumerate(events, 1):
+            store.append({"role": role, "content": content})
+            if index % per_turn == 0:
+                store.render(last=window)
+        results[name] = (time.perf_counter() - started) * 1000
+    return results
+
+
+def run(count):
+    events = synthetic_events(count)
+    result = {
+        "events": count,
+        "dict_list_bytes": measure_memory(build_dict_list, events),
+        "store_bytes": measure_memory(build_store, events),
+    }
+    result.update(measure_session(events))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="剧情历史存储基准")
+    parser.add_argument("--events", type=int, nargs="+", default=[1000, 10000], help="事件数")
+    parser.add_argument("--output", help="结果 JSON 文件路径，默认输出到标准输出")
+    args = parser.parse_args()
+
+    report = {
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "npc_history_window": NPC_HISTORY_WINDOW,
+        "results": [run(count) for count in args.events],
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"结果已写入 {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""共享 HTTP 连接池基准
+
+在本地启动一个模拟 SiliconFlow 接口的 HTTP 服务（聊天补全、流式补全、图片下载），
+分别用“各模块各自创建客户端”和“共享连接池”两种方式发送同样的请求序列，
+统计服务端接受的 TCP 连接数与请求耗时。--handshake-ms 为每个新连接增加延迟，
+用来模拟 TLS 握手的开销。
+
+用法:
+    python bench_http_pool.py
+    python bench_http_pool.py --rounds 50 --handshake-ms 30 --output pool.json
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_IMAGE_BYTES = b"\x89PNG\r\n\x1a\n" + b"\x00" * 64 * 1024
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # 避免 Nagle 算法与延迟确认叠加造成的 40ms 停顿影响测量
+    disable_nagle_algorithm = True
+    handshake_seconds = 0.0
+    connections = 0
+    requests = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with _StandInHandler.lock:
+            _StandInHandler.connections += 1
+        if self.handshake_seconds:
+            time.sleep(self.handshake_seconds)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, body, content_type):
+        with _StandInHandler.lock:
+            _StandInHandler.requests += 1
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._send(_IMAGE_BYTES, "image/png")
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        model = payload.get("model", "stand-in")
+        if payload.get("stream"):
+            events = []
+            for piece in ["你好", "，", "冒险者", "。"]:
+                chunk = {
+                    "id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 0, "model": model,
+                    "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+                }
+                events.append(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+            events.append("data: [DONE]\n\n")
+            self._send("".join(events).encode("utf-8"), "text/event-stream")
+            return
+        body = {
+            "id": "chatcmpl-bench", "object": "chat.completion", "created": 0, "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "你好，冒险者。"},
+                         "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        }
+        self._send(json.dumps(body, ensure_ascii=False).encode("utf-8"), "application/json")
+
+
+def start_server(handshake_ms):
+    _StandInHandler.handshake_seconds = handshake_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StandInHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def separate_clients(base_url):
+    """改造前：chatbot / god / npc / pic 各自一个 OpenAI 客户端，图片下载用 requests.get"""
+    import openai
+    import requests
+    clients = [openai.OpenAI(api_key="bench", base_url=base_url) for _ in range(4)]
+    return clients, lambda url: requests.get(url, timeout=30)
+
+
+def shared_clients(base_url):
+    """改造后：所有模块共用 http_clients 中的连接池"""
+    import http_clients
+    client = http_clients.get_openai_client(base_url=base_url, api_key="bench", use_cache=False)
+    return [client] * 4, lambda url: http_clients.http_get(url, timeout=30)
+
+
+def run_scenario(name, server, rounds):
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    factory = separate_clients if name == "separate" else shared_clients
+    clients, download = factory(base_url)
+
+    with _StandInHandler.lock:
+        _StandInHandler.connections = 0
+        _StandInHandler.requests = 0
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(rounds):
+        # 每轮：助手流式回复、叙事与 NPC 各一次补全、一次图片下载
+        for index, client in enumerate(clients[:3]):
+            request_started = time.perf_counter()
+            messages = [{"role": "user", "content": "你好"}]
+            if index == 0:
+                for _chunk in client.chat.completions.create(model="bench", messages=messages, stream=True):
+                    pass
+            else:
+                client.chat.completions.create(model="bench", messages=messages)
+            latencies.append(time.perf_counter() - request_started)
+        request_started = time.perf_counter()
+        download(base_url.rsplit("/v1", 1)[0] + "/image.png")
+        latencies.append(time.perf_counter() - request_started)
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "scenario": name,
+        "rounds": rounds,
+        "requests": _StandInHandler.requests,
+        "connections": _StandInHandler.connections,
+        "total_seconds": elapsed,
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="共享 HTTP 连接池基准")
+    parser.add_argument("--rounds", type=int, default=30, help="请求轮数（每轮 4 个请求）")
+    parser.add_argument("--handshake-ms", type=float, default=20.0, help="每个新连接的模拟握手延迟")
+    parser.add_argument("--output", help="结果 JSON 文件路径，默认输出到标准输出")
+    args = parser.parse_args()
+
+    server = start_server(args.handshake_ms)
+    try:
+        results = [run_scenario(name, server, args.rounds) for name in ("separate", "shared")]
+    finally:
+        server.shutdown()
+
+    report = {
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "handshake_ms": args.handshake_ms,
+        "results": results,
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"结果已写入 {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
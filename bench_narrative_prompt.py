@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""GodAgent 提示词布局基准
+
+对比两种提示词布局在一局模拟游戏中每回合发送的字节数，以及与上一回合请求
+逐字节相同的前缀长度（服务端前缀/KV 缓存可复用的部分）：
+
+  legacy  改造前：每回合新建 ChatAgent，整段提示词既作系统消息又作用户消息，
+          最近事件夹在背景与格式示例之间
+  prefix  改造后：静态前缀（角色设定、格式、示例、背景）作系统消息，
+          只有最近事件放在用户消息中
+
+加 --live 时用 SILICONFLOW_API_KEY 对真实接口发送流式请求（不经过响应缓存），
+额外统计每回合的首字延迟（TTFT）。
+
+用法:
+    python bench_narrative_prompt.py
+    python bench_narrative_prompt.py --turns 10 --live --output prompt.json
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from god import GodAgent
+
+_BACKGROUND = (
+    "【背景总结】：在一个被永夜笼罩的浮空群岛世界中，玩家是一名失去记忆的见习星术师，"
+    "必须在群岛坠落之前找回散落各地的星核碎片，揭开自己与古代星术师议会之间的秘密。"
+)
+_ACTIONS = ["调查码头的灯塔", "与船长交谈", "前往浮空图书馆", "跟踪可疑的斗篷人", "修复星盘", "在集市打听消息"]
+
+
+def legacy_messages(god):
+    """改造前 _build_prompt 的拼接顺序；ChatAgent 把同一段提示同时作为系统消息和用户消息发送"""
+    prompt = (god._instruction_block()
+              + god._background_block(god.world_state["background"]) + "\n\n"
+              + "\n" + god._events_block()
+              + "\n" + god._format_block())
+    return [{"role": "system", "content": prompt}, {"role": "user", "content": prompt}]
+
+
+def prefix_messages(god):
+    """GodAgent 实际发送的消息（流式与非流式生成共用）"""
+    return god._build_messages()
+
+
+def _serialize(messages):
+    return json.dumps(messages, ensure_ascii=False).encode("utf-8")
+
+
+def _common_prefix(a, b):
+    limit = min(len(a), len(b))
+    index = 0
+    while index < limit and a[index] == b[index]:
+        index += 1
+    return index
+
+
+def _measure_ttft(client, model_type, messages):
+    started = time.perf_counter()
+    stream = client.chat.completions.create(model=model_type, messages=messages, stream=True)
+    ttft = None
+    try:
+        for chunk in stream:
+            if ttft is None and chunk.choices and chunk.choices[0].delta.content:
+                ttft = time.perf_counter() - started
+    finally:
+        stream.close()
+    return None if ttft is None else ttft * 1000
+
+
+def run_layout(name, turns, live_client=None, model_type=None):
+    god = GodAgent(model=model_type)  # 只用来拼接提示词，请求由 live_client 发送
+    god.update_world_state(background=_BACKGROUND)
+    build = legacy_messages if name == "legacy" else prefix_messages
+
+    previous = None
+    rows = []
+    for turn in range(turns):
+        god.world_state["history"].append({"role": "玩家", "content": _ACTIONS[turn % len(_ACTIONS)]})
+        god.world_state["history"].append({"role": "系统", "content": f"第 {turn + 1} 回合的剧情叙述……" * 3})
+        messages = build(god)
+        payload = _serialize(messages)
+        row = {
+            "turn": turn + 1,
+            "request_bytes": len(payload),
+            "reused_prefix_bytes": _common_prefix(previous, payload) if previous else 0,
+        }
+        if live_client is not None:
+            row["ttft_ms"] = _measure_ttft(live_client, model_type, messages)
+        rows.append(row)
+        previous = payload
+
+    later = rows[1:] or rows
+    result = {
+        "layout": name,
+        "turns": turns,
+        "mean_request_bytes": sum(r["request_bytes"] for r in rows) / len(rows),
+        "mean_reused_prefix_bytes": sum(r["reused_prefix_bytes"] for r in later) / len(later),
+        "rows": rows,
+    }
+    ttfts = [r["ttft_ms"] for r in later if r.get("ttft_ms") is not None]
+    if ttfts:
+        ttfts.sort()
+        result["ttft_p50_ms"] = ttfts[len(ttfts) // 2]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GodAgent 提示词布局基准")
+    parser.add_argument("--turns", type=int, default=8, help="模拟回合数")
+    parser.add_argument("--live", action="store_true", help="对真实接口测量首字延迟")
+    parser.add_argument("--model", default="Qwen/QwQ-32B", help="--live 时使用的模型")
+    parser.add_argument("--output", help="结果 JSON 文件路径，默认输出到标准输出")
+    args = parser.parse_args()
+
+    client = None
+    if args.live:
+        import http_clients
+        client = http_clients.get_openai_client(use_cache=False)
+
+    results = [run_layout(name, args.turns, client, args.model) for name in ("legacy", "prefix")]
+    report = {
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "live": args.live,
+        "results": results,
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"结果已写入 {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
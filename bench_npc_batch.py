@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""NPC 请求模式基准
+
+在本地模拟服务上对比 npc.interact 的三种模式在 1/3/6/10 个 NPC 时每回合的
+请求数、token 数和耗时：
+
+  sequential  逐个角色请求（NPC_CONCURRENCY=1）
+  concurrent  并发请求各角色（NPC_CONCURRENCY 个同时进行）
+  batch       所有角色合并为一次请求，解析失败的角色再逐个请求
+
+模拟服务按"固定开销 + 每个输出字的生成时间"延迟回复，token 数按请求中所有消息
+（含各角色 agent 的记忆）和回复文本估算。--drop-rate 让批量回复随机漏掉角色，用来测量回退的开销。
+
+用法:
+    python bench_npc_batch.py
+    python bench_npc_batch.py --npcs 3 10 --turns 5 --drop-rate 0.1 --output npc.json
+"""
+
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import npc
+import http_clients
+from safe_token_counter import SimpleTokenCounter, estimate_tokens
+
+_NAMES = ["阿狸", "老王", "星术师艾琳", "船长霍克", "小明", "小美", "铁匠巴德", "吟游诗人", "守卫长", "神秘商人"]
+_TRAITS = "性格沉稳，说话简短，关心同伴的安危，对陌生人保持警惕，但愿意为正义挺身而出。"
+_INFO = "玩家在浮空群岛的码头上发现了一艘没有船员的幽灵船，船舱里传来微弱的星光。玩家做了登上幽灵船\n"
+_SINGLE = re.compile(r"你是(.+?)，你的性格如下")
+
+
+class _StandInModel(BaseHTTPRequestHandler):
+    """模拟的对话模型：单角色请求回复一句言行，批量请求为名单中的每个角色回复一行"""
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    base_seconds = 0.0
+    per_char_seconds = 0.0
+    drop_rate = 0.0
+    random = random.Random(0)
+    lock = threading.Lock()
+    stats = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    @classmethod
+    def reset(cls):
+        with cls.lock:
+            cls.stats = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+    def _reply_for(self, prompt):
+        if "在场的角色及其性格如下" in prompt:
+            roster = prompt.split("在场的角色及其性格如下：\n", 1)[1].split("请分别", 1)[0]
+            lines = []
+            for line in roster.splitlines():
+                name = line.split("：", 1)[0]
+                with _StandInModel.lock:
+                    dropped = self.random.random() < self.drop_rate
+                if name and not dropped:
+                    lines.append(f"{name}：{name}握紧武器，小心地跟在玩家身后走进船舱。")
+            return "\n".join(lines)
+        match = _SINGLE.search(prompt)
+        name = match.group(1) if match else "角色"
+        return f"{name}握紧武器，小心地跟在玩家身后走进船舱。"
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        messages = payload.get("messages", [])
+        prompt_tokens = sum(estimate_tokens(str(message.get("content", ""))) for message in messages)
+        content = self._reply_for(str(messages[-1].get("content", "")) if messages else "")
+        completion_tokens = estimate_tokens(content)
+        with _StandInModel.lock:
+            _StandInModel.stats["requests"] += 1
+            _StandInModel.stats["prompt_tokens"] += prompt_tokens
+            _StandInModel.stats["completion_tokens"] += completion_tokens
+        time.sleep(self.base_seconds + self.per_char_seconds * len(content))
+        body = {
+            "id": "chatcmpl-bench", "object": "chat.completion", "created": 0, "model": payload.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StandInModel)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_agents(base_url):
+    model = http_clients.create_model(model_type="stand-in", base_url=base_url, api_key="bench",
+                                      token_counter=SimpleTokenCounter())
+    # 不经过响应缓存，每次都真正请求模拟服务
+    model._client = http_clients.get_openai_client(base_url, "bench", use_cache=False)
+    return npc.NpcAgents(model=model)
+
+
+def run(mode, count, turns, base_url, concurrency):
+    characters = {name: {"traits": _TRAITS} for name in _NAMES[:count]}
+    agents = make_agents(base_url)
+    options = {
+        "sequential": {"concurrency": 1, "batch": False},
+        "concurrent": {"concurrency": concurrency, "batch": False},
+        "batch": {"concurrency": concurrency, "batch": True},
+    }[mode]
+    _StandInModel.reset()
+    latencies = []
+    replies = 0
+    for turn in range(turns):
+        started = time.perf_counter()
+        result = npc.interact((characters, f"第 {turn + 1} 回合。" + _INFO), npc_agents=agents, **options)
+        latencies.append((time.perf_counter() - started) * 1000)
+        replies += len(result)
+    stats = dict(_StandInModel.stats)
+    return {
+        "mode": mode,
+        "npcs": count,
+        "requests_per_turn": stats["requests"] / turns,
+        "prompt_tokens_per_turn": stats["prompt_tokens"] / turns,
+        "completion_tokens_per_turn": stats["completion_tokens"] / turns,
+        "mean_turn_ms": sum(latencies) / turns,
+        "replies_per_turn": replies / turns,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NPC 请求模式基准")
+    parser.add_argument("--npcs", type=int, nargs="+", default=[1, 3, 6, 10], help="NPC 数")
+    parser.add_argument("--turns", type=int, default=3, help="每种配置模拟的回合数")
+    parser.add_argument("--base-ms", type=float, default=300, help="模拟服务每次请求的固定开销（毫秒）")
+    parser.add_argument("--per-char-ms", type=float, default=5, help="模拟服务每个输出字的生成时间（毫秒）")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="批量回复漏掉每个角色的概率")
+    parser.add_argument("--concurrency", type=int, default=npc.NPC_CONCURRENCY, help="并发模式同时提交的请求数（实际并发还受 NPC 线程池大小 NPC_CONCURRENCY 限制）")
+    parser.add_argument("--output", help="结果 JSON 文件路径，默认输出到标准输出")
+    args = parser.parse_args()
+
+    _StandInModel.base_seconds = args.base_ms / 1000
+    _StandInModel.per_char_seconds = args.per_char_ms / 1000
+    _StandInModel.drop_rate = args.drop_rate
+    server = start_server()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    try:
+        results = [run(mode, count, args.turns, base_url, args.concurrency)
+                   for count in args.npcs for mode in ("sequential", "concurrent", "batch")]
+    finally:
+        server.shutdown()
+
+    report = {
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "base_ms": args.base_ms,
+        "per_char_ms": args.per_char_ms,
+        "drop_rate": args.drop_rate,
+        "concurrency": args.concurrency,
+        "results": results,
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"结果已写入 {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
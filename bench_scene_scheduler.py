@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""NPC 场景调度基准
+
+模拟一局角色不断登场的游戏：每回合新增若干角色，剧情只提到其中少数几个。
+对比改造前（所有登场过的角色每回合都行动）与 SceneScheduler 按相关度挑选时
+每回合行动的 NPC 数，以及挑选本身的耗时。另检查 "商人"、"诗人" 等普通名词
+不会选中 "神秘商人"、"吟游诗人" 这类角色（generic_noun_check）。
+
+用法:
+    python bench_scene_scheduler.py
+    python bench_scene_scheduler.py --cast 10 100 1000 --turns 300 --output scheduler.json
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+
+from history_store import HistoryStore
+from scene_scheduler import SceneScheduler
+
+_SURNAMES = "赵钱孙李周吴郑王冯陈褚卫蒋沈韩杨朱秦尤许何吕施张孔曹严华金魏陶姜"
+_GIVEN = "明华强丽静军敏磊洋艳勇杰娟涛超霞平刚桂英"
+_TITLES = ["船长", "铁匠", "星术师", "守卫", "商人", "学徒", ""]
+
+
+def make_names(count, rng):
+    names = []
+    seen = set()
+    while len(names) < count:
+        name = rng.choice(_TITLES) + rng.choice(_SURNAMES) + rng.choice(_GIVEN) + rng.choice(_GIVEN)
+        if name not in seen:
+            seen.add(name)
+            names.append(name)
+    return names
+
+
+def run(cast, turns, seed=0):
+    rng = random.Random(seed)
+    names = make_names(cast, rng)
+    per_turn = max(1, cast // turns + (1 if cast % turns else 0))
+    characters = {}
+    world_state = {"characters": characters, "history": HistoryStore()}
+    scheduler = SceneScheduler()
+    active_counts = []
+    legacy_counts = []
+    latencies = []
+    introduced = 0
+    for turn in range(turns):
+        # 本回合登场的新角色，以及剧情中提到的 1-2 个近期角色
+        newcomers = names[introduced:introduced + per_turn]
+        introduced += len(newcomers)
+        for name in newcomers:
+            characters[name] = {"traits": "性格沉稳"}
+        recent = list(characters)[-10:]
+        mentioned = newcomers[:1] + rng.sample(recent, min(len(recent), rng.randint(1, 2)))
+        narrative = "，".join(f"{name}看向远方" for name in mentioned) + "。海风吹过码头，灯塔的光忽明忽暗。"
+        world_state["history"].append({"role": "系统", "content": narrative})
+        choice = f"与{rng.choice(recent)}交谈" if rng.random() < 0.3 else "继续前进"
+
+        started = time.perf_counter()
+        selected = scheduler.select(world_state, choice)
+        latencies.append((time.perf_counter() - started) * 1000)
+        active_counts.append(len(selected))
+        legacy_counts.append(len(characters))
+        world_state["history"].append({"role": "玩家", "content": f"玩家选择{choice}"})
+
+    latencies.sort()
+    return {
+        "cast": cast,
+        "turns": turns,
+        "legacy_npcs_per_turn": sum(legacy_counts) / turns,
+        "legacy_npcs_last_turn": legacy_counts[-1],
+        "scheduled_npcs_per_turn": sum(active_counts) / turns,
+        "scheduled_npcs_max": max(active_counts),
+        "select_p50_ms": latencies[len(latencies) // 2],
+        "select_p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+    }
+
+
+# 普通名词式的角色名：剧情中的 "商人"、"诗人" 不应选中 "神秘商人"、"吟游诗人"
+_GENERIC_CAST = ["神秘商人", "吟游诗人", "守卫长", "船长霍克"]
+_GENERIC_NARRATIVE = "集市上的商人高声叫卖，一位诗人在街角弹琴。霍克看向远方。"
+
+
+def check_generic_nouns():
+    """只提到普通名词和 "霍克" 时，应当只选中船长霍克"""
+    world_state = {
+        "characters": {name: {"traits": "性格沉稳"} for name in _GENERIC_CAST},
+        "history": HistoryStore(),
+    }
+    world_state["history"].append({"role": "系统", "content": _GENERIC_NARRATIVE})
+    selected = list(SceneScheduler().select(world_state, "继续前进"))
+    return {"narrative": _GENERIC_NARRATIVE, "selected": selected, "passed": selected == ["船长霍克"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NPC 场景调度基准")
+    parser.add_argument("--cast", type=int, nargs="+", default=[10, 100, 1000], help="整局登场的角色总数")
+    parser.add_argument("--turns", type=int, default=200, help="模拟回合数")
+    parser.add_argument("--output", help="结果 JSON 文件路径，默认输出到标准输出")
+    args = parser.parse_args()
+
+    report = {
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": [run(cast, args.turns) for cast in args.cast],
+        "generic_noun_check": check_generic_nouns(),
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"结果已写入 {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""敏感词 / 提示注入检测性能基准
+
+用法:
+    python bench_screening.py                        # 全部引擎，结果 JSON 输出到标准输出
+    python bench_screening.py --output bench.json    # 结果写入文件
+    python bench_screening.py --engines snapshot,engine --sizes 100,1000
+
+每个引擎在独立子进程中构建与测量，以便得到互不干扰的内存数据。
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+ENGINES = ["flashtext", "ahocorasick", "snapshot", "engine", "engine_cached", "prompt_injection"]
+DEFAULT_SIZES = [100, 1000, 10000]
+DEFAULT_DENSITIES = [0.0, 0.01, 0.05]
+
+# 合成语料使用的常用汉字与标点
+_COMMON_CHARS = (
+    "的一是了我不人在他有这个上们来到时大地为子中你说生国年着就那和要她出也得里后自以会家可下而过天去能对小多"
+    "然于心学么之都好看起发当没成只如事把还用第样道想作种开美总从无情己面最女但现前些所同日手又行意动方期它头"
+    "经长儿回位分爱老因很给名法间斯知世什两次使身者被高已亲其进此话常与活正感见明问力理尔点文几定本公特做外孩"
+)
+_PUNCTUATION = "，。！？；："
+
+
+def rss_bytes():
+    """当前进程常驻内存（字节）"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        import resource
+        # ru_maxrss 在 Linux 上以 KB 为单位，这里退化为峰值常驻内存
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def load_vocabulary():
+    import Sensitive_word_screening
+    word_categories, _ = Sensitive_word_screening.load_corpus(Sensitive_word_screening.CORPUS_FOLDERS)
+    return sorted(word_categories)
+
+
+def make_corpus(vocabulary, size, density, count, seed):
+    """生成 count 段长度约为 size 的合成中文文本，density 为每个位置插入词库词的概率"""
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(count):
+        parts = []
+        length = 0
+        while length < size:
+            roll = rng.random()
+            if roll < density:
+                piece = rng.choice(vocabulary)
+            elif roll < density + 0.05:
+                piece = rng.choice(_PUNCTUATION)
+            else:
+                piece = rng.choice(_COMMON_CHARS)
+            parts.append(piece)
+            length += len(piece)
+        texts.append("".join(parts)[:size])
+    return texts
+
+
+def _engine_stats(engine):
+    """合并检测引擎自动机本身占用的内存，以及是否从缓存载入"""
+    stats = engine.automaton.get_stats()
+    return {"automaton_mb": stats["total_size"] / 1e6, "loaded_from_cache": engine.loaded_from_cache}
+
+
+def build_engine(name, vocabulary):
+    """构建指定引擎，返回 (检测函数, 附加统计)"""
+    if name == "flashtext":
+        from flashtext import KeywordProcessor
+        kp = KeywordProcessor()
+        kp.add_keywords_from_list(vocabulary)
+        return kp.extract_keywords, {}
+    if name == "ahocorasick":
+        import ahocorasick
+        automaton = ahocorasick.Automaton()
+        for word in vocabulary:
+            automaton.add_word(word, word)
+        automaton.make_automaton()
+        return (lambda text: [word for _, word in automaton.iter(text)]), {}
+    if name == "snapshot":
+        import Sensitive_word_screening
+        matcher = Sensitive_word_screening.load_matcher(
+            Sensitive_word_screening.CORPUS_FOLDERS, Sensitive_word_screening.SNAPSHOT_FILE)
+        return matcher.extract_keywords, {}
+    if name == "engine":
+        # 不使用缓存，从快照逐词构建自动机
+        import Screening_engine
+        engine = Screening_engine.ScreeningEngine()
+        return engine.screen, _engine_stats(engine)
+    if name == "engine_cached":
+        # 游戏中的实际路径：从快照旁的缓存文件载入自动机（缓存不存在时先构建一次，不计入）
+        import Screening_engine
+        path = Screening_engine.ENGINE_CACHE_FILE
+        if not os.path.exists(path):
+            Screening_engine.ScreeningEngine(cache_path=path)
+        engine = Screening_engine.ScreeningEngine(cache_path=path)
+        return engine.screen, _engine_stats(engine)
+    if name == "prompt_injection":
+        import Prompt_injection
+        return Prompt_injection.check_prompt_injection, {}
+    raise ValueError(f"未知引擎: {name}")
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_worker(name, sizes, densities, calls, seed):
+    """子进程：构建一个引擎并在所有语料上测量"""
+    vocabulary = load_vocabulary()
+    corpora = {
+        (size, density): make_corpus(vocabulary, size, density, calls, seed)
+        for size in sizes for density in densities
+    }
+
+    rss_before = rss_bytes()
+    started = time.perf_counter()
+    detect, extra = build_engine(name, vocabulary)
+    build_seconds = time.perf_counter() - started
+    rss_after_build = rss_bytes()
+
+    runs = []
+    for (size, density), texts in corpora.items():
+        for text in texts[:max(1, calls // 10)]:
+            detect(text)  # 预热
+        latencies = []
+        hits = 0
+        for text in texts:
+            started = time.perf_counter()
+            result = detect(text)
+            latencies.append(time.perf_counter() - started)
+            hits += len(result)
+        latencies.sort()
+        total = sum(latencies)
+        chars = sum(len(text) for text in texts)
+        runs.append({
+            "size": size,
+            "density": density,
+            "calls": len(texts),
+            "hits": hits,
+            "chars_per_second": chars / total if total else None,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+        })
+
+    return {
+        "engine": name,
+        "vocabulary_size": len(vocabulary),
+        "build_seconds": build_seconds,
+        "rss_build_mb": (rss_after_build - rss_before) / 1e6,
+        "rss_total_mb": rss_bytes() / 1e6,
+        **extra,
+        "runs": runs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="敏感词 / 提示注入检测性能基准")
+    parser.add_argument("--engines", default=",".join(ENGINES))
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)))
+    parser.add_argument("--densities", default=",".join(map(str, DEFAULT_DENSITIES)))
+    parser.add_argument("--calls", type=int, default=200, help="每种语料的调用次数")
+    parser.add_argument("--seed", type=int, default=20240601)
+    parser.add_argument("--output", help="结果 JSON 文件路径，默认输出到标准输出")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    densities = [float(d) for d in args.densities.split(",") if d]
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, sizes, densities, args.calls, args.seed)))
+        return
+
+    results = []
+    for name in [e for e in args.engines.split(",") if e]:
+        print(f"测量引擎: {name} ...", file=sys.stderr)
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", name,
+             "--sizes", args.sizes, "--densities", args.densities,
+             "--calls", str(args.calls), "--seed", str(args.seed)],
+            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        if completed.returncode != 0:
+            print(completed.stderr, file=sys.stderr)
+            results.append({"engine": name, "error": completed.stderr.strip().splitlines()[-1:]})
+            continue
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    report = {
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "sizes": sizes,
+        "densities": densities,
+        "calls": args.calls,
+        "results": results,
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"结果已写入 {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""长期剧情记忆基准
+
+生成一局包含数千条事件的模拟历史，统计：
+  - 每条事件加入索引的耗时（sync 只处理新增部分）
+  - 每回合检索相关往事、构造长期记忆块的耗时（p50/p99）
+  - 提示词中长期记忆部分的大小，与把全部历史放进提示词相比
+
+用法:
+    python bench_story_memory.py
+    python bench_story_memory.py --events 1000 5000 --queries 500 --output memory.json
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+
+from story_memory import StoryMemory
+
+_NPCS = ["阿狸", "老王", "星术师艾琳", "船长霍克", "守夜人", "图书管理员", "流浪商人", "斗篷人"]
+_PLACES = ["码头", "灯塔", "浮空图书馆", "集市", "钟楼", "地下水道", "议会大厅", "星坠遗迹"]
+_THINGS = ["星核碎片", "古老的星盘", "一封密信", "破损的地图", "银色钥匙", "发光的羽毛", "议会徽章"]
+_VERBS = ["发现了", "交出了", "藏起了", "争夺", "研究", "修复了", "丢失了"]
+
+
+def synthetic_history(count, seed=7):
+    rng = random.Random(seed)
+    history = []
+    for turn in range(count // 4 + 1):
+        place = rng.choice(_PLACES)
+        thing = rng.choice(_THINGS)
+        history.append({"role": "系统", "content": f"玩家来到{place}，{rng.choice(_NPCS)}在那里{rng.choice(_VERBS)}{thing}。"
+                                                  f"夜色渐深，远处传来钟声，第{turn}回合的冒险继续。"})
+        history.append({"role": "玩家", "content": f"玩家选择前往{rng.choice(_PLACES)}调查{thing}"})
+        for npc in rng.sample(_NPCS, 2):
+            history.append({"role": npc, "content": f"{npc}低声说起{rng.choice(_THINGS)}的传闻，并提议一起去{place}。"})
+    return history[:count]
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def run(count, queries):
+    history = synthetic_history(count)
+    characters = {name: {"traits": f"{name}的性格设定……" * 4} for name in _NPCS}
+    memory = StoryMemory()
+
+    # 模拟游戏过程：历史逐条增长，每回合（约 4 条事件）同步一次
+    growing = []
+    started = time.perf_counter()
+    for event in history:
+        growing.append(event)
+        if len(growing) % 4 == 0:
+            memory.sync(growing)
+    memory.sync(growing)
+    index_seconds = time.perf_counter() - started
+
+    rng = random.Random(11)
+    latencies = []
+    block = ""
+    for _ in range(queries):
+        end = rng.randint(len(history) // 2, len(history))
+        query = "\n".join(event["content"] for event in history[end - 3:end])
+        started = time.perf_counter()
+        block = memory.context(query, characters, exclude_recent=3)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    full_history = "".join(f"{event['role']}: {event['content']}\n" for event in history)
+    return {
+        "events": len(history),
+        "index_us_per_event": index_seconds / len(history) * 1e6,
+        "context_p50_ms": _percentile(latencies, 0.50),
+        "context_p99_ms": _percentile(latencies, 0.99),
+        "memory_block_bytes": len(block.encode("utf-8")),
+        "full_history_bytes": len(full_history.encode("utf-8")),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="长期剧情记忆基准")
+    parser.add_argument("--events", type=int, nargs="+", default=[1000, 5000], help="模拟历史的事件数")
+    parser.add_argument("--queries", type=int, default=300, help="每种规模的检索次数")
+    parser.add_argument("--output", help="结果 JSON 文件路径，默认输出到标准输出")
+    args = parser.parse_args()
+
+    report = {
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": [run(count, args.queries) for count in args.events],
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"结果已写入 {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
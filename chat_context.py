@@ -0,0 +1,198 @@
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from safe_token_counter import SimpleTokenCounter
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 每次请求的 token 上限（系统提示 + 摘要 + 保留的对话）
+DEFAULT_TOKEN_BUDGET = 4000
+# 触发压缩后，最近的对话保留到预算的这个比例以内，其余折叠进摘要
+KEEP_RECENT_RATIO = 0.5
+# 摘要的最大字数，避免摘要本身无限增长
+MAX_SUMMARY_CHARS = 600
+
+BACKGROUND_MARKER = "【背景总结】"
+SUMMARY_PREFIX = "【对话摘要】："
+
+
+def is_pinned(message):
+    """包含背景总结的消息永远不会被折叠"""
+    content = message.get("content")
+    return isinstance(content, str) and BACKGROUND_MARKER in content
+
+
+def fallback_summary(previous_summary, turns):
+    """摘要模型不可用时的退化方案：逐条截取开头"""
+    lines = [previous_summary] if previous_summary else []
+    for message in turns:
+        speaker = "玩家" if message["role"] == "user" else "助手"
+        lines.append(f"{speaker}：{message.get('content', '')[:60]}")
+    summary = "\n".join(lines)
+    return summary[-MAX_SUMMARY_CHARS:]
+
+
+class ChatContext:
+    """带 token 预算的对话上下文
+
+    维护对话的 token 合计；超出预算时，在后台把最早的若干轮对话连同旧摘要
+    折叠成一条滚动摘要消息。系统提示和包含【背景总结】的消息始终保留。
+    摘要完成前，messages() 会临时丢弃最早的对话，保证每次请求都不超过预算。
+    """
+
+    def __init__(self, system_prompt, token_counter=None, budget=DEFAULT_TOKEN_BUDGET, summarizer=None):
+        """summarizer(previous_summary, turns) -> str，返回新的摘要文本；为 None 时使用退化方案"""
+        try:
+            self.counter = token_counter or SimpleTokenCounter()
+            self.budget = budget
+            self.summarizer = summarizer
+            self.system_message = {"role": "system", "content": system_prompt}
+            self._system_tokens = self.counter.count_message(self.system_message)
+            self._lock = threading.Lock()
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat_context")
+            self._generation = 0  # 每次重置递增，用于丢弃过期的摘要结果
+            self.version = 0      # 内容每次变化递增，用于存档时判断是否需要保存
+            self._reset_state()
+        except Exception as e:
+            logger.error(f"ChatContext 初始化失败: {str(e)}")
+            raise
+
+    def _reset_state(self):
+        self.summary = ""
+        self._summary_message = None
+        self._summary_tokens = 0
+        self._turns = []          # [(消息, token 数)]
+        self._turn_tokens = 0
+        self._compacting = None   # 正在进行的压缩任务
+        self.compactions = 0
+        self.version += 1
+
+    @property
+    def total_tokens(self):
+        """完整上下文（未裁剪）的 token 数"""
+        return self._system_tokens + self._summary_tokens + self._turn_tokens
+
+    def append(self, role, content):
+        """追加一条对话消息，必要时在后台启动压缩"""
+        message = {"role": role, "content": content}
+        tokens = self.counter.count_message(message)
+        with self._lock:
+            self._turns.append((message, tokens))
+            self._turn_tokens += tokens
+            self.version += 1
+            if self.total_tokens > self.budget and self._compacting is None:
+                self._start_compaction()
+        return message
+
+    def messages(self):
+        """本次请求要发送的消息列表，token 数不超过预算"""
+        with self._lock:
+            result = [self.system_message]
+            if self._summary_message:
+                result.append(self._summary_message)
+            available = self.budget - self._system_tokens - self._summary_tokens
+            turns = self._turns
+            if self._turn_tokens > available:
+                # 摘要尚未完成：从最早的非固定消息开始临时丢弃（最后一条总会保留）
+                excess = self._turn_tokens - available
+                kept = []
+                for index, (message, tokens) in enumerate(turns):
+                    if excess > 0 and not is_pinned(message) and index < len(turns) - 1:
+                        excess -= tokens
+                        continue
+                    kept.append((message, tokens))
+                turns = kept
+            result.extend(message for message, _ in turns)
+            return result
+
+    def _start_compaction(self):
+        """选出要折叠的最早对话并提交后台摘要任务（调用方持有锁）"""
+        keep_budget = int(self.budget * KEEP_RECENT_RATIO) - self._system_tokens
+        remaining = self._turn_tokens
+        folded = []
+        # 最后一条（通常是刚输入的问题）不参与折叠
+        for message, tokens in self._turns[:-1]:
+            if remaining <= keep_budget:
+                break
+            if is_pinned(message):
+                continue
+            folded.append(message)
+            remaining -= tokens
+        if not folded:
+            return
+        generation = self._generation
+        previous_summary = self.summary
+        self._compacting = self._executor.submit(self._compact, generation, previous_summary, folded)
+
+    def _compact(self, generation, previous_summary, folded):
+        summary = None
+        try:
+            if self.summarizer is not None:
+                summary = self.summarizer(previous_summary, folded)
+        except Exception as e:
+            logger.error(f"生成对话摘要失败: {str(e)}")
+        if not summary:
+            summary = fallback_summary(previous_summary, folded)
+        summary = summary.strip()[-MAX_SUMMARY_CHARS:]
+
+        with self._lock:
+            if generation != self._generation:
+                # 压缩期间上下文已被重置
+                return
+            folded_ids = {id(message) for message in folded}
+            self._turns = [turn for turn in self._turns if id(turn[0]) not in folded_ids]
+            self._turn_tokens = sum(tokens for _, tokens in self._turns)
+            self.summary = summary
+            self._summary_message = {"role": "system", "content": SUMMARY_PREFIX + summary}
+            self._summary_tokens = self.counter.count_message(self._summary_message)
+            self._compacting = None
+            self.compactions += 1
+            self.version += 1
+            logger.info(f"已将 {len(folded)} 条对话折叠为摘要，当前上下文 {self.total_tokens} tokens")
+            # 压缩期间又追加了大量对话时继续压缩
+            if self.total_tokens > self.budget:
+                self._start_compaction()
+
+    def export_state(self):
+        """用于存档的对话状态：摘要和未折叠的对话"""
+        with self._lock:
+            return {
+                "summary": self.summary,
+                "turns": [(message["role"], message["content"]) for message, _ in self._turns],
+            }
+
+    def import_state(self, state):
+        """从存档恢复对话状态（token 数重新计算）"""
+        with self._lock:
+            self._generation += 1
+            self._reset_state()
+            summary = state.get("summary", "")
+            if summary:
+                self.summary = summary
+                self._summary_message = {"role": "system", "content": SUMMARY_PREFIX + summary}
+                self._summary_tokens = self.counter.count_message(self._summary_message)
+            for role, content in state.get("turns", []):
+                message = {"role": role, "content": content}
+                tokens = self.counter.count_message(message)
+                self._turns.append((message, tokens))
+                self._turn_tokens += tokens
+
+    def wait(self, timeout=None):
+        """等待正在进行的压缩完成（主要用于测试和退出前）"""
+        future = self._compacting
+        if future is not None:
+            future.result(timeout)
+
+    def reset(self):
+        with self._lock:
+            self._generation += 1
+            self._reset_state()
+
+    def close(self):
+        try:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        except Exception as e:
+            logger.error(f"关闭对话上下文失败: {str(e)}")
@@ -1,5 +1,9 @@
 from god import GodAgent
 import npc
+from speculation import Speculator
+from scene_scheduler import SceneScheduler
+from history_store import HistoryStore, NPC_HISTORY_WINDOW
+from savegame import SaveGame, collect_state
 from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot, QThread, QEventLoop
 import logging
 from dotenv import load_dotenv
@@ -13,6 +17,9 @@ logger = logging.getLogger(__name__)
 class Controller(QObject):
     # 向界面发送剧情、角色、选项
     update_signal = pyqtSignal(str, object, list)
+    # 剧情生成过程中逐段发送剧情正文和提前解析出的选项
+    narrative_stream_signal = pyqtSignal(str)
+    options_signal = pyqtSignal(list)
     # 向界面发送NPC行动
     NPC_signal = pyqtSignal(object)
     # 从界面接收玩家选择
@@ -20,15 +27,26 @@ class Controller(QObject):
     # 从界面接收游戏背景
     background_signal = pyqtSignal(str)
 
-    def __init__(self):
+    def __init__(self, resume_state=None, save=None):
+        """resume_state 为 save.load() 读出的状态时从存档继续，否则等待新的游戏背景"""
         try:
             super().__init__()
             self.god = GodAgent()
+            # 新的一局（或读档）从空白的 NPC 记忆开始
+            npc.agents.clear()
+            # 每回合只让与当前场景最相关的几个角色行动
+            self.scheduler = SceneScheduler()
+            # 玩家阅读选项时为每个选项提前生成下一回合（默认关闭）
+            self.speculator = Speculator(self.god, self.get_history, scheduler=self.scheduler)
             self.choice_signal.connect(self.handle_choice)
             self.background_signal.connect(self.receive_background)
             self.pending_choice = None
             self.waiting = False
             self.story_start = False
+            # 每回合自动存档；extra_state() 由界面提供对话记录、图片路径等非剧情状态
+            self.save = save or SaveGame()
+            self.resume_state = resume_state
+            self.extra_state = None
             logger.info("Controller 初始化成功")
         except Exception as e:
             logger.error(f"Controller 初始化失败: {str(e)}")
@@ -36,18 +54,42 @@ class Controller(QObject):
 
     def run(self):
         try:
-            self.background_loop = QEventLoop()
-            self.background_loop.exec_()
-            self.update_signal.emit("开始游戏", [], [])
+            ready_turn = None  # 已经生成好的一回合（来自推测分支或存档）
+            resumed = self.resume_state is not None
+            if resumed:
+                ready_turn = self.restore(self.resume_state)
+                self.resume_state = None
+            else:
+                self.background_loop = QEventLoop()
+                self.background_loop.exec_()
+                if self.stopping():
+                    return
+                self.update_signal.emit("开始游戏", [], [])
+                self.save.start(self.collect_state())
 
             while True:
                 try:
-                    narrative, options, new_role = self.god.generate_narrative()
+                    if ready_turn is not None:
+                        narrative, options, new_role = ready_turn
+                        ready_turn = None
+                    else:
+                        narrative, options, new_role = self.god.generate_narrative_stream(self.on_narrative_event)
+                    if self.stopping():
+                        return
                     self.update_signal.emit(narrative, new_role, options)
+                    self.speculator.start(options)
+                    if resumed:
+                        # 读档后显示的这一回合已经在存档里
+                        resumed = False
+                    else:
+                        self.save.record_turn(self.collect_state(narrative, options, new_role))
 
                     # 等待玩家选择
                     self.choice_loop = QEventLoop()
                     self.choice_loop.exec_()  # 在这里阻塞，直到 handle_choice 调用 quit()
+                    if self.stopping():
+                        self.speculator.shutdown()
+                        return
 
                     player_choice = self.pending_choice
                     self.pending_choice = None
@@ -56,10 +98,17 @@ class Controller(QObject):
                         logger.warning("玩家选择为空，使用默认选择")
                         player_choice = "继续观察"
 
+                    branch = self.speculator.commit(player_choice)
+                    if branch is not None:
+                        npc_info, ready_turn = branch
+                        self.NPC_signal.emit(npc_info)
+                        continue
+
                     former_history = self.get_history()
                     former_history += '玩家做了' + player_choice + '\n'
 
-                    npc_info = npc.interact((self.god.world_state['characters'], former_history))
+                    characters = self.scheduler.select(self.god.world_state, player_choice)
+                    npc_info = npc.interact((characters, former_history))
                     self.NPC_signal.emit(npc_info)
                     info = (player_choice, npc_info)
                     self.god.update_information(info)
@@ -73,6 +122,36 @@ class Controller(QObject):
             logger.error(f"Controller 运行失败: {str(e)}")
             self.update_signal.emit(f"控制器运行失败: {str(e)}", [], [])
 
+    def stopping(self):
+        """界面重新开始或读档时会请求中断控制器线程"""
+        return QThread.currentThread().isInterruptionRequested()
+
+    def collect_state(self, narrative=None, options=None, new_role=None):
+        extra = {}
+        if self.extra_state is not None:
+            try:
+                extra = self.extra_state()
+            except Exception as e:
+                logger.error(f"获取界面状态失败: {str(e)}")
+        return collect_state(self.god.world_state, narrative, options, new_role, **extra)
+
+    def restore(self, state):
+        """用存档恢复世界状态，返回存档时显示的 (剧情, 选项, 新角色)"""
+        self.god.world_state = {
+            "background": state["background"],
+            "characters": state["characters"],
+            "history": state["history"],
+        }
+        self.story_start = True
+        return state.get("narrative") or "（已读取存档）", state.get("options") or ["继续观察"], None
+
+    def on_narrative_event(self, kind, data):
+        """流式剧情事件转发给界面；新角色随最终结果一起显示"""
+        if kind == "narrative":
+            self.narrative_stream_signal.emit(data)
+        elif kind == "options":
+            self.options_signal.emit(data)
+
     @pyqtSlot(str)
     def handle_choice(self, content):
         try:
@@ -98,15 +177,14 @@ class Controller(QObject):
         except Exception as e:
             logger.error(f"接收背景失败: {str(e)}")
 
-    def get_history(self):
+    def get_history(self, world_state=None, window=NPC_HISTORY_WINDOW):
+        """NPC 使用的剧情文本，只包含最近 window 条事件（0 表示全部）"""
         try:
-            history = ""
-            for event in self.god.world_state["history"]:
-                if event['role'] == "系统":
-                    history += event['content'] + "\n"
-                else:
-                    history += f"{event['role']} 做了: {event['content'].strip()}\n"
-            return history
+            world_state = world_state if world_state is not None else self.god.world_state
+            history = world_state["history"]
+            if not isinstance(history, HistoryStore):
+                history = world_state["history"] = HistoryStore(history)
+            return history.render(last=window)
         except Exception as e:
             logger.error(f"获取历史记录失败: {str(e)}")
             return "无法获取历史记录"
@@ -1,12 +1,14 @@
-from camel.agents import ChatAgent
-from camel.messages import BaseMessage
-from camel.models import ModelFactory
-from camel.types import ModelType, ModelPlatformType
-from typing import Dict, List, Tuple, Any
+from camel.types import ModelType
+from typing import Dict, List, Tuple, Any, Callable, Optional
 import re
+import copy
 import logging
 import os
 from safe_token_counter import SimpleTokenCounter
+from http_clients import create_model
+import tracing
+from story_memory import StoryMemory
+from history_store import HistoryStore
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -15,6 +17,139 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+_NARRATIVE_HEADER = re.compile(r"剧情[:：]")
+_OPTIONS_HEADER = re.compile(r"选项[:：]")
+_ROLE_HEADER = re.compile(r"新角色[:：]")
+_OPTION_LINE = re.compile(r"^\s*(?:[-*]|\d+[.)、]?)\s*(.+)$")
+_ROLE_LINE = re.compile(r"新角色[:：]\s*(\S+)\s+([^\n]+)")
+# 节标题最长 4 个字符，流式输出时末尾最多保留这么多字符等待下一块确认
+_HEADER_HOLDBACK = 3
+MAX_OPTIONS = 5
+# 提示词中原样放入的最近事件条数，更早的事件通过 StoryMemory 检索
+RECENT_EVENTS = 3
+
+
+class NarrativeCancelled(Exception):
+    """流式生成剧情时被 should_stop 中止"""
+
+
+class NarrativeFailed(Exception):
+    """生成剧情失败（接口出错或返回空内容），只在 raise_on_error=True 时抛出"""
+
+
+class NarrativeStreamParser:
+    """流式解析“剧情: / 选项: / 新角色:”三段输出
+
+    feed() 返回本块新产生的事件列表：
+      ("narrative", 增量文本)  剧情正文，随到随发
+      ("options", [选项...])   选项块结束（遇到新角色段、空行、满 5 项或输出结束）时发出一次
+      ("new_role", [名字, 描述]) 新角色行完整时发出
+    只做渐进显示用；最终结果仍以 GodAgent._parse_response 对完整文本的解析为准。
+    """
+    PREAMBLE, NARRATIVE, OPTIONS, ROLE, DONE = range(5)
+
+    def __init__(self):
+        self.text = ""
+        self.state = self.PREAMBLE
+        self._pos = 0            # 下一次扫描的起点
+        self._emitted = 0        # 已发出的剧情正文终点
+        self.options = []
+        self._options_sent = False
+        self.new_role = None
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        self.text += chunk
+        return self._advance(final=False)
+
+    def finish(self) -> List[Tuple[str, Any]]:
+        return self._advance(final=True)
+
+    def _close_options(self, events):
+        if not self._options_sent and self.options:
+            self._options_sent = True
+            events.append(("options", self.options[:MAX_OPTIONS]))
+
+    def _advance(self, final):
+        events = []
+        text = self.text
+        while True:
+            if self.state == self.PREAMBLE:
+                match = _NARRATIVE_HEADER.search(text, self._pos)
+                if not match:
+                    self._pos = max(self._pos, len(text) - _HEADER_HOLDBACK)
+                    break
+                self.state = self.NARRATIVE
+                self._pos = self._emitted = match.end()
+
+            elif self.state == self.NARRATIVE:
+                options = _OPTIONS_HEADER.search(text, self._pos)
+                role = _ROLE_HEADER.search(text, self._pos)
+                ends = [m for m in (options, role) if m]
+                if ends:
+                    end = min(ends, key=lambda m: m.start())
+                    delta = text[self._emitted:end.start()].rstrip()
+                    if delta.strip():
+                        events.append(("narrative", delta))
+                    self._emitted = end.start()
+                    self._pos = end.end()
+                    self.state = self.OPTIONS if end is options else self.ROLE
+                    if end is role:
+                        self._pos = end.start()
+                    continue
+                safe_end = len(text) if final else max(self._emitted, len(text) - _HEADER_HOLDBACK)
+                if safe_end > self._emitted:
+                    events.append(("narrative", text[self._emitted:safe_end]))
+                    self._emitted = safe_end
+                self._pos = max(self._pos, len(text) - _HEADER_HOLDBACK)
+                break
+
+            elif self.state == self.OPTIONS:
+                newline = text.find("\n", self._pos)
+                if newline < 0 and not final:
+                    break
+                line_end = len(text) if newline < 0 else newline
+                line = text[self._pos:line_end]
+                role = _ROLE_HEADER.search(line)
+                if role:
+                    # 新角色段开始，选项块结束
+                    self._close_options(events)
+                    self.state = self.ROLE
+                    self._pos += role.start()
+                    continue
+                self._pos = line_end + 1
+                option = _OPTION_LINE.match(line)
+                if option and option.group(1).strip():
+                    self.options.append(option.group(1).strip())
+                    if len(self.options) >= MAX_OPTIONS:
+                        self._close_options(events)
+                elif not line.strip() and self.options:
+                    self._close_options(events)
+                if newline < 0:
+                    self._close_options(events)
+                    self.state = self.DONE
+                    break
+
+            elif self.state == self.ROLE:
+                match = _ROLE_LINE.match(text, self._pos)
+                newline = text.find("\n", self._pos)
+                if match and (newline >= 0 or final):
+                    self.new_role = [match.group(1).strip(), match.group(2).strip()]
+                    events.append(("new_role", self.new_role))
+                    self._pos = match.end()
+                    self.state = self.DONE
+                    continue
+                if final:
+                    self.state = self.DONE
+                break
+
+            else:
+                break
+
+        if final:
+            self._close_options(events)
+        return events
+
+
 class GodAgent:
     def __init__(
             self,
@@ -24,28 +159,39 @@ class GodAgent:
     ):
         try:
             if model is None:
-                model = ModelFactory.create(
-                    model_platform=ModelPlatformType.OPENAI_COMPATIBLE_MODEL,
+                model = create_model(
                     model_type="Qwen/QwQ-32B",
-                    url='https://api.siliconflow.cn/v1',
-                    api_key=os.getenv("SILICONFLOW_API_KEY"),
                     token_counter=SimpleTokenCounter()
                 )
             self.system_message = system_message
             self.model = model
             self.verbose = verbose
+            # 静态提示前缀缓存
+            self._prefix_cache = None   # (背景, 前缀)
+            self._last_prefix = None
+            # 长期剧情记忆：历史事件的检索索引与层级摘要
+            self.memory = StoryMemory()
+            self._sync_memory = True
 
             # 核心记忆组件
             self.world_state = {
                 "background": "",  # 世界观设定
                 "characters": {},  # NPC信息 {name: {traits: [], status: {}}}
-                "history": [],  # 交互历史 [{role, content}]
+                "history": HistoryStore(),  # 交互历史，按 [{role, content}] 列表使用
             }
             logger.info("GodAgent 初始化成功")
         except Exception as e:
             logger.error(f"GodAgent 初始化失败: {str(e)}")
             raise
 
+    def fork(self) -> "GodAgent":
+        """复制一个共享模型、但世界状态独立的 GodAgent，用于推测执行等不影响当前游戏的生成"""
+        clone = copy.copy(self)
+        clone.world_state = copy.deepcopy(self.world_state)
+        # 副本只读地共享长期记忆：分支新增的事件都在最近事件窗口内，不需要写入索引
+        clone._sync_memory = False
+        return clone
+
     def update_world_state(
             self,
             background: str = None,
@@ -68,76 +214,198 @@ class GodAgent:
 
     def generate_narrative(self) -> Tuple[str, List[str], List[str]]:
         """生成剧情和选项"""
+        trace = tracing.span("generate_narrative")
         try:
-            prompt = self._build_prompt()
-            agent = ChatAgent(
-                BaseMessage.make_user_message(role_name="God", content=prompt),
-                model=self.model
+            response = self.model._client.chat.completions.create(
+                model=self.model.model_type,
+                messages=self._build_messages(trace),
+                stream=False
             )
-            response = agent.step(prompt)
-            return self._parse_response(response.msg.content)
+            content = response.choices[0].message.content or ""
+            trace.set(output_text=content)
+            return self._parse_response(content)
         except Exception as e:
             logger.error(f"生成剧情失败: {str(e)}")
+            trace.fail(e)
             # 返回默认值，确保游戏可以继续
             return "发生了意想不到的情况...", ["观察周围", "等待片刻", "继续前进"], []
+        finally:
+            trace.finish()
+
+    def generate_narrative_stream(
+            self,
+            on_event: Optional[Callable[[str, Any], None]] = None,
+            should_stop: Optional[Callable[[], bool]] = None,
+            raise_on_error: bool = False
+    ) -> Tuple[str, List[str], List[str]]:
+        """流式生成剧情和选项
+
+        剧情正文、选项块、新角色在输出过程中通过 on_event(类型, 数据) 逐步回调
+        （事件类型见 NarrativeStreamParser），返回值与 generate_narrative 相同。
+        should_stop() 在每块到达时检查，返回 True 时关闭连接并抛出 NarrativeCancelled。
+        出错时默认返回兜底剧情让游戏继续；raise_on_error=True 时改为抛出 NarrativeFailed
+        （推测分支用它区分真正生成的剧情和兜底剧情）。
+        """
+        trace = tracing.span("generate_narrative", stream=True)
+        parser = NarrativeStreamParser()
+
+        def dispatch(events):
+            if on_event is None:
+                return
+            for kind, data in events:
+                try:
+                    on_event(kind, data)
+                except Exception as callback_error:
+                    logger.error(f"剧情事件回调失败: {str(callback_error)}")
 
-    def _build_prompt(self) -> str:
-        """构造上帝视角提示词"""
         try:
-            # 1. 核心指令
-            prompt = (
-                "## 角色设定\n"
-                "你是游戏世界的叙事控制者，负责推进剧情发展。根据以下要素：\n"
-                "1. 生成1段3-5句的剧情叙述（包含环境描写和角色互动，应当涉及所有已存在角色）（要求输出里所有玩家进行的操作的主语都是'玩家'）\n"
-                "2. 生成3-5个玩家选项（每个选项不超过15字）\n"
-                "3. 新增角色是非常规事件，只有当剧情出现重大转折或需要关键人物时才新增。大部分回合不需要新增角色。\n\n"
+            stream = self.model._client.chat.completions.create(
+                model=self.model.model_type,
+                messages=self._build_messages(trace),
+                stream=True
             )
+            for chunk in stream:
+                if should_stop is not None and should_stop():
+                    stream.close()
+                    raise NarrativeCancelled()
+                if not chunk.choices:
+                    continue
+                content = chunk.choices[0].delta.content or ""
+                if content:
+                    trace.chunk(content)
+                    dispatch(parser.feed(content))
+            dispatch(parser.finish())
+            trace.set(output_text=parser.text)
+            if raise_on_error and not parser.text.strip():
+                raise NarrativeFailed("模型返回了空内容")
+            return self._parse_response(parser.text)
+        except NarrativeCancelled:
+            trace.fail("cancelled")
+            raise
+        except Exception as e:
+            logger.error(f"流式生成剧情失败: {str(e)}")
+            trace.fail(e)
+            if raise_on_error:
+                if isinstance(e, NarrativeFailed):
+                    raise
+                raise NarrativeFailed(str(e)) from e
+            # 返回默认值，确保游戏可以继续
+            return "发生了意想不到的情况...", ["观察周围", "等待片刻", "继续前进"], []
+        finally:
+            trace.finish()
 
-            # 2. 世界状态注入
-            background = self.world_state.get('background', '')
-            prompt += f"### 世界观背景\n{self._truncate_text(background, 1000)}\n\n"
+    def _build_messages(self, trace=None) -> List[Dict]:
+        """两种生成方式共用的请求消息：静态前缀作系统消息，本回合内容作用户消息
 
-            # 3. 历史上下文
-            prompt += "\n### 最近事件\n"
-            history = self.world_state.get('history', [])
-            for event in history[-3:]:
-                role = event.get('role', '玩家')
-                content = self._truncate_text(event.get('content', ''), 200)
-                prompt += f"{role}: {content}\n"
-
-            # 4. 输出格式要求
-            prompt += (
-                "\n## 输出格式要求\n"
-                "请严格按照以下格式输出：\n"
-                "剧情: [生成的叙述文本]\n"
-                "选项:\n"
-                "1. [选项1]\n"
-                "2. [选项2]\n"
-                "3. [选项3]"
-                "若有新增角色，则添加以下内容："
-                "\n新角色:新角色名字 新角色描述"
-            )
+        每回合都是独立的一次请求，不带上一回合的对话（最近事件已包含在本回合内容中）。
+        """
+        prefix = self._static_prefix()
+        turn_prompt = self._build_turn_prompt()
+        self._record_prompt(trace, prefix, turn_prompt)
+        return [
+            {"role": "system", "content": prefix},
+            {"role": "user", "content": turn_prompt}
+        ]
+
+    def _build_prompt(self) -> str:
+        """构造完整提示词（静态前缀 + 本回合内容），用于日志和调试"""
+        return self._static_prefix() + "\n\n" + self._build_turn_prompt()
+
+    def _static_prefix(self) -> str:
+        """每回合逐字节相同的提示词前缀：角色设定、格式要求、示例、世界观背景
 
-            # 输出格式要求部分添加更明确的示例
-            prompt += (
-                "\n## 输出格式示例\n"
-                "剧情: 小镇中人声鼎沸，热闹非凡\n"
-                "选项:\n"
-                "1. 向路人询问热闹的原因\n"
-                "2. 前往镇中广场\n"
-                "剧情: 你走进昏暗的酒馆，看到角落坐着一位神秘的老人...\n"
-                "选项:\n"
-                "1. 上前与老人交谈\n"
-                "2. 在吧台点一杯麦酒\n"
-                "3. 观察酒馆内的情况\n"
-                "新角色:老巫师 穿着灰色长袍，手持橡木法杖"
+        只在背景变化时重新构造；放在系统消息中，便于服务端的前缀（KV）缓存命中。
+        """
+        background = self.world_state.get('background', '')
+        if self._prefix_cache is not None and self._prefix_cache[0] == background:
+            return self._prefix_cache[1]
+        try:
+            prefix = (
+                f"{self.system_message}\n\n"
+                + self._instruction_block()
+                + self._format_block()
+                + self._background_block(background)
             )
+        except Exception as e:
+            logger.error(f"构建提示词失败: {str(e)}")
+            prefix = "生成一个简单的冒险情节"
+        self._prefix_cache = (background, prefix)
+        return prefix
 
-            return prompt
+    def _build_turn_prompt(self) -> str:
+        """每回合变化的部分：长期记忆（故事梗概、相关往事、相关角色）和最近事件"""
+        try:
+            return self._memory_block() + self._events_block() + "\n请根据以上最近事件，按输出格式要求生成下一段剧情。"
         except Exception as e:
             logger.error(f"构建提示词失败: {str(e)}")
             return "生成一个简单的冒险情节"
 
+    def _instruction_block(self) -> str:
+        return (
+            "## 角色设定\n"
+            "你是游戏世界的叙事控制者，负责推进剧情发展。根据以下要素：\n"
+            "1. 生成1段3-5句的剧情叙述（包含环境描写和角色互动，应当涉及所有已存在角色）（要求输出里所有玩家进行的操作的主语都是'玩家'）\n"
+            "2. 生成3-5个玩家选项（每个选项不超过15字）\n"
+            "3. 新增角色是非常规事件，只有当剧情出现重大转折或需要关键人物时才新增。大部分回合不需要新增角色。\n\n"
+        )
+
+    def _format_block(self) -> str:
+        return (
+            "## 输出格式要求\n"
+            "请严格按照以下格式输出：\n"
+            "剧情: [生成的叙述文本]\n"
+            "选项:\n"
+            "1. [选项1]\n"
+            "2. [选项2]\n"
+            "3. [选项3]\n"
+            "若有新增角色，则添加以下内容："
+            "\n新角色:新角色名字 新角色描述\n"
+            "\n## 输出格式示例\n"
+            "剧情: 小镇中人声鼎沸，热闹非凡\n"
+            "选项:\n"
+            "1. 向路人询问热闹的原因\n"
+            "2. 前往镇中广场\n"
+            "剧情: 你走进昏暗的酒馆，看到角落坐着一位神秘的老人...\n"
+            "选项:\n"
+            "1. 上前与老人交谈\n"
+            "2. 在吧台点一杯麦酒\n"
+            "3. 观察酒馆内的情况\n"
+            "新角色:老巫师 穿着灰色长袍，手持橡木法杖\n\n"
+        )
+
+    def _background_block(self, background: str) -> str:
+        return f"### 世界观背景\n{self._truncate_text(background, 1000)}"
+
+    def _memory_block(self) -> str:
+        """从长期记忆中检索与最近事件相关的内容，长度有固定上限"""
+        try:
+            history = self.world_state.get('history', [])
+            if self._sync_memory:
+                self.memory.sync(history)
+            query = "\n".join(event.get('content', '') for event in history[-RECENT_EVENTS:])
+            return self.memory.context(query, self.world_state.get('characters'), exclude_recent=RECENT_EVENTS)
+        except Exception as e:
+            logger.error(f"检索剧情记忆失败: {str(e)}")
+            return ""
+
+    def _events_block(self) -> str:
+        block = "### 最近事件\n"
+        for event in self.world_state.get('history', [])[-RECENT_EVENTS:]:
+            role = event.get('role', '玩家')
+            content = self._truncate_text(event.get('content', ''), 200)
+            block += f"{role}: {content}\n"
+        return block
+
+    def _record_prompt(self, trace, prefix: str, turn_prompt: str):
+        """在追踪记录中写入本回合提示词大小及前缀是否与上回合相同"""
+        prefix_reused = prefix == self._last_prefix
+        self._last_prefix = prefix
+        if trace:
+            prefix_bytes = len(prefix.encode("utf-8"))
+            turn_bytes = len(turn_prompt.encode("utf-8"))
+            trace.set(request_bytes=prefix_bytes + turn_bytes, prefix_bytes=prefix_bytes,
+                      turn_bytes=turn_bytes, prefix_reused=prefix_reused)
+
     def _truncate_text(self, text: str, max_length: int) -> str:
         """截断文本到指定长度"""
         try:
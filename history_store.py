@@ -0,0 +1,115 @@
+import os
+import sys
+import logging
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 传给 NPC 的剧情文本只包含最近这么多条事件，0 表示全部
+NPC_HISTORY_WINDOW = int(os.getenv("NPC_HISTORY_WINDOW", 30))
+
+NARRATIVE_ROLE = "系统"
+
+
+class HistoryEvent:
+    """一条历史事件；与原来的 {"role", "content"} 字典用法兼容（event['role']、event.get('content')）"""
+    __slots__ = ("role", "content")
+
+    def __init__(self, role, content):
+        # 角色名反复出现，驻留后所有事件共享同一个字符串对象
+        self.role = sys.intern(role)
+        self.content = content
+
+    def __getitem__(self, key):
+        if key == "role":
+            return self.role
+        if key == "content":
+            return self.content
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __repr__(self):
+        return f"HistoryEvent({self.role!r}, {self.content!r})"
+
+    def to_dict(self):
+        return {"role": self.role, "content": self.content}
+
+
+def render_event(event):
+    """单条事件在 NPC 剧情文本中的写法"""
+    if event.role == NARRATIVE_ROLE:
+        return event.content + "\n"
+    return f"{event.role} 做了: {event.content.strip()}\n"
+
+
+class HistoryStore:
+    """只追加的剧情历史
+
+    取代 world_state["history"] 中的字典列表：事件为 __slots__ 记录、角色名驻留；
+    支持 append/extend/len/迭代/下标与切片，原有按列表使用的代码无需修改。
+    render() 的完整文本随追加增量维护，render(last=n) 只拼接最近 n 条，
+    每回合生成 NPC 剧情文本的开销只与新增（或窗口内）的事件数有关。
+    """
+    __slots__ = ("_events", "_text", "_rendered")
+
+    def __init__(self, events=None):
+        self._events = []
+        self._text = ""       # 前 _rendered 条事件的完整文本
+        self._rendered = 0
+        if events:
+            self.extend(events)
+
+    @staticmethod
+    def _coerce(event):
+        if isinstance(event, HistoryEvent):
+            return event
+        return HistoryEvent(event.get("role", ""), event.get("content", ""))
+
+    def append(self, event):
+        self._events.append(self._coerce(event))
+
+    def extend(self, events):
+        self._events.extend(self._coerce(event) for event in events)
+
+    def __len__(self):
+        return len(self._events)
+
+    def __iter__(self):
+        return iter(self._events)
+
+    def __getitem__(self, index):
+        return self._events[index]
+
+    def __bool__(self):
+        return bool(self._events)
+
+    def __deepcopy__(self, memo):
+        # 事件只追加、不修改，副本共享事件对象即可
+        clone = HistoryStore()
+        clone._events = list(self._events)
+        clone._text = self._text
+        clone._rendered = self._rendered
+        return clone
+
+    def clear(self):
+        self._events.clear()
+        self._text = ""
+        self._rendered = 0
+
+    def render(self, last=0):
+        """NPC 使用的剧情文本；last > 0 时只包含最近 last 条事件"""
+        if last and last < len(self._events):
+            return "".join(render_event(event) for event in self._events[-last:])
+        if self._rendered < len(self._events):
+            self._text += "".join(render_event(event) for event in self._events[self._rendered:])
+            self._rendered = len(self._events)
+        return self._text
+
+    def to_list(self):
+        return [event.to_dict() for event in self._events]
@@ -0,0 +1,185 @@
+import os
+import asyncio
+import threading
+import logging
+import httpx
+import openai
+from camel.models import ModelFactory
+from camel.types import ModelPlatformType
+from dotenv import load_dotenv
+import response_cache
+
+load_dotenv()
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SILICONFLOW_BASE_URL = 'https://api.siliconflow.cn/v1'
+
+# 连接池与超时配置，可通过环境变量调整
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 20))                # 最大并发连接数
+KEEPALIVE_SIZE = int(os.getenv("HTTP_KEEPALIVE_SIZE", 10))      # 最多保留的空闲连接
+KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 60))
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 10))
+READ_TIMEOUT = float(os.getenv("MODEL_TIMEOUT", 180))
+MAX_RETRIES = 3
+
+_lock = threading.Lock()
+_http_client = None
+_async_http_client = None
+_loop = None
+_openai_clients = {}  # (base_url, api_key, 是否异步, 是否缓存) -> 客户端
+
+
+def _limits():
+    return httpx.Limits(
+        max_connections=POOL_SIZE,
+        max_keepalive_connections=KEEPALIVE_SIZE,
+        keepalive_expiry=KEEPALIVE_EXPIRY
+    )
+
+
+def _timeout():
+    return httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+
+
+def get_http_client():
+    """进程内共享的 httpx 同步客户端（保持长连接）"""
+    global _http_client
+    if _http_client is None:
+        with _lock:
+            if _http_client is None:
+                _http_client = httpx.Client(limits=_limits(), timeout=_timeout(), follow_redirects=True)
+                logger.info(f"共享 HTTP 连接池已创建（最大连接数 {POOL_SIZE}）")
+    return _http_client
+
+
+def get_event_loop():
+    """进程内共享的后台事件循环
+
+    异步客户端的连接绑定在创建它们的事件循环上，所有异步请求都应通过
+    run_coroutine 提交到这个循环中执行。
+    """
+    global _loop
+    if _loop is None:
+        with _lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="http_clients_loop", daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def run_coroutine(coro):
+    """在共享事件循环中执行协程，返回 concurrent.futures.Future（可从任意线程取消）"""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+
+
+def get_async_http_client():
+    """进程内共享的 httpx 异步客户端（只能在 get_event_loop() 的循环中使用）"""
+    global _async_http_client
+    if _async_http_client is None:
+        with _lock:
+            if _async_http_client is None:
+                _async_http_client = httpx.AsyncClient(limits=_limits(), timeout=_timeout(), follow_redirects=True)
+    return _async_http_client
+
+
+def get_openai_client(base_url=SILICONFLOW_BASE_URL, api_key=None, use_cache=True):
+    """按 (base_url, api_key) 复用的 OpenAI 客户端，底层共享同一个连接池
+
+    use_cache 为 True 时 chat.completions.create 经过响应缓存（见 response_cache）。
+    """
+    api_key = api_key or os.getenv("SILICONFLOW_API_KEY")
+    key = (base_url, api_key, False, use_cache)
+    client = _openai_clients.get(key)
+    if client is None:
+        http_client = get_http_client()
+        with _lock:
+            client = _openai_clients.get(key)
+            if client is None:
+                client = openai.OpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    timeout=_timeout(),
+                    max_retries=MAX_RETRIES,
+                    http_client=http_client
+                )
+                if use_cache:
+                    client = response_cache.wrap_client(client)
+                _openai_clients[key] = client
+    return client
+
+
+def get_async_openai_client(base_url=SILICONFLOW_BASE_URL, api_key=None, use_cache=True):
+    """异步版本的 get_openai_client"""
+    api_key = api_key or os.getenv("SILICONFLOW_API_KEY")
+    key = (base_url, api_key, True, use_cache)
+    client = _openai_clients.get(key)
+    if client is None:
+        http_client = get_async_http_client()
+        with _lock:
+            client = _openai_clients.get(key)
+            if client is None:
+                client = openai.AsyncOpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    timeout=_timeout(),
+                    max_retries=MAX_RETRIES,
+                    http_client=http_client
+                )
+                if use_cache:
+                    client = response_cache.wrap_client(client, is_async=True)
+                _openai_clients[key] = client
+    return client
+
+
+def share_model_clients(model, base_url=SILICONFLOW_BASE_URL, api_key=None):
+    """把 CAMEL 模型内部各自创建的客户端替换为共享客户端"""
+    try:
+        model._client = get_openai_client(base_url, api_key)
+        model._async_client = get_async_openai_client(base_url, api_key)
+    except Exception as e:
+        logger.error(f"替换模型客户端失败: {str(e)}")
+    return model
+
+
+def create_model(model_type="Qwen/QwQ-32B", token_counter=None, model_config_dict=None,
+                 base_url=SILICONFLOW_BASE_URL, api_key=None):
+    """创建使用共享连接池的 OpenAI 兼容模型"""
+    api_key = api_key or os.getenv("SILICONFLOW_API_KEY")
+    model = ModelFactory.create(
+        model_platform=ModelPlatformType.OPENAI_COMPATIBLE_MODEL,
+        model_type=model_type,
+        model_config_dict=model_config_dict,
+        url=base_url,
+        api_key=api_key,
+        token_counter=token_counter,
+        timeout=READ_TIMEOUT
+    )
+    return share_model_clients(model, base_url, api_key)
+
+
+def http_get(url, timeout=30):
+    """通过共享连接池发起 GET 请求（用于下载图片等）"""
+    return get_http_client().get(url, timeout=timeout)
+
+
+def close_all():
+    """关闭所有共享客户端（退出时调用）"""
+    global _http_client, _async_http_client, _loop
+    with _lock:
+        try:
+            if _http_client is not None:
+                _http_client.close()
+            if _async_http_client is not None and _loop is not None:
+                asyncio.run_coroutine_threadsafe(_async_http_client.aclose(), _loop).result(timeout=2)
+        except Exception as e:
+            logger.error(f"关闭 HTTP 连接池失败: {str(e)}")
+        if _loop is not None:
+            _loop.call_soon_threadsafe(_loop.stop)
+        _http_client = None
+        _async_http_client = None
+        _loop = None
+        _openai_clients.clear()
@@ -0,0 +1,131 @@
+import os
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import QObject, pyqtSignal
+
+import pic
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ImageRequestCancelled(Exception):
+    """图片请求已被更新的请求取代"""
+
+
+class ImagePipeline(QObject):
+    """后台图片生成流水线
+
+    resize_image / analyze_image_style / 生成 / 下载 全部在线程池中执行，
+    结果通过 Qt 信号返回 GUI 线程。新请求会取代旧请求（最新者优先），
+    旧请求在下一个阶段边界处放弃，其结果不会再发出。
+    """
+    # 图片生成完成: (请求编号, 图片路径)
+    image_ready = pyqtSignal(int, str)
+    # 图片生成失败: (请求编号, 失败原因)
+    image_failed = pyqtSignal(int, str)
+
+    def __init__(self, max_workers=2, model="black-forest-labs/FLUX.1-dev", parent=None):
+        try:
+            super().__init__(parent)
+            self.model = model
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image_pipeline")
+            self._lock = threading.Lock()
+            self._latest_id = 0
+            self._pending = {}  # 请求编号 -> Future
+        except Exception as e:
+            logger.error(f"ImagePipeline 初始化失败: {str(e)}")
+            raise
+
+    def submit(self, prompt, reference_image_path):
+        """提交新的图片请求，并取消所有更早的请求，返回请求编号"""
+        with self._lock:
+            self._latest_id += 1
+            request_id = self._latest_id
+            # 尚未开始的旧请求直接取消，已在执行的旧请求会在阶段边界处放弃
+            for future in self._pending.values():
+                future.cancel()
+            self._pending.clear()
+            future = self._executor.submit(self._run, request_id, prompt, reference_image_path)
+            self._pending[request_id] = future
+        future.add_done_callback(lambda f, rid=request_id: self._forget(rid))
+        logger.info(f"已提交图片请求 #{request_id}")
+        return request_id
+
+    def cancel_all(self):
+        """放弃所有进行中的请求"""
+        with self._lock:
+            self._latest_id += 1
+            for future in self._pending.values():
+                future.cancel()
+            self._pending.clear()
+
+    def is_current(self, request_id):
+        return request_id == self._latest_id
+
+    def shutdown(self):
+        """关闭线程池，不等待进行中的请求"""
+        try:
+            self.cancel_all()
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        except Exception as e:
+            logger.error(f"关闭图片流水线失败: {str(e)}")
+
+    def _forget(self, request_id):
+        with self._lock:
+            self._pending.pop(request_id, None)
+
+    def _check(self, request_id):
+        if not self.is_current(request_id):
+            raise ImageRequestCancelled()
+
+    def _run(self, request_id, prompt, reference_image_path):
+        resized_image_path = None
+        try:
+            if not prompt or not prompt.strip():
+                raise ValueError("提示词为空")
+            if not reference_image_path or not os.path.exists(reference_image_path):
+                raise ValueError("没有可用的基础图片")
+
+            # 调整图片尺寸
+            self._check(request_id)
+            resized_image_path = pic.resize_image(reference_image_path)
+            if not resized_image_path:
+                raise ValueError("调整图片尺寸失败")
+
+            # 分析参考图片风格
+            self._check(request_id)
+            style_hints = pic.analyze_image_style(reference_image_path)
+            style_prompt = pic.build_style_prompt(prompt, style_hints)
+
+            # 生成图像
+            self._check(request_id)
+            image_url = pic.request_style_image(style_prompt, model=self.model)
+            if not image_url:
+                raise ValueError("图像生成请求失败")
+
+            # 下载图像
+            self._check(request_id)
+            image_path = pic.download_image(image_url)
+            if not image_path:
+                raise ValueError("图片下载失败")
+
+            if not self.is_current(request_id):
+                logger.info(f"图片请求 #{request_id} 已过期，丢弃结果")
+                return
+            self.image_ready.emit(request_id, image_path)
+
+        except ImageRequestCancelled:
+            logger.info(f"图片请求 #{request_id} 已被更新的请求取代")
+        except Exception as e:
+            logger.error(f"图片请求 #{request_id} 失败: {str(e)}")
+            if self.is_current(request_id):
+                self.image_failed.emit(request_id, str(e))
+        finally:
+            try:
+                if resized_image_path and os.path.exists(resized_image_path):
+                    os.remove(resized_image_path)
+            except OSError as cleanup_error:
+                logger.error(f"清理临时文件失败: {str(cleanup_error)}")
@@ -1,19 +1,25 @@
 import sys
-import threading
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
                              QProgressBar, QToolBar, QMessageBox, QTextEdit, QFrame, QScrollArea, QStatusBar, QAction,
                              QLabel, QPushButton)
 from PyQt5.QtGui import QFont, QPixmap, QIcon
 from PyQt5.QtCore import Qt, QTimer, pyqtSignal, QObject, QThread
 from ctrller import Controller
-from chatbot import ChatBot
+from chatbot import ChatBot, BackgroundSummaryExtractor
 import logging
 from dotenv import load_dotenv
-from Prompt_injection import check_prompt_injection, truncate_text
-from Sensitive_word_screening import search_keywords_in_text
+from Prompt_injection import truncate_text, check_obfuscated_injection
+from Sensitive_word_screening import start_reloader, stop_reloader
+from Screening_engine import (get_engine, hits_in_category, is_sensitive_category,
+                              CATEGORY_INJECTION, CATEGORY_SENSITIVE)
 import os
+import threading
 
-from pic import generate_style_image
+from image_pipeline import ImagePipeline
+import http_clients
+import tracing
+import speculation
+from savegame import SaveGame, SaveError
 
 load_dotenv()
 
@@ -25,16 +31,21 @@ class ChatWorker(QObject):
     stream_signal = pyqtSignal(str)
     char_signal = pyqtSignal(str)  # 单字符信号，用于更流畅的显示
     batch_signal = pyqtSignal(str)  # 批量字符信号，用于平滑流式输出
+    screen_signal = pyqtSignal(object)  # 输出中检测到的敏感词命中列表（全局字符区间）
+    background_signal = pyqtSignal(str)  # 回复中的【背景总结】在句号到达时立即发出
     finish_signal = pyqtSignal()
 
-    def __init__(self, bot, user_input: str, typing_speed=0.005):
+    def __init__(self, bot, user_input: str, typing_speed=0.005, stop_on_sensitive=False):
         try:
             super().__init__()
             self.bot = bot
             self.user_input = user_input
             self.accumulated_response = ""
+            self.screened_response = []  # 已遮盖敏感词的回复（逐字）
+            self.summary_fed = 0  # 已交给背景总结提取器的字符数
             self.typing_speed = typing_speed  # 可调节的打字速度
             self.batch_size = 3  # 批量发送字符数，平衡流畅度和性能
+            self.stop_on_sensitive = stop_on_sensitive  # 检测到敏感词时是否中止回复
         except Exception as e:
             logger.error(f"ChatWorker 初始化失败: {str(e)}")
 
@@ -46,6 +57,11 @@ class ChatWorker(QObject):
             
             chunk_count = 0
             char_buffer = ""
+            # 流式检测模型输出，自动机状态在块之间延续
+            screener = get_engine().stream()
+            # 增量提取背景总结，不再反复扫描整段回复；只读取已遮盖敏感词、不会再有新命中的文本，
+            # 背景总结会进入 GodAgent 的提示词和存档
+            summary_extractor = BackgroundSummaryExtractor()
             
             for chunk in self.bot.chat_stream(self.user_input):
                 chunk_count += 1
@@ -72,6 +88,16 @@ class ChatWorker(QObject):
                 
                 # 同时发送完整的chunk用于兼容
                 self.stream_signal.emit(chunk)
+
+                self.screened_response.extend(chunk)
+                hits = self.report_sensitive(screener.feed(chunk))
+                self.feed_summary(summary_extractor, screener.settled())
+                if hits and self.stop_on_sensitive:
+                    logger.warning("回复中检测到敏感词，已中止输出")
+                    break
+            else:
+                self.report_sensitive(screener.finish())
+                self.feed_summary(summary_extractor, len(self.screened_response))
             
             print(f"=== ChatWorker 完成，共收到{chunk_count}个响应块 ===")  # 调试日志
             self.finish_signal.emit()
@@ -81,6 +107,25 @@ class ChatWorker(QObject):
             self.stream_signal.emit(f"处理聊天时出现错误: {str(e)}")
             self.finish_signal.emit()
 
+    def report_sensitive(self, hits):
+        """只报告敏感词类别的命中（提示注入词在正常叙述中很常见），并在 screened_response 中遮盖"""
+        hits = [hit for hit in hits if any(is_sensitive_category(c) for c in hit.categories)]
+        if hits:
+            for hit in hits:
+                for i in range(hit.start, min(hit.end, len(self.screened_response))):
+                    self.screened_response[i] = "*"
+            self.screen_signal.emit(hits)
+        return hits
+
+    def feed_summary(self, extractor, end):
+        """把 screened_response 中到 end 为止、尚未处理的已遮盖文本交给背景总结提取器"""
+        if end <= self.summary_fed:
+            return
+        background = extractor.feed("".join(self.screened_response[self.summary_fed:end]))
+        self.summary_fed = end
+        if background:
+            self.background_signal.emit(background)
+
 class MainWindow(QMainWindow):
     def __init__(self):
         try:
@@ -125,6 +170,12 @@ class MainWindow(QMainWindow):
             # 流式输出相关状态
             self.is_streaming = False
             self.current_response = ""
+            # 剧情流式显示相关状态
+            self._stream_base_text = None   # 本轮剧情开始前的显示内容
+            self._stream_text = ""          # 本轮已显示的流式剧情段落
+            self._early_options = None      # 剧情生成过程中提前显示的选项
+            self.speculation_enabled = speculation.SPECULATION_ENABLED
+            self._resuming = False          # 读档后的第一次界面更新不重新生成图片
             self.cursor_visible = True
             self.typing_speed = 0.005  # 默认打字速度
             
@@ -138,6 +189,11 @@ class MainWindow(QMainWindow):
             self.ui_update_timer.setSingleShot(True)
             self.pending_ui_update = False
             
+            # 后台图片生成流水线，结果通过信号回到GUI线程
+            self.image_pipeline = ImagePipeline(parent=self)
+            self.image_pipeline.image_ready.connect(self.on_image_ready)
+            self.image_pipeline.image_failed.connect(self.on_image_failed)
+            
             # 创建状态栏
             self.create_status_bar()
             
@@ -151,6 +207,10 @@ class MainWindow(QMainWindow):
             self.setup_ui()
             
             QTimer.singleShot(0, self.start_game_thread)
+            # 在后台预先构建检测引擎，避免首次发送消息时卡顿
+            threading.Thread(target=get_engine, daemon=True).start()
+            # 监视词库目录，修改词表后无需重启游戏
+            start_reloader()
             logger.info("MainWindow 初始化成功")
         except Exception as e:
             logger.error(f"MainWindow 初始化失败: {str(e)}")
@@ -185,6 +245,12 @@ class MainWindow(QMainWindow):
             new_game_action.setShortcut('Ctrl+N')
             new_game_action.triggered.connect(self.new_game)
             file_menu.addAction(new_game_action)
+
+            # 从自动存档继续
+            load_game_action = QAction('继续游戏(&L)', self)
+            load_game_action.setShortcut('Ctrl+L')
+            load_game_action.triggered.connect(self.load_game)
+            file_menu.addAction(load_game_action)
             
             file_menu.addSeparator()
             
@@ -201,6 +267,25 @@ class MainWindow(QMainWindow):
             typing_speed_action = QAction('打字机速度(&T)', self)
             typing_speed_action.triggered.connect(self.show_typing_speed_dialog)
             settings_menu.addAction(typing_speed_action)
+
+            settings_menu.addSeparator()
+
+            # 性能追踪
+            trace_action = QAction('记录性能追踪(&R)', self)
+            trace_action.setCheckable(True)
+            trace_action.setChecked(tracing.is_enabled())
+            trace_action.toggled.connect(tracing.set_enabled)
+            settings_menu.addAction(trace_action)
+
+            speculation_action = QAction('推测生成下一回合(&S)', self)
+            speculation_action.setCheckable(True)
+            speculation_action.setChecked(self.speculation_enabled)
+            speculation_action.toggled.connect(self.set_speculation_enabled)
+            settings_menu.addAction(speculation_action)
+
+            trace_summary_action = QAction('性能统计(&P)', self)
+            trace_summary_action.triggered.connect(self.show_trace_summary)
+            settings_menu.addAction(trace_summary_action)
             
             # 帮助菜单
             help_menu = menubar.addMenu('帮助(&H)')
@@ -242,10 +327,17 @@ class MainWindow(QMainWindow):
                 # 重置游戏状态
                 self.background_summary = ""
                 self.game_started = False
+                self.image_pipeline.cancel_all()
+                # 立即中止仍在进行的助手回复
+                if self.bot is not None:
+                    self.bot.cancel()
                 
                 # 清除选项按钮
                 self.clear_options()
                 self.show_options_hint("等待游戏开始...")
+                self._stream_base_text = None
+                self._stream_text = ""
+                self._early_options = None
                 
                 # 重置剧情显示
                 self.narrative_content.setText("欢迎来到多智能体剧情游戏！\n请在下方输入游戏背景开始你的冒险...")
@@ -264,9 +356,7 @@ class MainWindow(QMainWindow):
                 """)
                 
                 # 重启控制器线程
-                if hasattr(self, 'controller_thread'):
-                    self.controller_thread.quit()
-                    self.controller_thread.wait()
+                self.stop_game_thread()
                 
                 QTimer.singleShot(100, self.start_game_thread)
                 
@@ -287,35 +377,35 @@ class MainWindow(QMainWindow):
         """重新生成当前剧情图片"""
         try:
             if hasattr(self, 'last_narrative') and self.last_narrative:
-                self.status_bar.showMessage("正在重新生成图片...")
-                self.progress_bar.setVisible(True)
-                
-                # 异步生成图片
-                def generate_image():
-                    try:
-                        if hasattr(self, 'last_image_path') and os.path.exists(self.last_image_path):
-                            new_image_path = generate_style_image(self.last_narrative, self.last_image_path)
-                            if new_image_path and os.path.exists(new_image_path):
-                                self.display_image(new_image_path)
-                                self.last_image_path = new_image_path
-                                self.status_bar.showMessage("图片重新生成完成")
-                            else:
-                                self.status_bar.showMessage("图片生成失败")
-                        else:
-                            self.status_bar.showMessage("没有可用的基础图片")
-                    except Exception as e:
-                        logger.error(f"生成图片失败: {str(e)}")
-                        self.status_bar.showMessage("图片生成失败")
-                    finally:
-                        self.progress_bar.setVisible(False)
-                
-                # 在新线程中生成图片
-                threading.Thread(target=generate_image, daemon=True).start()
+                if hasattr(self, 'last_image_path') and os.path.exists(self.last_image_path):
+                    self.status_bar.showMessage("正在重新生成图片...")
+                    self.progress_bar.setVisible(True)
+                    self.image_pipeline.submit(self.last_narrative, self.last_image_path)
+                else:
+                    self.status_bar.showMessage("没有可用的基础图片")
             else:
                 QMessageBox.information(self, '提示', '暂时没有可生成图片的剧情内容')
         except Exception as e:
             logger.error(f"生成图片失败: {str(e)}")
     
+    def set_speculation_enabled(self, enabled):
+        """开关推测生成：玩家阅读选项时提前为每个选项生成下一回合，会额外消耗模型调用"""
+        self.speculation_enabled = enabled
+        if hasattr(self, 'controller'):
+            self.controller.speculator.set_enabled(enabled)
+
+    def show_trace_summary(self):
+        """显示各阶段的耗时统计（p50/p95）"""
+        try:
+            text = tracing.format_summary()
+            if hasattr(self, 'controller') and self.controller.speculator.enabled:
+                stats = self.controller.speculator.stats()
+                text += (f"\n推测生成: 命中 {stats['hits']} / 未命中 {stats['misses']}  "
+                         f"调用 {stats['calls']}/{stats['max_calls']}（被取消分支 {stats['wasted_calls']}）")
+            QMessageBox.information(self, '性能统计', text)
+        except Exception as e:
+            logger.error(f"显示性能统计失败: {str(e)}")
+
     def show_about(self):
         """显示关于对话框"""
         try:
@@ -692,12 +782,81 @@ class MainWindow(QMainWindow):
             logger.error(f"事件过滤失败: {str(e)}")
             return False
 
-    def start_game_thread(self):
+    def stop_game_thread(self):
+        """停止当前的控制器线程（等待选择或背景时立即退出，生成中则在本回合结束后退出）"""
+        if hasattr(self, 'controller'):
+            self.controller.speculator.shutdown()
+        if hasattr(self, 'controller_thread'):
+            self.controller_thread.requestInterruption()
+            self.controller_thread.quit()
+            self.controller_thread.wait()
+
+    def load_game(self):
+        """从自动存档继续游戏"""
+        try:
+            save = SaveGame()
+            if not save.exists():
+                QMessageBox.information(self, '继续游戏', '没有找到存档。')
+                return
+            if self.game_started:
+                reply = QMessageBox.question(self, '继续游戏', '读取存档将放弃当前进度，确定继续吗？',
+                                             QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+                if reply != QMessageBox.Yes:
+                    return
+            state = save.load()
+        except SaveError as e:
+            QMessageBox.warning(self, '继续游戏', f'读取存档失败：{str(e)}')
+            return
+        except Exception as e:
+            logger.error(f"读取存档失败: {str(e)}")
+            QMessageBox.warning(self, '继续游戏', f'读取存档失败：{str(e)}')
+            return
+
+        try:
+            self.stop_game_thread()
+            self.image_pipeline.cancel_all()
+            if self.bot is not None:
+                self.bot.cancel()
+            # 恢复助手对话
+            if state.get("chat") and self.init_chatbot():
+                self.bot.context.import_state(state["chat"])
+            self.background_summary = state["background"]
+            self.game_started = True
+
+            image_path = state.get("last_image_path")
+            if image_path and os.path.exists(image_path):
+                self.last_image_path = image_path
+                self.display_image(image_path)
+
+            self.clear_options()
+            self._stream_base_text = None
+            self._stream_text = ""
+            self._early_options = None
+            self.narrative_content.setText(f"📂 已读取存档（第 {state['turn']} 回合）")
+            self._resuming = True
+            self.start_game_thread(resume_state=state, save=save)
+            self.status_bar.showMessage(f"已读取存档：第 {state['turn']} 回合")
+        except Exception as e:
+            logger.error(f"恢复存档失败: {str(e)}")
+
+    def collect_ui_state(self):
+        """控制器自动存档时调用：对话记录与当前图片（在控制器线程中执行，只读取）"""
+        state = {"last_image_path": getattr(self, 'last_image_path', None)}
+        if self.bot is not None:
+            state["chat"] = self.bot.context.export_state()
+            state["chat_version"] = self.bot.context.version
+        return state
+
+    def start_game_thread(self, resume_state=None, save=None):
         try:
-            self.controller = Controller()
+            self.controller = Controller(resume_state, save)
+            self.controller.extra_state = self.collect_ui_state
+            self.controller.speculator.enabled = self.speculation_enabled
             self.controller_thread = QThread()
             self.controller.moveToThread(self.controller_thread)
             self.controller.update_signal.connect(self.update_ui)
+            self.controller.narrative_stream_signal.connect(self.on_narrative_delta)
+            self.controller.options_signal.connect(self.on_early_options)
             self.controller.NPC_signal.connect(self.update_NPC)
             self.controller_thread.started.connect(self.controller.run)
             self.controller_thread.start()
@@ -718,23 +877,17 @@ class MainWindow(QMainWindow):
             # 更新剧情显示
             self.update_narrative_display(narrative, new_role)
             
-            # 生成并显示剧情图片
-            if hasattr(self, 'last_image_path') and os.path.exists(self.last_image_path):
-                try:
-                    self.status_bar.showMessage("正在生成剧情图片...")
-                    new_image_path = generate_style_image(narrative, self.last_image_path)
-                    if new_image_path and os.path.exists(new_image_path):
-                        self.display_image(new_image_path)
-                        self.last_image_path = new_image_path
-                        self.status_bar.showMessage("剧情图片生成完成")
-                    else:
-                        self.status_bar.showMessage("图片生成失败，使用默认图片")
-                except Exception as img_error:
-                    logger.error(f"图片生成错误: {str(img_error)}")
-                    self.status_bar.showMessage("图片生成失败，继续游戏")
+            # 在后台生成剧情图片，不阻塞剧情和选项的显示（读档时沿用存档中的图片）
+            if self._resuming:
+                self._resuming = False
+            elif hasattr(self, 'last_image_path') and os.path.exists(self.last_image_path):
+                self.image_pipeline.submit(narrative, self.last_image_path)
             
-            # 更新选项按钮
-            if options:
+            # 更新选项按钮（生成过程中已提前显示的选项保持不变，玩家可能已经点选）
+            if self._early_options is not None:
+                self._early_options = None
+                self.status_bar.showMessage("界面更新完成 - 请选择你的行动")
+            elif options:
                 self.update_options(options)
                 self.status_bar.showMessage("界面更新完成 - 请选择你的行动")
             else:
@@ -746,6 +899,58 @@ class MainWindow(QMainWindow):
             logger.error(f"更新UI失败: {str(e)}")
             self.status_bar.showMessage("界面更新失败")
     
+    def on_image_ready(self, request_id, image_path):
+        """后台图片生成完成"""
+        try:
+            if not self.image_pipeline.is_current(request_id):
+                return
+            if image_path and os.path.exists(image_path):
+                self.display_image(image_path)
+                self.last_image_path = image_path
+                self.status_bar.showMessage("剧情图片生成完成")
+            if not self.is_streaming:
+                self.progress_bar.setVisible(False)
+        except Exception as e:
+            logger.error(f"显示生成图片失败: {str(e)}")
+    
+    def on_image_failed(self, request_id, reason):
+        """后台图片生成失败"""
+        try:
+            if not self.image_pipeline.is_current(request_id):
+                return
+            self.status_bar.showMessage(f"图片生成失败，继续游戏: {reason}")
+            if not self.is_streaming:
+                self.progress_bar.setVisible(False)
+        except Exception as e:
+            logger.error(f"处理图片生成失败: {str(e)}")
+    
+    def on_narrative_delta(self, delta):
+        """剧情生成过程中逐段显示剧情正文"""
+        try:
+            if self._stream_base_text is None:
+                current_text = self.narrative_content.text()
+                if current_text == "欢迎来到多智能体剧情游戏！\n请在下方输入游戏背景开始你的冒险...":
+                    self._stream_base_text = ""
+                    self._stream_text = "📖 "
+                else:
+                    self._stream_base_text = current_text
+                    self._stream_text = "\n\n📖 "
+                self.status_bar.showMessage("正在生成剧情...")
+            self._stream_text += delta.lstrip() if self._stream_text.endswith("📖 ") else delta
+            self.narrative_content.setText(self._stream_base_text + self._stream_text)
+            QTimer.singleShot(100, self.scroll_narrative_to_bottom)
+        except Exception as e:
+            logger.error(f"流式显示剧情失败: {str(e)}")
+
+    def on_early_options(self, options):
+        """剧情仍在生成时先显示已解析出的选项"""
+        try:
+            self._early_options = options
+            self.update_options(options)
+            self.status_bar.showMessage("选项已就绪 - 剧情仍在生成中")
+        except Exception as e:
+            logger.error(f"提前显示选项失败: {str(e)}")
+
     def update_narrative_display(self, narrative, new_role=None):
         """更新剧情显示区域"""
         try:
@@ -759,7 +964,17 @@ class MainWindow(QMainWindow):
                 new_content += f"\n\n🎭 新角色登场：{new_role[0]}!"
             
             # 更新显示内容
-            if current_text == "欢迎来到多智能体剧情游戏！\n请在下方输入游戏背景开始你的冒险...":
+            if self._stream_base_text is not None:
+                # 用完整解析结果替换流式显示的段落，保留其后追加的内容（如提前做出的选择）
+                streamed = self._stream_base_text + self._stream_text
+                tail = current_text[len(streamed):] if current_text.startswith(streamed) else ""
+                if self._stream_base_text:
+                    self.narrative_content.setText(self._stream_base_text + new_content + tail)
+                else:
+                    self.narrative_content.setText(new_content.strip() + tail)
+                self._stream_base_text = None
+                self._stream_text = ""
+            elif current_text == "欢迎来到多智能体剧情游戏！\n请在下方输入游戏背景开始你的冒险...":
                 # 第一次更新，替换欢迎文本
                 self.narrative_content.setText(new_content.strip())
             else:
@@ -925,6 +1140,20 @@ class MainWindow(QMainWindow):
         except Exception as e:
             logger.error(f"窗口大小调整失败: {str(e)}")
     
+    def closeEvent(self, event):
+        """关闭窗口时停止后台图片生成、词库监视和对话压缩"""
+        try:
+            self.image_pipeline.shutdown()
+            if hasattr(self, 'controller'):
+                self.controller.speculator.shutdown()
+            stop_reloader()
+            if self.bot is not None:
+                self.bot.close()
+            http_clients.close_all()
+        except Exception as e:
+            logger.error(f"关闭后台任务失败: {str(e)}")
+        super().closeEvent(event)
+    
     def init_chatbot(self):
         """初始化ChatBot实例"""
         if self.bot is None:
@@ -968,12 +1197,17 @@ class MainWindow(QMainWindow):
             if user_text == "__超出字数限制":
                 QMessageBox.warning(self, "字数限制检测", "输入字符过多，超出字数限制")
                 return
-            found_keywords = check_prompt_injection(user_text)
+            # 提示注入和敏感词在同一次扫描中完成
+            hits = get_engine().screen(user_text)
+            found_keywords = hits_in_category(hits, CATEGORY_INJECTION)
+            if not found_keywords:
+                # 精确匹配未命中时，只有含空格、全角、繁体等变形写法的输入才归一化后再检查一遍
+                found_keywords = check_obfuscated_injection(user_text)
             if found_keywords:
                 warning_msg = f"检测到潜在的提示注入关键词：{','.join(found_keywords)}"
                 QMessageBox.warning(self, "提示注入检测", warning_msg)
                 return
-            sensitive_keywords = search_keywords_in_text(user_text)
+            sensitive_keywords = hits_in_category(hits, CATEGORY_SENSITIVE)
             if sensitive_keywords:
                 warning_msg = f"检测到敏感词：{', '.join(sensitive_keywords)}\n请修改内容避免违规。"
                 QMessageBox.warning(self, "敏感词检测", warning_msg)
@@ -1008,9 +1242,10 @@ class MainWindow(QMainWindow):
             self.chat_worker.moveToThread(self.chat_thread)
 
             # 连接信号
-            self.chat_worker.stream_signal.connect(self.process_chat_response)
+            self.chat_worker.background_signal.connect(self.on_background_summary)
             self.chat_worker.char_signal.connect(self.process_char_response)
             self.chat_worker.batch_signal.connect(self.process_batch_response)  # 新增批量字符处理
+            self.chat_worker.screen_signal.connect(self.redact_response)
             self.chat_worker.finish_signal.connect(self.chat_finished)
             self.chat_thread.started.connect(self.chat_worker.run)
             self.chat_thread.finished.connect(self.chat_worker.deleteLater)
@@ -1117,6 +1352,19 @@ class MainWindow(QMainWindow):
         except Exception as e:
             logger.error(f"处理批量字符AI响应失败: {str(e)}")
 
+    def redact_response(self, hits):
+        """用星号遮盖回复中检测到的敏感词"""
+        try:
+            response = list(self.current_response)
+            for hit in hits:
+                for i in range(hit.start, min(hit.end, len(response))):
+                    response[i] = "*"
+            self.current_response = "".join(response)
+            self.request_ui_update()
+            self.status_bar.showMessage(f"AI回复中检测到 {len(hits)} 处敏感内容，已遮盖")
+        except Exception as e:
+            logger.error(f"遮盖敏感内容失败: {str(e)}")
+
     def chat_finished(self):
         """聊天完成后的处理"""
         try:
@@ -1167,29 +1415,16 @@ class MainWindow(QMainWindow):
         except Exception as e:
             logger.error(f"处理单字符AI响应失败: {str(e)}")
 
-    def process_chat_response(self, chunk: str):
-        """处理AI响应流 - 兼容模式，主要用于背景总结检测"""
+    def on_background_summary(self, summary: str):
+        """聊天线程识别出完整的背景总结后调用"""
         try:
-            chunk = chunk.strip()
-            if chunk != '':
-                # 检查是否包含背景总结
-                if "【背景总结】" in self.current_response and self.background_summary == "":
-                    if "。" in self.current_response:
-                        # 提取背景总结内容
-                        if "【背景总结】：" in self.current_response:
-                            summary_part = self.current_response.split("【背景总结】：")[1]
-                            self.background_summary = summary_part.split("。")[0] + "。"
-                        elif "【背景总结】:" in self.current_response:
-                            summary_part = self.current_response.split("【背景总结】:")[1]
-                            self.background_summary = summary_part.split("。")[0] + "。"
-                        
-                        if self.background_summary:
-                            # 发送背景到游戏控制器
-                            self.send_background(self.background_summary)
-                            self.status_bar.showMessage("游戏背景已设置，剧情即将开始...")
-                            
+            if self.background_summary == "":
+                self.background_summary = summary
+                # 发送背景到游戏控制器
+                self.send_background(self.background_summary)
+                self.status_bar.showMessage("游戏背景已设置，剧情即将开始...")
         except Exception as e:
-            logger.error(f"处理AI响应失败: {str(e)}")
+            logger.error(f"处理背景总结失败: {str(e)}")
 
     def show_typing_speed_dialog(self):
         """显示打字机速度设置对话框"""
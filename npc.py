@@ -1,9 +1,14 @@
 from camel.agents import ChatAgent
-from camel.models import ModelFactory
-from camel.types import ModelPlatformType
 import logging
 import os
+import re
+import time
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from safe_token_counter import SimpleTokenCounter
+from http_clients import create_model
+import tracing
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -12,22 +17,122 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 同时请求的 NPC 数，1 表示按角色顺序逐个调用；也是全局 NPC 线程池的大小
+NPC_CONCURRENCY = int(os.getenv("NPC_CONCURRENCY", 4))
+# 单个 NPC 的最长等待时间（秒，从提交到线程池算起），超时的角色本回合不发言
+NPC_TIMEOUT = float(os.getenv("NPC_TIMEOUT", 90))
+# 通过环境变量 NPC_BATCH=1 开启批量模式：所有角色合并为一次请求，每个角色回复一行
+NPC_BATCH = os.getenv("NPC_BATCH", "0") == "1"
+# 批量请求在追踪和日志中使用的名字
+BATCH_NAME = "全体角色"
+# 每个角色的记忆只保留最近这么多条消息（一问一答为两条），请求的上下文不超过 NPC_MEMORY_TOKENS
+NPC_MEMORY_WINDOW = int(os.getenv("NPC_MEMORY_WINDOW", 6))
+NPC_MEMORY_TOKENS = int(os.getenv("NPC_MEMORY_TOKENS", 8000))
+# 最多保留多少个角色的 agent，超出时淘汰最久没有发言的角色
+NPC_MAX_AGENTS = int(os.getenv("NPC_MAX_AGENTS", 16))
+
+# 批量回复中的一行：可选的列表符号、可选的加粗或括号、角色名、冒号、言行
+_BATCH_LINE = re.compile(r"^\s*(?:[-*•]|\d+[.、)）])?\s*[*【\[]*\s*(.+?)\s*[*】\]]*\s*[：:]\s*(.+?)\s*$")
+
+
+class NpcAgents:
+    """每个角色一个 ChatAgent，记忆按条数和 token 数限制，角色数超过 capacity 时按最近使用淘汰
+
+    各角色的记忆互不相通，不会再出现一个角色延续另一个角色的口吻；agent 的存储在每次
+    问答后裁剪到窗口大小，整局游戏中内存和每次请求的输入长度都保持有界。
+    每个角色还有一把锁（lock(name)），同一角色的请求依次在它自己的 agent 上进行。
+    """
+
+    def __init__(self, model=None, capacity=NPC_MAX_AGENTS, window=NPC_MEMORY_WINDOW, token_limit=NPC_MEMORY_TOKENS):
+        self.model = model
+        self.capacity = capacity
+        self.window = window
+        self.token_limit = token_limit
+        self.evictions = 0
+        self._agents = OrderedDict()  # 名字 -> ChatAgent，最近使用的在末尾
+        self._locks = {}              # 名字 -> 该角色 agent 的锁
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._agents)
+
+    def __contains__(self, name):
+        return name in self._agents
+
+    def get(self, name):
+        """取出角色的 agent（没有则新建），并标记为最近使用"""
+        with self._lock:
+            npc_agent = self._agents.pop(name, None)
+            if npc_agent is None:
+                npc_agent = self._new_agent()
+            self._agents[name] = npc_agent
+            while len(self._agents) > self.capacity:
+                evicted, _ = self._agents.popitem(last=False)
+                self._locks.pop(evicted, None)
+                self.evictions += 1
+                logger.info(f"角色 {evicted} 长时间未发言，已释放其记忆")
+            return npc_agent
+
+    def lock(self, name):
+        """角色 agent 的锁；请求和记忆裁剪都在持有它时进行"""
+        with self._lock:
+            return self._locks.setdefault(name, threading.Lock())
+
+    def _new_agent(self):
+        return ChatAgent(
+            model=self.model if self.model is not None else model,
+            output_language='中文',
+            message_window_size=self.window,
+            token_limit=self.token_limit
+        )
+
+    def copy_agent(self, npc_agent):
+        """带记忆的 agent 副本
+
+        不用 ChatAgent.clone(with_memory=True)：它会在复制来的记忆前再加一条系统消息。
+        """
+        copy = self._new_agent()
+        copy.memory.clear()
+        copy.memory.write_records([record.memory_record for record in npc_agent.memory.retrieve()])
+        return copy
+
+    def clone(self):
+        """带记忆的副本，推测执行时使用，不影响当前游戏"""
+        with self._lock:
+            copy = NpcAgents(self.model, self.capacity, self.window, self.token_limit)
+            for name, npc_agent in self._agents.items():
+                copy._agents[name] = self.copy_agent(npc_agent)
+            return copy
+
+    def clear(self):
+        with self._lock:
+            self._agents.clear()
+            self._locks.clear()
+
+
+def trim_memory(npc_agent):
+    """把 agent 的存储裁剪到记忆窗口以内；窗口只限制放进请求的条数，存储本身会一直增长"""
+    try:
+        records = [record.memory_record for record in npc_agent.memory.retrieve()]
+        npc_agent.memory.clear()
+        npc_agent.memory.write_records(records)
+    except Exception as e:
+        logger.error(f"裁剪 NPC 记忆失败: {str(e)}")
+
+
 try:
     # 优先从环境变量读取 API key，如果没有则使用硬编码值
     api_key = os.getenv("SILICONFLOW_API_KEY")
     
-    model = ModelFactory.create(
-        model_platform=ModelPlatformType.OPENAI_COMPATIBLE_MODEL,
+    model = create_model(
         model_type="Qwen/QwQ-32B",
-        url='https://api.siliconflow.cn/v1',
         api_key=api_key,
         token_counter=SimpleTokenCounter()
     )
 
-    agent = ChatAgent(
-        model=model,
-        output_language='中文'
-    )
+    agents = NpcAgents()
+    # 所有 NPC 请求共用的有界线程池：超时后仍在运行的请求也占着名额，后台线程数不会超过 NPC_CONCURRENCY
+    _executor = ThreadPoolExecutor(max_workers=max(1, NPC_CONCURRENCY), thread_name_prefix="npc")
     logger.info("NPC 模块初始化成功")
 except Exception as e:
     logger.error(f"NPC 模块初始化失败: {str(e)}")
@@ -35,15 +140,22 @@ except Exception as e:
 
 #while True:
 #    str = input("You: ")
-#    response = agent.step(str)
+#    response = agents.get('小明').step(str)
 #    print(response.msgs[0].content)
 
 
 #str由character，info_str构成
 #character是形如['钟离','胡桃’,'空']
 #info_str则为当前剧情加玩家选择比如'四个人一起玩炸金花，玩家选择作弊。'
-def interact(str):
-    """处理NPC交互"""
+def interact(str, npc_agents=None, should_stop=None, concurrency=None, timeout=None, batch=None):
+    """处理NPC交互
+
+    npc_agents 默认为模块级的 agents（每个角色一个 agent）；推测执行时传入其副本，避免影响当前游戏。
+    should_stop() 在每次请求开始前检查，返回 True 时放弃剩余角色。
+    concurrency > 1 时并发请求各角色（默认 NPC_CONCURRENCY），单个请求超过 timeout 秒
+    （默认 NPC_TIMEOUT）未返回则跳过；batch 为 True 时（默认 NPC_BATCH）所有角色合并为
+    一次请求，解析失败的角色再逐个请求。返回结果始终按角色顺序排列。
+    """
     try:
         if not str or len(str) != 2:
             logger.error("传入参数格式错误")
@@ -55,37 +167,194 @@ def interact(str):
             logger.warning("角色信息或情节信息为空")
             return []
             
-        return_info = []
-        
+        npc_agents = agents if npc_agents is None else npc_agents
+        concurrency = NPC_CONCURRENCY if concurrency is None else concurrency
+        timeout = NPC_TIMEOUT if timeout is None else timeout
+        batch = NPC_BATCH if batch is None else batch
+
+        actives = []
         for dic in character.keys():
-            try:
-                name = dic
-                des = character[dic].get("traits", "")
-                
-                if not name or not des:
-                    logger.warning(f"角色 {name} 信息不完整")
-                    continue
-                    
-                input_text = info_str + '你是' + name + '，你的性格如下：' + des + '请以' + name + "为主语写一下接下来的言行，控制在50字以内。要求能够让故事能持续下去，不必完结太快。"
-                
-                response = agent.step(input_text)
-                
-                if response and response.msgs and len(response.msgs) > 0:
-                    content = response.msgs[0].content
-                    return_info.append({"role": name, "content": content})
-                else:
-                    logger.warning(f"角色 {name} 响应为空")
-                    
-            except Exception as char_error:
-                logger.error(f"处理角色 {name} 时出错: {str(char_error)}")
+            name = dic
+            des = character[dic].get("traits", "")
+
+            if not name or not des:
+                logger.warning(f"角色 {name} 信息不完整")
                 continue
-                
-        return return_info
+
+            actives.append((name, des))
+
+        if batch and len(actives) > 1:
+            return _interact_batch(actives, info_str, npc_agents, should_stop, concurrency, timeout)
+
+        prompts = [(name, build_prompt(info_str, name, des)) for name, des in actives]
+        return _request(prompts, npc_agents, should_stop, concurrency, timeout)
         
     except Exception as e:
         logger.error(f"NPC 交互失败: {str(e)}")
         return []
 
+
+def _request(prompts, npc_agents, should_stop, concurrency, timeout):
+    """用各自的 agent 发送 [(名字, 提示词)] 中的每个请求，返回 [{"role", "content"}]"""
+    if concurrency > 1 and prompts:
+        return _interact_concurrent(prompts, npc_agents, should_stop, concurrency, timeout)
+
+    return_info = []
+    for name, input_text in prompts:
+        if should_stop is not None and should_stop():
+            break
+        try:
+            response = _locked_step(npc_agents, name, input_text, None, timeout)
+            if response is not None:
+                return_info.append({"role": name, "content": response.content})
+        except Exception as char_error:
+            logger.error(f"处理角色 {name} 时出错: {str(char_error)}")
+            continue
+
+    return return_info
+
+
+def _interact_batch(actives, info_str, npc_agents, should_stop, concurrency, timeout):
+    """一次请求生成所有角色的言行；回复中缺失或无法解析的角色改为逐个请求
+
+    批量请求使用名为 BATCH_NAME 的 agent，它的记忆同样有界。
+    """
+    names = [name for name, _ in actives]
+    replies = {}
+    result = _request([(BATCH_NAME, build_batch_prompt(info_str, actives))], npc_agents, should_stop,
+                      concurrency, timeout)
+    if result:
+        replies = parse_batch_reply(result[0]["content"], names)
+
+    missing = [(name, des) for name, des in actives if name not in replies]
+    if missing:
+        logger.info(f"批量回复中缺少 {len(missing)} 个角色，改为逐个请求: {[name for name, _ in missing]}")
+        prompts = [(name, build_prompt(info_str, name, des)) for name, des in missing]
+        for info in _request(prompts, npc_agents, should_stop, concurrency, timeout):
+            replies[info["role"]] = info["content"]
+
+    return [{"role": name, "content": replies[name]} for name in names if name in replies]
+
+
+def build_prompt(info_str, name, des):
+    return info_str + '你是' + name + '，你的性格如下：' + des + '请以' + name + "为主语写一下接下来的言行，控制在50字以内。要求能够让故事能持续下去，不必完结太快。"
+
+
+def build_batch_prompt(info_str, actives):
+    """actives 为 [(名字, 性格)]"""
+    roster = "".join(f"{name}：{des}\n" for name, des in actives)
+    return (info_str + '在场的角色及其性格如下：\n' + roster
+            + "请分别以每个角色为主语写一下他们接下来的言行，每个角色控制在50字以内。要求能够让故事能持续下去，不必完结太快。\n"
+            + "每个角色输出一行，格式为“角色名：言行”，按上面的顺序输出，不要输出其他内容。")
+
+
+def parse_batch_reply(text, names):
+    """从批量回复中解析出 {名字: 言行}；不认识的名字和重复的行被忽略"""
+    wanted = set(names)
+    replies = {}
+    for line in text.splitlines():
+        match = _BATCH_LINE.match(line)
+        if not match:
+            continue
+        name, content = match.group(1), match.group(2)
+        if name in wanted and name not in replies and content:
+            replies[name] = content
+    return replies
+
+
+def _step(npc_agent, name, input_text):
+    """请求一个角色的言行，返回回复消息；响应为空时返回 None"""
+    with tracing.span("npc_step", npc=name) as trace:
+        if trace:
+            trace.set(request_bytes=len(input_text.encode("utf-8")))
+        response = npc_agent.step(input_text)
+
+        if response and response.msgs and len(response.msgs) > 0:
+            message = response.msgs[0]
+            trace.set(output_text=message.content)
+            return message
+        trace.fail("empty response")
+        logger.warning(f"角色 {name} 响应为空")
+        return None
+
+
+def _locked_step(npc_agents, name, input_text, should_stop, timeout):
+    """持有角色的锁，在它自己的 agent 上请求一次并裁剪记忆
+
+    上一回合超时的请求可能仍占着这个角色的锁，最多等待 timeout 秒，拿不到锁则本回合跳过。
+    should_stop 在拿到锁之后、发出请求之前检查。
+    """
+    lock = npc_agents.lock(name)
+    if not lock.acquire(timeout=timeout):
+        logger.warning(f"角色 {name} 的上一次请求仍未结束，本回合跳过")
+        return None
+    try:
+        if should_stop is not None and should_stop():
+            return None
+        npc_agent = npc_agents.get(name)
+        message = _step(npc_agent, name, input_text)
+        trim_memory(npc_agent)
+        return message
+    finally:
+        lock.release()
+
+
+class _NpcCall:
+    """并发模式下一个角色的请求状态"""
+
+    def __init__(self, name, input_text):
+        self.name = name
+        self.input_text = input_text
+        self.future = None
+        self.submitted = None   # 提交到线程池的时间
+        self.message = None
+
+
+def _interact_concurrent(prompts, npc_agents, should_stop, concurrency, timeout):
+    """在全局 NPC 线程池中并发请求各角色，本次调用同时提交的请求不超过 concurrency 个
+
+    每个请求直接在该角色的 agent 上进行（由角色的锁保证同一角色不会同时有两个请求）。
+    超过 timeout 秒未返回的请求被取消（尚未开始的不再运行），已在运行的留在池中
+    自行结束、结果被丢弃，它占用的仍是池里的名额；即使有角色卡住，整回合最多也只
+    等待约 ceil(N / concurrency) 个 timeout。
+    """
+    calls = [_NpcCall(name, input_text) for name, input_text in prompts]
+    queued = deque(calls)
+    running = {}  # future -> _NpcCall
+
+    while queued or running:
+        while queued and len(running) < concurrency:
+            call = queued.popleft()
+            try:
+                call.future = _executor.submit(_locked_step, npc_agents, call.name, call.input_text,
+                                               should_stop, timeout)
+            except RuntimeError as e:
+                # 解释器退出时线程池已关闭
+                logger.error(f"提交角色 {call.name} 的请求失败: {str(e)}")
+                continue
+            call.submitted = time.monotonic()
+            running[call.future] = call
+
+        if not running:
+            break
+        deadline = min(call.submitted for call in running.values()) + timeout
+        done, _ = wait(running, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+        for future in done:
+            call = running.pop(future)
+            try:
+                call.message = future.result()
+            except Exception as char_error:
+                logger.error(f"处理角色 {call.name} 时出错: {str(char_error)}")
+
+        now = time.monotonic()
+        for future, call in list(running.items()):
+            if now - call.submitted >= timeout:
+                future.cancel()
+                del running[future]
+                logger.warning(f"角色 {call.name} 超过 {timeout:.0f} 秒未响应，本回合跳过")
+
+    return [{"role": call.name, "content": call.message.content} for call in calls if call.message is not None]
+
 '''
 character={"小明":"沉稳内敛，不善言辞，但心思细腻，善于观察细节。做事认真负责，一旦决定的事情就会全力以赴，不达目的绝不罢休。平时话不多，但每句话都经过深思熟虑，给人一种可靠的感觉。",
            "小美":"热情开朗，性格外向，善于与人交往，总是能迅速融入新环境。她充满活力，对生活充满热情，喜欢尝试新鲜事物。同时，她也很有同情心，乐于助人，是朋友眼中的“开心果”。",
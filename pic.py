@@ -1,10 +1,10 @@
-import openai
-import requests
 import os
 from datetime import datetime
 from PIL import Image
 import logging
 from dotenv import load_dotenv
+from http_clients import get_openai_client, http_get
+import tracing
 load_dotenv()
 
 # 配置日志
@@ -13,10 +13,8 @@ logger = logging.getLogger(__name__)
 
 # 配置 SiliconFlow API
 try:
-    client = openai.OpenAI(
-        api_key=os.getenv("SILICONFLOW_API_KEY"),
-        base_url='https://api.siliconflow.cn/v1'
-    )
+    # 与聊天模型共享同一个连接池
+    client = get_openai_client()
     logger.info("OpenAI 客户端初始化成功")
 except Exception as e:
     logger.error(f"OpenAI 客户端初始化失败: {str(e)}")
@@ -51,7 +49,7 @@ def resize_image(image_path, max_size=(1024, 1024)):
             
             img.thumbnail(max_size, Image.Resampling.LANCZOS)
             
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
             temp_path = f"temp_resized_{timestamp}.jpg"
             
             img.save(temp_path, "JPEG", quality=85)
@@ -161,30 +159,62 @@ def generate_style_image(prompt, reference_image_path, model="black-forest-labs/
         style_hints = analyze_image_style(reference_image_path)
         
         # 构建详细的风格化提示词
-        style_prompt = f"{prompt}, {style_hints}, highly detailed, masterpiece quality"
+        style_prompt = build_style_prompt(prompt, style_hints)
         
         logger.info(f"风格化提示词: {style_prompt}")
         
         # 生成图像
+        image_url = request_style_image(style_prompt, model=model)
+        
+        # 清理临时文件
+        if os.path.exists(resized_image_path):
+            os.remove(resized_image_path)
+        
+        if not image_url:
+            return None
+        return download_image(image_url)
+            
+    except Exception as e:
+        logger.error(f"生成失败: {str(e)}")
+        return None
+
+def build_style_prompt(prompt, style_hints):
+    """构建详细的风格化提示词"""
+    return f"{prompt}, {style_hints}, highly detailed, masterpiece quality"
+
+def request_style_image(style_prompt, model="black-forest-labs/FLUX.1-dev"):
+    """调用图像生成接口，返回生成图片的URL"""
+    trace = tracing.span("generate_style_image", model=model)
+    try:
+        if trace:
+            trace.set(request_bytes=len(style_prompt.encode("utf-8")))
         response = client.images.generate(
             model=model,
             prompt=style_prompt,
             size="1024x1024",
             n=1,
         )
-        
-        image_url = response.data[0].url
-        image_response = requests.get(image_url, timeout=30)
-        
-        # 清理临时文件
-        if os.path.exists(resized_image_path):
-            os.remove(resized_image_path)
+        return response.data[0].url
+    except Exception as e:
+        logger.error(f"图像生成请求失败: {str(e)}")
+        trace.fail(e)
+        return None
+    finally:
+        trace.finish()
+
+def download_image(image_url, timeout=30):
+    """下载生成的图片并保存到 generated_images 目录"""
+    trace = tracing.span("image_download")
+    try:
+        image_response = http_get(image_url, timeout=timeout)
+        trace.set(status=image_response.status_code, response_bytes=len(image_response.content))
         
         if image_response.status_code == 200:
             if not os.path.exists("generated_images"):
-                os.makedirs("generated_images")
+                os.makedirs("generated_images", exist_ok=True)
             
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            # 精确到微秒，避免并发下载时文件名冲突
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
             filename = f"generated_images/style_{timestamp}.png"
             
             with open(filename, 'wb') as f:
@@ -194,11 +224,14 @@ def generate_style_image(prompt, reference_image_path, model="black-forest-labs/
             return filename
         else:
             logger.error(f"下载失败: {image_response.status_code}")
+            trace.fail(f"HTTP {image_response.status_code}")
             return None
-            
     except Exception as e:
-        logger.error(f"生成失败: {str(e)}")
+        logger.error(f"下载图片失败: {str(e)}")
+        trace.fail(e)
         return None
+    finally:
+        trace.finish()
 
 def main():
     """主函数"""
@@ -243,7 +276,7 @@ def main():
                 )
                 
                 test_url = test_response.data[0].url
-                test_img_response = requests.get(test_url, timeout=30)
+                test_img_response = http_get(test_url, timeout=30)
                 
                 if test_img_response.status_code == 200:
                     if not os.path.exists("generated_images"):
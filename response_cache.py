@@ -0,0 +1,352 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+import logging
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 缓存模式（默认 off：剧情生成每次都应重新请求，否则相同的开局会逐字重放同一段故事；
+# 其余模式只用于开发调试和基准测试）:
+#   off       不使用缓存（默认）
+#   readwrite 命中则直接返回，未命中时请求接口并写入缓存
+#   record    总是请求接口，并用新结果覆盖缓存
+#   replay    严格回放：只读缓存，未命中时报错，用于离线、可重复地运行整局游戏
+MODE_OFF = "off"
+MODE_READWRITE = "readwrite"
+MODE_RECORD = "record"
+MODE_REPLAY = "replay"
+CACHE_MODES = (MODE_OFF, MODE_READWRITE, MODE_RECORD, MODE_REPLAY)
+
+CACHE_MODE = os.getenv("RESPONSE_CACHE_MODE", MODE_OFF)
+CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "response_cache.sqlite3")
+CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 24 * 3600))                  # 秒，0 表示永不过期
+CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024))  # 压缩后的总大小上限
+
+KIND_COMPLETION = "completion"
+KIND_STREAM = "stream"
+
+
+class CacheMissError(Exception):
+    """严格回放模式下请求未命中缓存"""
+
+
+def make_key(params, base_url=""):
+    """按 (接口地址, 模型, 消息, 参数) 计算内容寻址的缓存键
+
+    不同接口即使模型名相同，返回的内容也可能不同，因此接口地址也是键的一部分。
+    """
+    canonical = json.dumps({"base_url": str(base_url), "params": params},
+                           sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """基于 SQLite 的响应缓存，支持 TTL 过期和按总大小的 LRU 淘汰"""
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES, mode=CACHE_MODE):
+        try:
+            if mode not in CACHE_MODES:
+                raise ValueError(f"未知的缓存模式: {mode}")
+            self.path = path
+            self.ttl = ttl
+            self.max_bytes = max_bytes
+            self.mode = mode
+            self._lock = threading.Lock()
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, model TEXT, kind TEXT, payload BLOB,"
+                " size INTEGER, created REAL, last_used REAL, hits INTEGER DEFAULT 0)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses(last_used)")
+            self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            self.hits = 0
+            self.misses = 0
+        except Exception as e:
+            logger.error(f"ResponseCache 初始化失败: {str(e)}")
+            raise
+
+    @property
+    def enabled(self):
+        return self.mode != MODE_OFF
+
+    def get(self, key):
+        """返回 (类型, 数据) 或 None；过期条目会被删除"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT kind, payload, size, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            kind, payload, size, created = row
+            if self.ttl and now - created > self.ttl and self.mode != MODE_REPLAY:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._total_bytes -= size
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE responses SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key)
+            )
+            self.hits += 1
+        return kind, json.loads(zlib.decompress(payload))
+
+    def put(self, key, model, kind, data):
+        if self.mode == MODE_REPLAY:
+            return
+        payload = zlib.compress(json.dumps(data, ensure_ascii=False).encode("utf-8"))
+        now = time.time()
+        try:
+            with self._lock:
+                old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, model, kind, payload, size, created, last_used, hits)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+                    (key, str(model), kind, payload, len(payload), now, now)
+                )
+                self._total_bytes += len(payload) - (old[0] if old else 0)
+                self._evict(now)
+        except sqlite3.Error as e:
+            logger.error(f"写入响应缓存失败: {str(e)}")
+
+    def _evict(self, now):
+        """删除过期条目，再按最近使用时间淘汰直到总大小不超过上限（调用方持有锁）"""
+        if self.ttl:
+            self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+            self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        while self._total_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_used LIMIT 32"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self._total_bytes <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._total_bytes -= size
+
+    def stats(self):
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {"entries": count, "bytes": self._total_bytes, "hits": self.hits, "misses": self.misses,
+                "mode": self.mode}
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._total_bytes = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class _ReplayStream:
+    """按块回放缓存的流式响应（同步）"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return ChatCompletionChunk.model_validate(next(self._chunks))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._chunks = iter(())
+
+
+class _AsyncReplayStream(_ReplayStream):
+    """按块回放缓存的流式响应（异步）"""
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return self.__next__()
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    async def close(self):
+        self._chunks = iter(())
+
+
+class _RecordingStream:
+    """透传流式响应，完整读完后把所有块写入缓存；中途关闭则不写入"""
+
+    def __init__(self, stream, on_complete):
+        self._stream = stream
+        self._iter = iter(stream)
+        self._chunks = []
+        self._on_complete = on_complete
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self._iter)
+        except StopIteration:
+            self._on_complete(self._chunks)
+            raise
+        self._chunks.append(chunk.model_dump(mode="json"))
+        return chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._stream.close()
+
+
+class _AsyncRecordingStream:
+    """_RecordingStream 的异步版本"""
+
+    def __init__(self, stream, on_complete):
+        self._stream = stream
+        self._iter = stream.__aiter__()
+        self._chunks = []
+        self._on_complete = on_complete
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            chunk = await self._iter.__anext__()
+        except StopAsyncIteration:
+            self._on_complete(self._chunks)
+            raise
+        self._chunks.append(chunk.model_dump(mode="json"))
+        return chunk
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        await self._stream.close()
+
+
+class _Proxy:
+    """把未覆盖的属性转发给被包装的对象"""
+
+    def __init__(self, target):
+        self._target = target
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+
+class _CachedCompletions(_Proxy):
+    """chat.completions 的缓存包装"""
+
+    def __init__(self, completions, cache, is_async, base_url=""):
+        super().__init__(completions)
+        self._cache = cache
+        self._is_async = is_async
+        self._base_url = base_url
+
+    def _lookup(self, kwargs):
+        """返回 (缓存键, 回放对象或 None)"""
+        key = make_key(kwargs, self._base_url)
+        if self._cache.mode != MODE_RECORD:
+            cached = self._cache.get(key)
+            if cached is not None:
+                kind, data = cached
+                if kind == KIND_STREAM:
+                    return key, (_AsyncReplayStream if self._is_async else _ReplayStream)(data)
+                return key, ChatCompletion.model_validate(data)
+        if self._cache.mode == MODE_REPLAY:
+            raise CacheMissError(f"回放模式下未找到缓存的响应（模型 {kwargs.get('model')}）")
+        return key, None
+
+    def _store(self, key, kwargs, response):
+        model = kwargs.get("model")
+        if kwargs.get("stream"):
+            stream_class = _AsyncRecordingStream if self._is_async else _RecordingStream
+            return stream_class(response, lambda chunks: self._cache.put(key, model, KIND_STREAM, chunks))
+        self._cache.put(key, model, KIND_COMPLETION, response.model_dump(mode="json"))
+        return response
+
+    def create(self, **kwargs):
+        if self._is_async:
+            return self._acreate(**kwargs)
+        key, replay = self._lookup(kwargs)
+        if replay is not None:
+            return replay
+        return self._store(key, kwargs, self._target.create(**kwargs))
+
+    async def _acreate(self, **kwargs):
+        key, replay = self._lookup(kwargs)
+        if replay is not None:
+            return replay
+        return self._store(key, kwargs, await self._target.create(**kwargs))
+
+
+class CachedClient(_Proxy):
+    """OpenAI / AsyncOpenAI 客户端的缓存包装，只拦截 chat.completions.create"""
+
+    def __init__(self, client, cache, is_async=False):
+        super().__init__(client)
+        self.chat = _Proxy(client.chat)
+        self.chat.completions = _CachedCompletions(client.chat.completions, cache, is_async,
+                                                   base_url=getattr(client, "base_url", ""))
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """全局响应缓存，首次调用时打开数据库；模式为 off 时返回 None"""
+    global _cache
+    if CACHE_MODE == MODE_OFF:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+                logger.info(f"响应缓存已启用（模式 {CACHE_MODE}，{CACHE_PATH}）")
+    return _cache
+
+
+def wrap_client(client, is_async=False):
+    """按全局配置为客户端加上缓存层"""
+    try:
+        cache = get_cache()
+    except Exception as e:
+        logger.error(f"打开响应缓存失败，已跳过缓存: {str(e)}")
+        return client
+    if cache is None:
+        return client
+    return CachedClient(client, cache, is_async=is_async)
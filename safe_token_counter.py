@@ -1,19 +1,213 @@
+import os
+import re
+import sys
+import base64
+import hashlib
+import tempfile
+import logging
+import threading
+from collections import OrderedDict
 from typing import List
 from camel.messages import OpenAIMessage
 from camel.utils import BaseTokenCounter
 
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# cl100k_base 的预分词正则与特殊符号（与 tiktoken_ext.openai_public 一致）
+CL100K_PAT_STR = r"""'(?i:[sdmt]|ll|ve|re)|[^\r\n\p{L}\p{N}]?+\p{L}+|\p{N}{1,3}| ?[^\s\p{L}\p{N}]++[\r\n]*|\s*[\r\n]|\s+(?!\S)|\s+"""
+CL100K_SPECIAL_TOKENS = {
+    "<|endoftext|>": 100257,
+    "<|fim_prefix|>": 100258,
+    "<|fim_middle|>": 100259,
+    "<|fim_suffix|>": 100260,
+    "<|endofprompt|>": 100276,
+}
+
+# OpenAI 聊天格式中每条消息的固定开销，以及回复起始的开销
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+TOKENS_REPLY_PRIMING = 3
+
+DEFAULT_CACHE_SIZE = 4096
+
+# 没有分词文件时的估算：汉字等表意文字按 1 个，英文单词按每 4 个字母 1 个，其余符号各 1 个
+_ESTIMATE_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff]|[A-Za-z]+|\d{1,3}|\S")
+
+
+def _resource_path(relative_path):
+    """兼容 PyInstaller 打包路径"""
+    if hasattr(sys, '_MEIPASS'):
+        return os.path.join(sys._MEIPASS, relative_path)
+    return os.path.abspath(relative_path)
+
+
+CL100K_URL = "https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken"
+# 分词文件只从本地读取，运行时不会下载；可用环境变量 TOKENIZER_FILE 指定路径
+TOKENIZER_FILE = os.getenv("TOKENIZER_FILE")
+
+
+def tiktoken_cache_path(url=CL100K_URL):
+    """tiktoken 自己缓存该文件的位置（TIKTOKEN_CACHE_DIR / DATA_GYM_CACHE_DIR，默认系统临时目录下的 data-gym-cache）"""
+    cache_dir = os.getenv("TIKTOKEN_CACHE_DIR", os.getenv("DATA_GYM_CACHE_DIR"))
+    if cache_dir is None:
+        cache_dir = os.path.join(tempfile.gettempdir(), "data-gym-cache")
+    if not cache_dir:
+        return None
+    return os.path.join(cache_dir, hashlib.sha1(url.encode()).hexdigest())
+
+
+def find_tokenizer_file():
+    """依次查找 TOKENIZER_FILE、tiktoken 的缓存、打包时附带的 tokenizer/cl100k_base.tiktoken，返回存在的路径和所有候选路径"""
+    candidates = [
+        TOKENIZER_FILE,
+        tiktoken_cache_path(),
+        _resource_path(os.path.join("tokenizer", "cl100k_base.tiktoken")),
+    ]
+    candidates = [path for path in candidates if path]
+    for path in candidates:
+        if os.path.exists(path):
+            return path, candidates
+    return None, candidates
+
+
+def load_encoding(path=None):
+    """从本地 .tiktoken 文件构建 cl100k_base 编码，找不到文件或文件损坏时返回 None"""
+    try:
+        import tiktoken
+        if path is None:
+            path, candidates = find_tokenizer_file()
+            if path is None:
+                logger.warning(f"未找到分词文件（已查找 {', '.join(candidates)}），token 数将使用估算值")
+                return None
+        elif not os.path.exists(path):
+            logger.warning(f"未找到分词文件 {path}，token 数将使用估算值")
+            return None
+        with open(path, "rb") as f:
+            mergeable_ranks = {
+                base64.b64decode(token): int(rank)
+                for token, rank in (line.split() for line in f.read().splitlines() if line)
+            }
+        return tiktoken.Encoding(
+            name="cl100k_base",
+            pat_str=CL100K_PAT_STR,
+            mergeable_ranks=mergeable_ranks,
+            special_tokens=CL100K_SPECIAL_TOKENS,
+        )
+    except Exception as e:
+        logger.error(f"加载分词文件失败: {str(e)}")
+        return None
+
+
+def estimate_tokens(text):
+    """没有分词器时的近似 token 数（中文按字计，偏保守）"""
+    count = 0
+    for piece in _ESTIMATE_PATTERN.findall(text):
+        count += (len(piece) + 3) // 4 if piece.isascii() and piece.isalpha() else 1
+    return count
+
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def get_encoding():
+    """全局共享的编码对象，首次调用时加载"""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                _encoding = load_encoding()
+                _encoding_loaded = True
+    return _encoding
+
+
+def _message_text(message):
+    """取出消息中参与计数的文本"""
+    content = message.get("content")
+    if content is None:
+        text = ""
+    elif isinstance(content, str):
+        text = content
+    else:
+        # 多模态消息只统计文本部分
+        text = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    for key in ("tool_calls", "function_call"):
+        if message.get(key):
+            text += str(message[key])
+    return text
+
+
 class SimpleTokenCounter(BaseTokenCounter):
+    """基于 tiktoken（cl100k_base）的 token 计数器
+
+    - 单条消息的计数按 (角色, 名字, 内容) 的哈希缓存在有界 LRU 中；
+    - 对同一个只追加的消息列表重复计数时，只计算新增的消息。
+    """
+
+    def __init__(self, encoding=None, cache_size=DEFAULT_CACHE_SIZE):
+        self.encoding = encoding if encoding is not None else get_encoding()
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # 内容哈希 -> token 数
+        self._lock = threading.Lock()
+        # 上一次计数的 (消息列表, 长度, 末条消息, 合计)，整体替换以保证线程间读到一致的状态
+        self._last = (None, 0, None, 0)
+        self.hits = 0
+        self.misses = 0
+
     def decode(self, token_ids: List[int]) -> str:
-        return ' '.join([str(id) for id in token_ids])
+        if self.encoding is not None:
+            return self.encoding.decode(token_ids)
+        return ''.join(chr(id) for id in token_ids)
 
     def encode(self, text: str) -> List[int]:
+        if self.encoding is not None:
+            return self.encoding.encode(text, disallowed_special=())
         return [ord(char) for char in text]
 
-    def count_tokens_from_messages(self, messages: List[OpenAIMessage]) -> int:
-        total_tokens = 0
-        for message in messages:
-            total_tokens += self.count_tokens(message["content"])
-        return total_tokens
-
     def count_tokens(self, text: str) -> int:
-        return len(text.split())  # 简单按空格分词
\ No newline at end of file
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode_ordinary(text))
+        return estimate_tokens(text)
+
+    def count_message(self, message):
+        """单条消息的 token 数（含消息格式开销），结果会被缓存"""
+        role = message.get("role", "")
+        name = message.get("name") or ""
+        text = _message_text(message)
+        key = hashlib.blake2b(f"{role}\x00{name}\x00{text}".encode("utf-8", "surrogatepass"),
+                              digest_size=16).digest()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return cached
+        tokens = TOKENS_PER_MESSAGE + self.count_tokens(role) + self.count_tokens(text)
+        if name:
+            tokens += TOKENS_PER_NAME + self.count_tokens(name)
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = tokens
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return tokens
+
+    def count_tokens_from_messages(self, messages: List[OpenAIMessage]) -> int:
+        start = 0
+        total = 0
+        last_messages, last_length, last_tail, last_total = self._last
+        # 同一个列表只在尾部追加了消息：沿用上次的合计，只计算新增部分
+        if (messages is last_messages and last_length
+                and len(messages) >= last_length
+                and messages[last_length - 1] is last_tail):
+            start = last_length
+            total = last_total
+        for message in messages[start:]:
+            total += self.count_message(message)
+        self._last = (messages, len(messages), messages[-1] if messages else None, total)
+        return total + TOKENS_REPLY_PRIMING
@@ -0,0 +1,249 @@
+import os
+import json
+import zlib
+import struct
+import logging
+
+from history_store import HistoryStore
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SAVE_DIR = os.getenv("SAVE_DIR", "saves")
+AUTOSAVE_SLOT = "autosave"
+# 每隔多少回合写一次完整快照并清空日志
+SNAPSHOT_EVERY = int(os.getenv("SAVE_SNAPSHOT_EVERY", 50))
+
+# 版本 2 起改用 JSON 编码；版本 1 的 marshal 存档不再读取
+SAVE_VERSION = 2
+_SNAPSHOT_MAGIC = b"AIGS"
+_RECORD_HEADER = struct.Struct("<II")  # 长度、CRC32
+
+
+class SaveError(Exception):
+    """存档损坏或无法读取"""
+
+
+def _encode(data):
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _decode(payload):
+    """解析一段 JSON 数据；内容不是合法的 UTF-8 JSON 时抛出 SaveError"""
+    try:
+        return json.loads(payload.decode("utf-8"))
+    except ValueError as e:
+        raise SaveError(f"存档数据无法解析: {str(e)}") from e
+
+
+class SaveGame:
+    """只追加的回合日志 + 定期快照的存档
+
+    每回合 record_turn 只把自上次保存以来新增的历史事件和变化的角色、对话等
+    追加到 <槽位>.journal；每 SNAPSHOT_EVERY 回合把完整状态写入 <槽位>.snap
+    （先写临时文件再替换）并清空日志。读档时加载快照，再重放其后的日志记录。
+    数据用 JSON 编码（快照再用 zlib 压缩），快照和每条日志记录都带长度和 CRC32，
+    写到一半中断的尾部记录会被忽略。
+    """
+
+    def __init__(self, slot=AUTOSAVE_SLOT, directory=SAVE_DIR, snapshot_every=SNAPSHOT_EVERY):
+        try:
+            self.slot = slot
+            self.directory = directory
+            self.snapshot_every = snapshot_every
+            self.snapshot_path = os.path.join(directory, f"{slot}.snap")
+            self.journal_path = os.path.join(directory, f"{slot}.journal")
+            self._reset_tracking()
+        except Exception as e:
+            logger.error(f"SaveGame 初始化失败: {str(e)}")
+            raise
+
+    def _reset_tracking(self):
+        self.turn = 0
+        self._history_length = 0       # 上次保存时的历史长度与末条事件
+        self._last_event = None
+        self._characters = {}          # 名字 -> 已保存的角色信息
+        self._background = None
+        self._chat_version = None
+        self._last_image_path = None
+        self._since_snapshot = 0
+
+    def exists(self):
+        return os.path.exists(self.snapshot_path)
+
+    # ---------- 写入 ----------
+
+    def start(self, state):
+        """开始新的一局（或读档后继续）：写入完整快照作为日志的起点"""
+        self._write_snapshot(state)
+
+    def record_turn(self, state):
+        """保存一回合；只写入增量，需要时改写完整快照
+
+        state 与 collect_state 的返回值格式相同。
+        """
+        try:
+            self.turn += 1
+            history = state["history"]
+            if (self._history_length > len(history)
+                    or (self._history_length and history[self._history_length - 1] is not self._last_event)
+                    or self._since_snapshot + 1 >= self.snapshot_every):
+                # 历史被替换成了不相关的内容，或到了定期快照的时候
+                self._write_snapshot(state)
+                return
+            record = {"turn": self.turn, "history": self._new_events(history)}
+            changed = {name: info for name, info in state["characters"].items() if self._characters.get(name) != info}
+            if changed:
+                record["characters"] = changed
+            if state["background"] != self._background:
+                record["background"] = state["background"]
+            if state.get("chat_version") != self._chat_version:
+                record["chat"] = state.get("chat")
+            if state.get("last_image_path") != self._last_image_path:
+                record["last_image_path"] = state.get("last_image_path")
+            for key in ("narrative", "options", "new_role"):
+                record[key] = state.get(key)
+            self._append(record)
+            self._mark_saved(state)
+            self._since_snapshot += 1
+        except Exception as e:
+            logger.error(f"自动存档失败: {str(e)}")
+
+    def _new_events(self, history):
+        return [(event["role"], event["content"]) for event in history[self._history_length:]]
+
+    def _mark_saved(self, state):
+        history = state["history"]
+        self._history_length = len(history)
+        self._last_event = history[-1] if len(history) else None
+        for name, info in state["characters"].items():
+            if self._characters.get(name) != info:
+                self._characters[name] = dict(info) if isinstance(info, dict) else info
+        self._background = state["background"]
+        self._chat_version = state.get("chat_version")
+        self._last_image_path = state.get("last_image_path")
+
+    def _append(self, record):
+        payload = _encode(record)
+        with open(self.journal_path, "ab") as f:
+            f.write(_RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+
+    def _write_snapshot(self, state):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            data = {
+                "version": SAVE_VERSION,
+                "turn": self.turn,
+                "background": state["background"],
+                "characters": state["characters"],
+                "history": [(event["role"], event["content"]) for event in state["history"]],
+                "chat": state.get("chat"),
+                "last_image_path": state.get("last_image_path"),
+                "narrative": state.get("narrative"),
+                "options": state.get("options"),
+                "new_role": state.get("new_role"),
+            }
+            payload = zlib.compress(_encode(data), 1)
+            temp_path = self.snapshot_path + ".tmp"
+            with open(temp_path, "wb") as f:
+                f.write(_SNAPSHOT_MAGIC + _RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.snapshot_path)
+            # 快照已包含全部内容，日志从空开始；若在此之前中断，读档时会跳过快照回合之前的记录
+            open(self.journal_path, "wb").close()
+            self._characters = {}
+            self._mark_saved(state)
+            self._since_snapshot = 0
+            logger.info(f"已写入存档快照（第 {self.turn} 回合）")
+        except Exception as e:
+            logger.error(f"写入存档快照失败: {str(e)}")
+
+    # ---------- 读取 ----------
+
+    def load(self):
+        """读取存档，返回与 collect_state 相同格式的状态（history 为 HistoryStore）"""
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                data = f.read()
+        except OSError as e:
+            raise SaveError(f"找不到存档: {self.snapshot_path}") from e
+        if data[:4] != _SNAPSHOT_MAGIC:
+            raise SaveError("存档快照格式错误")
+        length, checksum = _RECORD_HEADER.unpack_from(data, 4)
+        payload = data[4 + _RECORD_HEADER.size:4 + _RECORD_HEADER.size + length]
+        if len(payload) != length or zlib.crc32(payload) != checksum:
+            raise SaveError("存档快照已损坏")
+        try:
+            state = _decode(zlib.decompress(payload))
+        except (zlib.error, SaveError) as e:
+            raise SaveError(f"存档快照无法解析（可能是旧版本的存档）: {str(e)}") from e
+        if not isinstance(state, dict) or state.get("version") != SAVE_VERSION:
+            raise SaveError(f"不支持的存档版本: {state.get('version') if isinstance(state, dict) else None}")
+
+        events = state["history"]
+        replayed = 0
+        for record in self._read_journal():
+            if record["turn"] <= state["turn"]:
+                continue
+            events.extend(record["history"])
+            state["characters"].update(record.get("characters", {}))
+            for key in ("background", "chat", "last_image_path"):
+                if key in record:
+                    state[key] = record[key]
+            for key in ("turn", "narrative", "options", "new_role"):
+                state[key] = record[key]
+            replayed += 1
+
+        history = HistoryStore()
+        history.extend({"role": role, "content": content} for role, content in events)
+        state["history"] = history
+        self._reset_tracking()
+        self.turn = state["turn"]
+        self._since_snapshot = replayed
+        self._mark_saved(state)
+        logger.info(f"已读取存档：第 {state['turn']} 回合，{len(history)} 条历史（重放 {replayed} 条日志）")
+        return state
+
+    def _read_journal(self):
+        """逐条读取日志；遇到不完整或校验失败的尾部记录时截断文件并停止"""
+        try:
+            with open(self.journal_path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return
+        offset = 0
+        while offset + _RECORD_HEADER.size <= len(data):
+            length, checksum = _RECORD_HEADER.unpack_from(data, offset)
+            start = offset + _RECORD_HEADER.size
+            payload = data[start:start + length]
+            if len(payload) != length or zlib.crc32(payload) != checksum:
+                break
+            try:
+                record = _decode(payload)
+            except SaveError as e:
+                logger.error(f"读取存档日志失败: {str(e)}")
+                break
+            yield record
+            offset = start + length
+        if offset < len(data):
+            logger.warning(f"存档日志末尾有 {len(data) - offset} 字节不完整的记录，已丢弃")
+            with open(self.journal_path, "r+b") as f:
+                f.truncate(offset)
+
+
+def collect_state(world_state, narrative=None, options=None, new_role=None, chat=None, chat_version=None,
+                  last_image_path=None):
+    """把游戏各部分的状态整理为存档使用的格式"""
+    return {
+        "background": world_state.get("background", ""),
+        "characters": world_state.get("characters", {}),
+        "history": world_state["history"],
+        "narrative": narrative,
+        "options": list(options) if options else [],
+        "new_role": list(new_role) if new_role else None,
+        "chat": chat,
+        "chat_version": chat_version,
+        "last_image_path": last_image_path,
+    }
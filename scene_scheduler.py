@@ -0,0 +1,240 @@
+import os
+import threading
+import logging
+from collections import deque
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 每回合最多行动的 NPC 数，0 表示不筛选（所有角色都行动）
+NPC_MAX_ACTIVE = int(os.getenv("NPC_MAX_ACTIVE", 3))
+# 最近这么多回合的剧情中出现过的角色，即使本回合没被提到也可以行动
+NPC_RECENT_TURNS = int(os.getenv("NPC_RECENT_TURNS", 3))
+
+# 相关度 = 本回合剧情中被提到的次数 + CHOICE_WEIGHT × 玩家选择中被提到的次数 + 最近出现的加分
+CHOICE_WEIGHT = 2.0
+RECENCY_WEIGHT = 1.0
+
+# 参与"出场"统计的历史事件：剧情叙述和玩家选择（NPC 自己的言行不算，否则行动过的角色会一直被选中）
+SCENE_ROLES = ("系统", "玩家")
+_ALIAS_SEPARATORS = "·•・ "
+# 中文名前可以省略的头衔和职业：去掉最后两个字后以其中之一结尾时，最后两个字作为简称
+NAME_TITLES = (
+    "船长", "舰长", "队长", "村长", "镇长", "城主", "领主", "国王", "女王", "王子", "公主",
+    "骑士", "爵士", "公爵", "伯爵", "男爵", "将军", "星术师", "法师", "术士", "巫师", "祭司",
+    "牧师", "神父", "修女", "医生", "博士", "教授", "老师", "学者", "馆长", "先生", "女士",
+    "小姐", "夫人", "商人", "铁匠", "猎人", "守卫", "卫兵", "水手", "学徒",
+)
+
+
+def aliases_for(name, info=None):
+    """角色的所有称呼：名字本身、角色信息中的 aliases，以及自动生成的简称
+
+    简称规则：外文名按间隔号拆开的各部分；中文名只有在前面是头衔或职业
+    （NAME_TITLES）时才取后面的名字（"船长霍克" -> "霍克"、"见习星术师艾琳" -> "艾琳"）。
+    "神秘商人"、"吟游诗人"、"守卫长" 这类本身就是普通名词的名字不生成简称，
+    否则剧情中的 "商人"、"诗人" 会被当成提到了这个角色；需要时在 aliases 中显式写出。
+    """
+    aliases = {name}
+    if isinstance(info, dict):
+        aliases.update(alias for alias in info.get("aliases", []) if alias)
+    parts = [part for part in _split(name) if len(part) >= 2]
+    if len(parts) > 1:
+        aliases.update(parts)
+    elif len(name) >= 3 and not name.isascii():
+        if name[:-2].endswith(NAME_TITLES):
+            aliases.add(name[-2:])
+    return aliases
+
+
+def _split(name):
+    parts = [name]
+    for separator in _ALIAS_SEPARATORS:
+        parts = [piece for part in parts for piece in part.split(separator)]
+    return parts
+
+
+class NameAutomaton:
+    """角色名和简称的 Aho-Corasick 自动机，一次扫描统计文本中每个角色被提到的次数"""
+
+    def __init__(self, patterns):
+        """patterns 为 {称呼: 角色名}"""
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]  # 状态 -> [(称呼长度, 角色名)]
+        for alias, name in patterns.items():
+            state = 0
+            for char in alias:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = next_state
+            self._output[state].append((len(alias), name))
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def find(self, text):
+        """返回所有匹配 [(起点, 终点, 角色名)]（可能重叠）"""
+        matches = []
+        state = 0
+        goto, fail, output = self._goto, self._fail, self._output
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for length, name in output[state]:
+                matches.append((index + 1 - length, index + 1, name))
+        return matches
+
+    def count(self, text):
+        """{角色名: 被提到的次数}；重叠的匹配只算最靠左、最长的一个（"星术师艾琳"不会再算一次"艾琳"）"""
+        counts = {}
+        end = 0
+        for start, stop, name in sorted(self.find(text), key=lambda match: (match[0], -match[1])):
+            if start < end:
+                continue
+            counts[name] = counts.get(name, 0) + 1
+            end = stop
+        return counts
+
+
+class SceneScheduler:
+    """按与当前场景的相关度挑选本回合行动的 NPC
+
+    相关度由本回合剧情和玩家选择中提到角色的次数（名字与简称的自动机匹配）以及角色
+    最近一次在剧情中出现距今的回合数决定；只有得分大于 0 的角色参与排序，取前
+    max_active 个。每回合行动的 NPC 数因此与登场过的角色总数无关。
+    出场记录从 world_state["history"] 增量更新，读档或开始新游戏时自动重建。
+    一个调度器只跟随一份历史：推测分支用 fork() 得到的副本，提交时用 adopt() 取回副本的状态，
+    不要让同一个调度器在不同的历史之间来回切换（每次切换都会从头重建）。
+    """
+
+    def __init__(self, max_active=NPC_MAX_ACTIVE, recent_turns=NPC_RECENT_TURNS):
+        self.max_active = max_active
+        self.recent_turns = recent_turns
+        self._lock = threading.Lock()
+        self._automaton = None
+        self._automaton_key = None
+        self._reset()
+
+    def fork(self):
+        """状态相同、此后互不影响的副本（自动机构建后不再修改，可以共用）"""
+        with self._lock:
+            copy = SceneScheduler(self.max_active, self.recent_turns)
+            copy._automaton = self._automaton
+            copy._automaton_key = self._automaton_key
+            copy._turn = self._turn
+            copy._last_seen = dict(self._last_seen)
+            copy._synced = self._synced
+            copy._last_event = self._last_event
+            return copy
+
+    def adopt(self, other):
+        """换用 other（通常是被提交的推测分支的副本）的状态"""
+        with other._lock:
+            state = (other._automaton, other._automaton_key, other._turn, dict(other._last_seen),
+                     other._synced, other._last_event)
+        with self._lock:
+            (self._automaton, self._automaton_key, self._turn, self._last_seen,
+             self._synced, self._last_event) = state
+
+    def _reset(self):
+        self._turn = 0              # 已扫描的剧情叙述段数
+        self._last_seen = {}        # 角色名 -> 最近一次出场的回合，None 表示从未在剧情中出现
+        self._synced = 0            # 已扫描的历史事件数
+        self._last_event = None
+
+    def _get_automaton(self, characters):
+        key = tuple((name, tuple(info.get("aliases", ())) if isinstance(info, dict) else ())
+                    for name, info in characters.items())
+        if key != self._automaton_key:
+            owners = {}
+            for name, info in characters.items():
+                for alias in aliases_for(name, info):
+                    owners.setdefault(alias, set()).add(name)
+            patterns = {}
+            for alias, names in owners.items():
+                if alias in names:
+                    patterns[alias] = alias
+                elif len(names) == 1:
+                    patterns[alias] = next(iter(names))
+                # 多个角色共用的简称无法区分，不参与匹配
+            self._automaton = NameAutomaton(patterns)
+            self._automaton_key = key
+        return self._automaton
+
+    def _sync(self, history, characters):
+        """扫描新增的历史事件，更新各角色的出场回合"""
+        if self._synced and (len(history) < self._synced or history[self._synced - 1] is not self._last_event):
+            self._reset()
+        rebuilding = not self._synced
+        automaton = self._get_automaton(characters)
+        for event in history[self._synced:]:
+            role = event.get('role', '')
+            if role not in SCENE_ROLES:
+                continue
+            if role == SCENE_ROLES[0]:
+                self._turn += 1
+            for name in automaton.count(event.get('content', '')):
+                self._last_seen[name] = self._turn
+        self._synced = len(history)
+        self._last_event = history[-1] if len(history) else None
+        # 之后新登场的角色从登场的回合算起；从头扫描历史时无法知道剧情中没提到的角色何时登场
+        for name in characters:
+            self._last_seen.setdefault(name, None if rebuilding else self._turn)
+
+    def scores(self, world_state, choice=""):
+        """返回 [(角色名, 相关度)]，按相关度从高到低排列，只包含相关度大于 0 的角色"""
+        characters = world_state.get('characters', {})
+        history = world_state.get('history', [])
+        with self._lock:
+            self._sync(history, characters)
+            automaton = self._automaton
+            narrative = ""
+            for event in reversed(history):
+                if event.get('role', '') == SCENE_ROLES[0]:
+                    narrative = event.get('content', '')
+                    break
+            in_narrative = automaton.count(narrative)
+            in_choice = automaton.count(choice or "")
+            ranked = []
+            for order, name in enumerate(characters):
+                score = in_narrative.get(name, 0) + CHOICE_WEIGHT * in_choice.get(name, 0)
+                last_seen = self._last_seen.get(name)
+                age = self._turn - last_seen if last_seen is not None else self._turn + self.recent_turns + 1
+                if age <= self.recent_turns:
+                    score += RECENCY_WEIGHT * (self.recent_turns + 1 - age) / (self.recent_turns + 1)
+                if score > 0:
+                    ranked.append((score, age, order, name))
+        # 同分时最近出场的优先，再同则较新登场的优先
+        ranked.sort(key=lambda item: (-item[0], item[1], -item[2]))
+        return [(name, score) for score, _, _, name in ranked]
+
+    def select(self, world_state, choice=""):
+        """本回合行动的角色 {名字: 信息}，保持 world_state["characters"] 中的顺序"""
+        characters = world_state.get('characters', {})
+        if not self.max_active or not characters:
+            return characters
+        try:
+            chosen = {name for name, _ in self.scores(world_state, choice)[:self.max_active]}
+            selected = {name: info for name, info in characters.items() if name in chosen}
+            if len(selected) < len(characters):
+                logger.info(f"本回合行动的角色: {list(selected)}（共 {len(characters)} 个角色）")
+            return selected
+        except Exception as e:
+            logger.error(f"挑选行动角色失败: {str(e)}")
+            return characters
@@ -0,0 +1,206 @@
+import os
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+
+import npc
+from god import NarrativeCancelled, NarrativeFailed
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 通过环境变量 SPECULATION_ENABLED=1 开启；也可以在运行时调用 Speculator.set_enabled
+SPECULATION_ENABLED = os.getenv("SPECULATION_ENABLED", "0") == "1"
+SPECULATION_WORKERS = int(os.getenv("SPECULATION_WORKERS", 3))
+# 每回合最多推测的选项数
+SPECULATION_MAX_BRANCHES = int(os.getenv("SPECULATION_MAX_BRANCHES", 3))
+# 推测执行累计可发起的模型调用次数上限（NPC 每个角色一次、剧情一次），用完后不再推测
+SPECULATION_MAX_CALLS = int(os.getenv("SPECULATION_MAX_CALLS", 60))
+
+
+class Branch:
+    """一个选项的推测分支：在世界状态副本上完成 NPC 反应和下一段剧情"""
+
+    def __init__(self, choice, god, npc_agents, scheduler=None):
+        self.choice = choice
+        self.god = god                # GodAgent 副本
+        self.npc_agents = npc_agents  # 各角色 NPC agent 的副本（带记忆）
+        self.scheduler = scheduler    # 场景调度器副本，跟随分支自己的历史
+        self.cancel_event = threading.Event()
+        self.future = None
+        self.calls = 0                # 本分支用掉的调用次数
+        self.reserved = 0             # 启动时预留、尚未用掉的调用次数
+        self.complete = False         # 是否完整跑完
+
+
+class Speculator:
+    """玩家阅读选项时，为每个选项提前生成下一回合
+
+    start(options) 在有界线程池中为每个选项启动一个分支；commit(choice) 取出
+    对应分支的结果（未完成时等待它），并取消其余分支。推测使用世界状态和
+    NPC agent 的副本，只有被提交的分支才会替换正式的游戏状态。
+    """
+
+    def __init__(self, god, history_fn, enabled=SPECULATION_ENABLED, max_workers=SPECULATION_WORKERS,
+                 max_branches=SPECULATION_MAX_BRANCHES, max_calls=SPECULATION_MAX_CALLS, scheduler=None):
+        """history_fn(world_state) -> str，把世界状态中的历史拼成 NPC 使用的剧情文本
+
+        scheduler 为 SceneScheduler 时只让它挑选的角色行动（每个分支使用它的副本，
+        提交时取回副本的状态），为 None 时所有角色都行动。
+        """
+        try:
+            self.god = god
+            self.history_fn = history_fn
+            self.scheduler = scheduler
+            self.enabled = enabled
+            self.max_branches = max_branches
+            self.max_calls = max_calls
+            self.calls = 0            # 已用掉的推测调用次数
+            self._reserved = 0        # 运行中的分支预留的调用次数
+            self.wasted_calls = 0     # 被取消分支用掉的调用次数
+            self.hits = 0
+            self.misses = 0
+            self._lock = threading.Lock()
+            self._branches = {}
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculation")
+        except Exception as e:
+            logger.error(f"Speculator 初始化失败: {str(e)}")
+            raise
+
+    def set_enabled(self, enabled):
+        self.enabled = bool(enabled)
+        if not self.enabled:
+            self.cancel_all()
+        logger.info(f"推测生成已{'开启' if self.enabled else '关闭'}")
+
+    @property
+    def budget_left(self):
+        return max(0, self.max_calls - self.calls - self._reserved)
+
+    def start(self, options):
+        """为当前显示的选项启动推测分支
+
+        每个分支启动前按本回合行动的 NPC 数 + 1 预留调用次数，预算不足的选项不推测，
+        这样不会出现跑到一半因预算耗尽而作废的分支。
+        """
+        self.cancel_all()
+        if not self.enabled or not options:
+            return
+        for choice in options[:self.max_branches]:
+            cost = len(self._characters(self.scheduler, self.god.world_state, choice)) + 1
+            with self._lock:
+                if self.budget_left < cost:
+                    logger.info("推测生成的调用预算已用完")
+                    break
+                self._reserved += cost
+            try:
+                scheduler = self.scheduler.fork() if self.scheduler is not None else None
+                branch = Branch(choice, self.god.fork(), npc.agents.clone(), scheduler)
+                branch.reserved = cost
+                branch.future = self._executor.submit(self._run, branch)
+                branch.future.add_done_callback(lambda _, done=branch: self._release(done))
+                self._branches[choice] = branch
+            except Exception as e:
+                with self._lock:
+                    self._reserved -= cost
+                logger.error(f"启动推测分支失败: {str(e)}")
+
+    @staticmethod
+    def _characters(scheduler, world_state, choice):
+        if scheduler is None:
+            return world_state.get('characters', {})
+        return scheduler.select(world_state, choice)
+
+    def _take_call(self, branch):
+        """发起一次模型调用前检查是否已取消，并从预留中扣除一次；返回 True 表示应当停止"""
+        with self._lock:
+            # NPC 并发请求时会从多个线程同时调用
+            if branch.cancel_event.is_set() or branch.reserved <= 0:
+                return True
+            branch.reserved -= 1
+            branch.calls += 1
+            self._reserved -= 1
+            self.calls += 1
+        return False
+
+    def _release(self, branch):
+        """分支结束（完成、失败或取消）后归还未用掉的预留"""
+        with self._lock:
+            self._reserved -= branch.reserved
+            branch.reserved = 0
+
+    def _count_waste(self, branch):
+        with self._lock:
+            self.wasted_calls += branch.calls
+
+    def _run(self, branch):
+        world_state = branch.god.world_state
+        history = self.history_fn(world_state) + '玩家做了' + branch.choice + '\n'
+        characters = self._characters(branch.scheduler, world_state, branch.choice)
+        npc_info = npc.interact((characters, history), npc_agents=branch.npc_agents,
+                                should_stop=lambda: self._take_call(branch))
+        if branch.cancel_event.is_set():
+            # 被取消：部分 NPC 没有反应，这个分支不能提交
+            return None
+        branch.god.update_information((branch.choice, npc_info))
+        if self._take_call(branch):
+            return None
+        # 接口出错时抛出 NarrativeFailed，而不是把兜底剧情当作推测结果
+        result = branch.god.generate_narrative_stream(should_stop=branch.cancel_event.is_set, raise_on_error=True)
+        branch.complete = True
+        return npc_info, result
+
+    def commit(self, choice):
+        """返回所选分支的 (npc_info, (剧情, 选项, 新角色))，并把它的状态设为正式状态
+
+        没有对应分支或分支失败时返回 None，由调用方按正常流程生成。
+        """
+        branch = self._branches.pop(choice, None)
+        self.cancel_all()
+        if branch is None:
+            if self.enabled:
+                self.misses += 1
+            return None
+        try:
+            outcome = branch.future.result()
+        except (CancelledError, NarrativeCancelled):
+            outcome = None
+        except NarrativeFailed as e:
+            logger.info(f"推测分支生成剧情失败，改为正常生成: {str(e)}")
+            outcome = None
+        except Exception as e:
+            logger.error(f"推测分支执行失败: {str(e)}")
+            outcome = None
+        if outcome is None or not branch.complete:
+            self.misses += 1
+            return None
+        # 用分支的世界状态和 NPC 记忆替换正式状态
+        self.god.world_state = branch.god.world_state
+        npc.agents = branch.npc_agents
+        if self.scheduler is not None and branch.scheduler is not None:
+            self.scheduler.adopt(branch.scheduler)
+        self.hits += 1
+        logger.info(f"命中推测分支: {choice}（已用调用 {self.calls}/{self.max_calls}）")
+        return outcome
+
+    def cancel_all(self):
+        """取消所有未提交的分支：排队中的直接丢弃，运行中的在下一次检查点停止"""
+        branches, self._branches = self._branches, {}
+        for branch in branches.values():
+            branch.cancel_event.set()
+            if branch.future is not None:
+                branch.future.cancel()
+                # 已完成的分支立即计入，运行中的在停止后计入
+                branch.future.add_done_callback(lambda _, wasted=branch: self._count_waste(wasted))
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "calls": self.calls,
+                "wasted_calls": self.wasted_calls, "max_calls": self.max_calls}
+
+    def shutdown(self):
+        self.cancel_all()
+        try:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        except Exception as e:
+            logger.error(f"关闭推测线程池失败: {str(e)}")
@@ -0,0 +1,236 @@
+import re
+import math
+import heapq
+import bisect
+import threading
+import logging
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 提示词中放入的相关往事条数、相关角色数，以及各部分的字数上限
+MAX_RELATED_EVENTS = 5
+MAX_RELATED_CHARACTERS = 5
+MAX_EVENT_CHARS = 120
+MAX_TRAIT_CHARS = 80
+MAX_OUTLINE_CHARS = 400
+
+# 层级摘要：每 FANOUT 段剧情叙述（或下一层的 FANOUT 条摘要）合并为一条上层摘要
+FANOUT = 8
+MAX_SUMMARY_CHARS = 160
+
+# BM25 参数。为保证检索耗时与历史长度基本无关：查询只使用 idf 最高的若干个词项，
+# 每个词项只扫描最新的若干条倒排记录（常见词项的早期出现对相关性贡献很小）
+BM25_K1 = 1.2
+BM25_B = 0.75
+MAX_QUERY_TERMS = 16
+MAX_POSTINGS_PER_TERM = 64
+
+# GodAgent 写入历史的剧情叙述使用的角色名
+NARRATIVE_ROLE = "系统"
+
+_RUN = re.compile(r"[^\W_]+")
+_CLAUSE_END = re.compile(r"[。！？!?；;\n]")
+
+
+def tokenize(text):
+    """中文按相邻两字切分，英文和数字按整词切分"""
+    tokens = []
+    for run in _RUN.findall(text.lower()):
+        if run.isascii():
+            tokens.append(run)
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def _first_clause(text, limit=40):
+    match = _CLAUSE_END.search(text)
+    clause = text[:match.start()] if match else text
+    return clause.strip()[:limit]
+
+
+def extractive_summary(texts):
+    """摘要模型不可用时的默认方案：取每条的第一句拼接，每条平分字数上限"""
+    limit = max(8, MAX_SUMMARY_CHARS // max(1, len(texts)) - 1)
+    summary = "；".join(clause for clause in (_first_clause(text, limit) for text in texts) if clause)
+    return summary[:MAX_SUMMARY_CHARS]
+
+
+class StoryMemory:
+    """剧情历史的检索索引和层级摘要
+
+    - 事件按字二元组建立倒排索引，用 BM25 检索与当前局面最相关的往事；
+    - 每 FANOUT 段剧情叙述折叠为一条摘要，摘要再逐层折叠，得到长度受限的故事梗概；
+    - sync() 只处理新增的事件，每回合的维护开销与历史总长度无关。
+    """
+
+    def __init__(self, summarizer=None):
+        """summarizer(texts) -> str，把若干条文本合并为一条摘要；为 None 时使用 extractive_summary"""
+        self.summarizer = summarizer or extractive_summary
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self._events = []         # [(角色, 内容)]
+        self._postings = {}       # 词项 -> [(事件序号, 词频)]
+        self._lengths = []        # 每条事件的词项数
+        self._total_length = 0
+        self._levels = [[]]       # 第 0 层为剧情叙述原文，第 n 层为摘要
+        self._rolled = [0]        # 每层已被折叠进上一层的条数
+
+    def __len__(self):
+        return len(self._events)
+
+    def sync(self, history):
+        """把 history（world_state["history"]）中新增的事件加入索引
+
+        history 与已索引的部分不一致（例如开始新游戏或读档）时重建索引。
+        """
+        with self._lock:
+            count = len(self._events)
+            if count and (len(history) < count or not self._same_event(history[count - 1], self._events[-1])):
+                self.clear()
+                count = 0
+            for event in history[count:]:
+                self._add(event.get('role', ''), event.get('content', ''))
+
+    @staticmethod
+    def _same_event(event, indexed):
+        return event.get('role', '') == indexed[0] and event.get('content', '') == indexed[1]
+
+    def _add(self, role, content):
+        doc_id = len(self._events)
+        self._events.append((role, content))
+        tokens = tokenize(f"{role} {content}")
+        frequencies = {}
+        for token in tokens:
+            frequencies[token] = frequencies.get(token, 0) + 1
+        for token, frequency in frequencies.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                self._postings[token] = [(doc_id, frequency)]
+            else:
+                postings.append((doc_id, frequency))
+        self._lengths.append(len(tokens))
+        self._total_length += len(tokens)
+        if role == NARRATIVE_ROLE:
+            # 每回合的剧情叙述已概括了这一回合，梗概只由它们折叠而成；玩家和 NPC 的言行仍可被检索到
+            self._push_summary(0, content)
+
+    def _push_summary(self, level, text):
+        """向第 level 层追加一条，凑满 FANOUT 条未折叠的就合并到上一层"""
+        entries = self._levels[level]
+        entries.append(text)
+        if len(entries) - self._rolled[level] < FANOUT:
+            return
+        batch = entries[self._rolled[level]:]
+        self._rolled[level] = len(entries)
+        try:
+            summary = self.summarizer(batch)
+        except Exception as e:
+            logger.error(f"生成剧情摘要失败: {str(e)}")
+            summary = extractive_summary(batch)
+        if level + 1 == len(self._levels):
+            self._levels.append([])
+            self._rolled.append(0)
+        self._push_summary(level + 1, summary[:MAX_SUMMARY_CHARS])
+
+    def outline(self, max_chars=MAX_OUTLINE_CHARS):
+        """故事梗概：从最高层到第 1 层，依次取每层尚未被折叠的摘要（越靠后越新）"""
+        with self._lock:
+            parts = []
+            for level in range(len(self._levels) - 1, 0, -1):
+                parts.extend(self._levels[level][self._rolled[level]:])
+        # 超出上限时从最旧的一条开始丢弃
+        kept = []
+        used = 0
+        for part in reversed(parts):
+            if used + len(part) > max_chars:
+                break
+            kept.append(part)
+            used += len(part) + 1
+        return "\n".join(reversed(kept))
+
+    def search(self, query, k=MAX_RELATED_EVENTS, exclude_recent=0):
+        """返回与 query 最相关的 k 条事件 [(序号, 角色, 内容)]，按时间顺序排列
+
+        exclude_recent 条最新事件不参与检索（它们已经作为最近事件放进了提示词）。
+        """
+        with self._lock:
+            count = len(self._events) - exclude_recent
+            if count <= 0 or k <= 0:
+                return []
+            terms = set(tokenize(query))
+            if not terms:
+                return []
+            total = len(self._events)
+            average_length = self._total_length / total
+            weighted = []
+            for term in terms:
+                postings = self._postings.get(term)
+                if postings:
+                    df = len(postings)
+                    weighted.append((math.log(1 + (total - df + 0.5) / (df + 0.5)), postings))
+            weighted = heapq.nlargest(MAX_QUERY_TERMS, weighted, key=lambda item: item[0])
+
+            scores = {}
+            lengths = self._lengths
+            norm = BM25_K1 * (1 - BM25_B)
+            scale = BM25_K1 * BM25_B / average_length
+            for idf, postings in weighted:
+                end = bisect.bisect_left(postings, (count,))
+                boost = idf * (BM25_K1 + 1)
+                for doc_id, frequency in postings[max(0, end - MAX_POSTINGS_PER_TERM):end]:
+                    scores[doc_id] = scores.get(doc_id, 0.0) + boost * frequency / (
+                        frequency + norm + scale * lengths[doc_id])
+            best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [(doc_id, *self._events[doc_id]) for doc_id, _ in sorted(best)]
+
+    def related_characters(self, texts, characters, k=MAX_RELATED_CHARACTERS):
+        """按在 texts 中被提到的次数挑选最相关的 k 个角色，返回 [(名字, 信息)]"""
+        if not characters:
+            return []
+        joined = "\n".join(texts)
+        ranked = []
+        for order, (name, info) in enumerate(characters.items()):
+            mentions = joined.count(name)
+            # 没被提到的角色按加入顺序靠后的优先（较新登场）
+            ranked.append((mentions, order, name, info))
+        ranked.sort(reverse=True)
+        return [(name, info) for _, _, name, info in ranked[:k]]
+
+    def context(self, query, characters=None, exclude_recent=0):
+        """构造放入提示词的长期记忆：故事梗概、相关往事、相关角色（各部分长度固定有界）"""
+        # 多取一些候选，去掉内容重复的事件
+        related = []
+        seen = set()
+        for event in self.search(query, k=MAX_RELATED_EVENTS * 2, exclude_recent=exclude_recent):
+            if event[2] not in seen and len(related) < MAX_RELATED_EVENTS:
+                seen.add(event[2])
+                related.append(event)
+        block = ""
+        outline = self.outline()
+        if outline:
+            block += f"### 故事梗概\n{outline}\n\n"
+        if related:
+            block += "### 相关往事\n"
+            for _, role, content in related:
+                block += f"{role}: {_truncate(content, MAX_EVENT_CHARS)}\n"
+            block += "\n"
+        texts = [query] + [content for _, _, content in related]
+        selected = self.related_characters(texts, characters or {})
+        if selected:
+            block += "### 相关角色\n"
+            for name, info in selected:
+                traits = info.get('traits', '') if isinstance(info, dict) else str(info)
+                block += f"{name}: {_truncate(traits, MAX_TRAIT_CHARS)}\n"
+            block += "\n"
+        return block
+
+
+def _truncate(text, max_length):
+    return text if len(text) <= max_length else text[:max_length] + "..."
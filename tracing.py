@@ -0,0 +1,243 @@
+import os
+import json
+import time
+import threading
+import logging
+import logging.handlers
+from collections import deque, defaultdict
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 通过环境变量 TRACE_ENABLED=1 开启；也可以在运行时调用 set_enabled
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "0") == "1"
+TRACE_FILE = os.getenv("TRACE_FILE", os.path.join("traces", "trace.jsonl"))
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", 5 * 1024 * 1024))
+TRACE_BACKUP_COUNT = int(os.getenv("TRACE_BACKUP_COUNT", 3))
+# 每个阶段保留用于统计分位数的最近样本数
+SUMMARY_WINDOW = 1000
+
+_enabled = TRACE_ENABLED
+_lock = threading.Lock()
+_samples = defaultdict(lambda: deque(maxlen=SUMMARY_WINDOW))  # 阶段 -> 最近的 span 记录
+_writer = None
+
+
+def is_enabled():
+    return _enabled
+
+
+def set_enabled(enabled):
+    global _enabled
+    _enabled = bool(enabled)
+    logger.info(f"性能追踪已{'开启' if _enabled else '关闭'}")
+
+
+def _get_writer():
+    """按需创建滚动写入的 JSONL 追踪文件"""
+    global _writer
+    if _writer is None:
+        with _lock:
+            if _writer is None:
+                directory = os.path.dirname(TRACE_FILE)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                handler = logging.handlers.RotatingFileHandler(
+                    TRACE_FILE, maxBytes=TRACE_MAX_BYTES, backupCount=TRACE_BACKUP_COUNT, encoding="utf-8"
+                )
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                writer = logging.getLogger("aigame.trace")
+                writer.setLevel(logging.INFO)
+                writer.propagate = False
+                writer.addHandler(handler)
+                _writer = writer
+    return _writer
+
+
+class Span:
+    """一次阶段调用的计时记录
+
+    用作上下文管理器；流式调用每收到一块调用 chunk()，首块时间即 TTFT。
+    set(output_text=...) 传入完整输出用于统计 token 数和生成速度（不写入记录）。
+    """
+    __slots__ = ("stage", "attrs", "started", "wall_started", "first_chunk", "chunks", "output_chars", "error",
+                 "finished")
+
+    def __init__(self, stage, attrs):
+        self.stage = stage
+        self.attrs = attrs
+        self.started = time.perf_counter()
+        self.wall_started = time.time()
+        self.first_chunk = None
+        self.chunks = 0
+        self.output_chars = 0
+        self.error = None
+        self.finished = False
+
+    def __bool__(self):
+        return True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self.error is None:
+            self.error = "cancelled" if exc_type.__name__ == "CancelledError" else f"{exc_type.__name__}: {exc}"
+        self.finish()
+        return False
+
+    def chunk(self, text=""):
+        if self.first_chunk is None:
+            self.first_chunk = time.perf_counter()
+        self.chunks += 1
+        self.output_chars += len(text)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def fail(self, error):
+        self.error = str(error)
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        duration = time.perf_counter() - self.started
+        record = {
+            "stage": self.stage,
+            "start": round(self.wall_started, 3),
+            "duration_ms": round(duration * 1000, 2),
+            "ttft_ms": None if self.first_chunk is None else round((self.first_chunk - self.started) * 1000, 2),
+            "chunks": self.chunks,
+            "output_chars": self.output_chars,
+        }
+        # output_text 只用于统计，不写入记录
+        text = self.attrs.pop("output_text", None)
+        if text and not self.output_chars:
+            record["output_chars"] = len(text)
+        output_tokens = self.attrs.pop("output_tokens", None)
+        if output_tokens is None and text:
+            output_tokens = _count_tokens(text)
+        if output_tokens:
+            record["output_tokens"] = output_tokens
+            # 生成速度按首块之后的时间计算，不含排队和首包等待
+            generating = time.perf_counter() - (self.first_chunk or self.started)
+            record["tokens_per_s"] = round(output_tokens / generating, 1) if generating > 0 else None
+        record.update(self.attrs)
+        if self.error:
+            record["error"] = self.error
+        _record(record)
+
+
+class _NoopSpan:
+    """追踪关闭时使用的空 span，所有操作都不做任何事"""
+    __slots__ = ()
+
+    def __bool__(self):
+        return False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def chunk(self, text=""):
+        pass
+
+    def set(self, **attrs):
+        pass
+
+    def fail(self, error):
+        pass
+
+    def finish(self):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(stage, **attrs):
+    """开始一个 span；追踪关闭时返回共享的空 span（判断为 False，可用于跳过昂贵的属性计算）"""
+    if not _enabled:
+        return _NOOP_SPAN
+    return Span(stage, attrs)
+
+
+_token_counter = None
+
+
+def _count_tokens(text):
+    global _token_counter
+    try:
+        if _token_counter is None:
+            from safe_token_counter import SimpleTokenCounter
+            _token_counter = SimpleTokenCounter()
+        return _token_counter.count_tokens(text)
+    except Exception:
+        return None
+
+
+def _record(record):
+    with _lock:
+        _samples[record["stage"]].append(record)
+    try:
+        _get_writer().info(json.dumps(record, ensure_ascii=False, default=str))
+    except Exception as e:
+        logger.error(f"写入追踪记录失败: {str(e)}")
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def summary():
+    """各阶段最近样本的统计：次数、错误数、耗时与 TTFT 的 p50/p95、生成速度中位数"""
+    with _lock:
+        snapshot = {stage: list(records) for stage, records in _samples.items()}
+    result = {}
+    for stage, records in snapshot.items():
+        durations = [r["duration_ms"] for r in records]
+        ttfts = [r["ttft_ms"] for r in records if r.get("ttft_ms") is not None]
+        speeds = [r["tokens_per_s"] for r in records if r.get("tokens_per_s")]
+        result[stage] = {
+            "count": len(records),
+            "errors": sum(1 for r in records if r.get("error")),
+            "p50_ms": _percentile(durations, 0.50),
+            "p95_ms": _percentile(durations, 0.95),
+            "ttft_p50_ms": _percentile(ttfts, 0.50),
+            "ttft_p95_ms": _percentile(ttfts, 0.95),
+            "tokens_per_s_p50": _percentile(speeds, 0.50),
+        }
+    return result
+
+
+def format_summary():
+    """用于界面显示的统计文本"""
+    stats = summary()
+    if not stats:
+        return "暂无追踪数据" if _enabled else "性能追踪未开启"
+
+    def fmt(value, unit="ms"):
+        return "-" if value is None else f"{value:.0f}{unit}"
+
+    lines = []
+    for stage, item in sorted(stats.items()):
+        line = (f"{stage}: {item['count']} 次（失败 {item['errors']}）  "
+                f"p50 {fmt(item['p50_ms'])} / p95 {fmt(item['p95_ms'])}")
+        if item["ttft_p50_ms"] is not None:
+            line += f"  首字 p50 {fmt(item['ttft_p50_ms'])} / p95 {fmt(item['ttft_p95_ms'])}"
+        if item["tokens_per_s_p50"] is not None:
+            line += f"  {fmt(item['tokens_per_s_p50'], ' tok/s')}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def reset():
+    with _lock:
+        _samples.clear()